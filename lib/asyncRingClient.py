@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - asyncio Ring API client
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import asyncio
+import functools
+import json
+import threading
+import time
+from udi_interface import LOGGER
+
+# aiohttp is optional: Its C extensions may not build on the eisy. Without it, the calls run on the synchronous session.
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+from lib.retryPolicy import CircuitOpenError
+from lib.deviceSnapshot import DeviceSnapshot
+
+# Raised when the Ring API answers with an HTTP error
+class RingApiError(Exception):
+    def __init__(self, status, text, headers=None):
+        super().__init__(f"HTTP { status }: { text }")
+        self.status = status
+        self.text = text
+        self.headers = headers or {}
+
+'''
+asyncio client for the Ring API, with the same calls as RingInterface.
+It runs on its own event loop thread: Any number of calls can be waiting for Ring without using a thread each.
+
+It shares its state with the RingInterface: Tokens, response cache, rate limiter, retry policy,
+circuit breaker, subscription and metrics.
+
+Callers on other threads submit coroutines and get a concurrent.futures.Future:
+    client.submit(client.floodlightOn(deviceId))
+    client.submit(client.getAllDevices(), callback=lambda devices: ...)
+
+If aiohttp is not installed, the API calls are made by the RingInterface on the loop's default executor:
+The callers still don't wait, but each call waiting for Ring uses a thread.
+'''
+class AsyncRingClient:
+    def __init__(self, ringInterface):
+        self.ring = ringInterface
+        self.loop = None
+        self._thread = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    # The loop thread is started on the first submit
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            if aiohttp is None:
+                LOGGER.warning('aiohttp is not installed: Async Ring calls run on the synchronous session')
+
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run, name='ringAsync', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self, timeout=5):
+        with self._lock:
+            if self._thread is None:
+                return
+
+            try:
+                asyncio.run_coroutine_threadsafe(self._closeSession(), self.loop).result(timeout)
+            except Exception as error:
+                LOGGER.warning(f"Error closing the async Ring session: { error }")
+
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
+            self.loop.close()
+            self._thread = None
+
+    # Run a coroutine on the loop thread. Returns immediately with a concurrent.futures.Future.
+    # If callback is set, it is called with the result. Errors are logged.
+    def submit(self, coroutine, callback=None):
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        future.add_done_callback(lambda done: self._runCallback(done, callback))
+        return future
+
+    def _runCallback(self, future, callback):
+        try:
+            result = future.result()
+
+            if callback is not None:
+                callback(result)
+        except Exception as error:
+            LOGGER.error(f"Async Ring call failed: { error }")
+
+    # Created on the loop, with the same pool size and timeouts as the synchronous session
+    async def _getSession(self):
+        if self._session is None or self._session.closed:
+            httpSession = self.ring.session
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=httpSession.poolSize, keepalive_timeout=httpSession.idleTimeout),
+                timeout=aiohttp.ClientTimeout(sock_connect=httpSession.connectTimeout, sock_read=httpSession.readTimeout)
+            )
+
+        return self._session
+
+    async def _closeSession(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # Same behavior as RingInterface._callApi: Cache, conditional requests, rate limit, retries and circuit breaker
+    # useCache=False: The call always reaches Ring, even if a cached response is available
+    async def _callApi(self, method='GET', url=None, body=None, idempotent=None, decode=None, useCache=True):
+        ring = self.ring
+
+        if aiohttp is None:
+            call = functools.partial(ring._callApi, method=method, url=url, body=body, idempotent=idempotent, decode=decode, useCache=useCache)
+            return await asyncio.get_running_loop().run_in_executor(None, call)
+
+        completeUrl = ring.ringApiBasePath + url
+        cached = ring.responseCache.get(completeUrl) if method == 'GET' and useCache else None
+
+        if ring.responseCache.isFresh(cached):
+            LOGGER.debug('Using cached response for %s %s', method, completeUrl)
+            return cached.data
+
+        LOGGER.info('Making async call to %s %s', method, completeUrl)
+
+        headers = { 'Authorization': await self._getAuthorizationHeader() }
+        headers.update(ring.responseCache.conditionalHeaders(cached))
+
+        try:
+            response, content = await self._sendWithRetry(method, completeUrl, headers, body, idempotent)
+        except RingApiError as error:
+            if error.status == 401:
+                LOGGER.error(f"Call { method } { completeUrl } failed with status code 401. Asking to re-authorize.")
+                ring.poly.Notices['auth'] = 'Please initiate authentication'
+                ring.tokens.invalidate()
+            else:
+                LOGGER.error(f"Call { method } { completeUrl } failed with status { error.status }: { error.text }")
+            raise
+        except CircuitOpenError as error:
+            LOGGER.warning(f"Call { method } { completeUrl } not attempted: { error }")
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            LOGGER.error(f"Request error occurred: { type(error).__name__ } { error }")
+            raise
+
+        if response.status == 304 and cached is not None:
+            LOGGER.info('Call %s %s successful: Not modified', method, completeUrl)
+            ring.responseCache.revalidated(cached, response)
+            return cached.data
+
+        LOGGER.info('Call %s %s successful', method, completeUrl)
+
+        if method != 'GET':
+            ring.responseCache.expireAll()
+            return self._decode(content, decode)
+
+        digest = ring.responseCache.digest(content)
+
+        if cached is not None and cached.digest == digest:
+            ring.responseCache.revalidated(cached, response)
+            return cached.data
+
+        return ring.responseCache.store(completeUrl, response, self._decode(content, decode), digest).data
+
+    # The cached header is read on the loop. Getting a new one may block on a token refresh: It runs on the default executor.
+    async def _getAuthorizationHeader(self):
+        header = self.ring.tokens.getCachedHeader()
+
+        if header is not None:
+            return header
+
+        return await asyncio.get_running_loop().run_in_executor(None, self.ring.tokens.getAuthorizationHeader)
+
+    async def _sendWithRetry(self, method, completeUrl, headers, body, idempotent):
+        ring = self.ring
+        session = await self._getSession()
+        endpoint = ring.getEndpoint(completeUrl)
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            if not ring.circuitBreaker.allow():
+                raise CircuitOpenError('Ring API calls are suspended after repeated failures')
+
+            await self._acquireToken()
+            start = time.perf_counter()
+            retryAfter = None
+
+            try:
+                async with session.request(method, completeUrl, headers=headers, json=body) as response:
+                    content = await response.read()
+
+                ring.recordCall(method, endpoint, response.status, start)
+
+                if response.status < 400:
+                    ring.circuitBreaker.recordSuccess()
+                    return response, content
+
+                error = RingApiError(response.status, content.decode(errors='replace'), response.headers)
+                transient = response.status in ring.retryPolicy.retryStatuses
+                retryAfter = response.headers.get('Retry-After')
+
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as connectionError:
+                # No response, or the connection failed while reading it
+                ring.recordCall(method, endpoint, type(connectionError).__name__, start)
+                error = connectionError
+                transient = True
+
+            except aiohttp.ClientError as clientError:
+                # Invalid response, too many redirects... Not retried, but the call failed: The circuit breaker must know,
+                # or a trial call would leave it half-open.
+                ring.recordCall(method, endpoint, type(clientError).__name__, start)
+
+                if ring.circuitBreaker.recordFailure():
+                    LOGGER.error(f"Ring API calls suspended for { ring.circuitBreaker.resetTimeout }s after repeated failures")
+
+                raise
+
+            if not transient:
+                ring.circuitBreaker.recordSuccess()
+                raise error
+
+            if ring.circuitBreaker.recordFailure():
+                LOGGER.error(f"Ring API calls suspended for { ring.circuitBreaker.resetTimeout }s after repeated failures")
+                raise error
+
+            if attempt >= ring.retryPolicy.maxAttempts or not ring.retryPolicy.isIdempotent(method, idempotent):
+                raise error
+
+            delay = ring.retryPolicy.delay(attempt, retryAfter=retryAfter)
+            LOGGER.warning(f"Call { method } { completeUrl } failed ({ error }), retrying in { round(delay, 1) }s")
+            await asyncio.sleep(delay)
+
+    # Shares the rate limit with the synchronous calls, without blocking the loop
+    async def _acquireToken(self):
+        while True:
+            wait = self.ring.rateLimiter.tryAcquire()
+
+            if wait == 0:
+                return
+
+            await asyncio.sleep(wait)
+
+    # Same as RingInterface._decodeResponse: decode if set, else JSON if possible, else text
+    def _decode(self, content, decode=None):
+        if decode is not None:
+            return decode(content)
+
+        try:
+            return json.loads(content)
+        except ValueError:
+            return content.decode(errors='replace')
+
+    # Checks the access token with Ring: Never answered from the cache
+    async def testApiCall(self):
+        return await self._callApi(url='/user/info', useCache=False)
+
+    async def testWebhook(self, body):
+        if aiohttp is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.ring.testWebhook, body)
+
+        config = self.ring.poly.getConfig()
+        completeUrl = self.ring.getPostbackUrl(config['uuid'], config['profileNum'])
+        session = await self._getSession()
+
+        async with session.post(completeUrl, headers={ 'pragma': self.ring.getCurrentPragma() }, json=body, timeout=aiohttp.ClientTimeout(total=5)) as response:
+            if response.status >= 400:
+                LOGGER.error(f"Call event url failed POST { completeUrl } failed with HTTP { response.status }")
+                raise Exception('Error sending event to Portal webhook')
+
+    async def getAllDevices(self):
+        try:
+            return await self._callApi(url='/devices', decode=DeviceSnapshot.parse)
+        except Exception:
+            return None
+
+    async def getUserInfo(self):
+        try:
+            return await self._callApi(url='/user/info')
+        except Exception:
+            return None
+
+    async def subscribe(self):
+        config = self.ring.poly.getConfig()
+        postbackUrl = self.ring.getPostbackUrl(config['uuid'], config['profileNum'])
+        subscriptions = self.ring.subscriptions
+        pragma = subscriptions.startRenewal()
+
+        LOGGER.info(f"Requesting subscription to { postbackUrl }")
+
+        body = {
+            'subscription': {
+                'postback_url': postbackUrl,
+                'metadata': {
+                    'headers': {
+                        'Pragma': pragma
+                    }
+                }
+            }
+        }
+
+        try:
+            result = await self._callApi(method='PATCH', url='/subscription', body=body, idempotent=True)
+        except Exception:
+            subscriptions.renewalFailed()
+            return None
+
+        subscriptions.renewed(postbackUrl)
+        return result
+
+    async def unsubscribe(self):
+        self.ring.subscriptions.invalidate()
+
+        try:
+            return await self._callApi(method='DELETE', url='/subscription')
+        except Exception:
+            return None
+
+    async def floodlightOn(self, deviceId):
+        try:
+            return await self._callApi(method='PUT', url=f"/devices/{ deviceId }/floodlight_on", idempotent=True)
+        except Exception:
+            return None
+
+    async def floodlightOff(self, deviceId):
+        try:
+            return await self._callApi(method='PUT', url=f"/devices/{ deviceId }/floodlight_off", idempotent=True)
+        except Exception:
+            return None
+
+    # Turn the floodlights of several devices on or off concurrently. Returns { deviceId: True if successful }
+    async def setFloodlights(self, deviceIds, on):
+        call = self.floodlightOn if on else self.floodlightOff
+        results = await asyncio.gather(*[ call(deviceId) for deviceId in deviceIds ])
+
+        return { deviceId: result is not None for deviceId, result in zip(deviceIds, results) }
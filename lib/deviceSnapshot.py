@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Ring devices snapshot
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import json
+
+# State of one Ring device, with only what the nodes use. Built once per fetch of the devices data.
+# category is the array of the payload where the device was found.
+# Battery fields are None when the device does not report them, lightOn is None for devices without lights.
+# New fields are added at the end, so that saved states (toList) remain readable.
+class DeviceState:
+    __slots__ = ( 'id', 'category', 'ownerId', 'kind', 'description', 'online', 'batteryLife', 'batteryLife2', 'batteryVoltage', 'lightOn' )
+
+    def __init__(self, id, category=None, ownerId=None, kind=None, description=None, online=False,
+                 batteryLife=None, batteryLife2=None, batteryVoltage=None, lightOn=None):
+        self.id = id
+        self.category = category
+        self.ownerId = ownerId
+        self.kind = kind
+        self.description = description
+        self.online = online
+        self.batteryLife = batteryLife
+        self.batteryLife2 = batteryLife2
+        self.batteryVoltage = batteryVoltage
+        self.lightOn = lightOn
+
+    # From the data of a device in the /devices payload
+    @classmethod
+    def fromData(cls, data, category=None):
+        owner = data.get('owner') or {}
+        alerts = data.get('alerts') or {}
+        ledStatus = data.get('led_status')
+
+        return cls(
+            data['id'],
+            category,
+            owner.get('id'),
+            data.get('kind'),
+            data.get('description'),
+            alerts.get('connection') == 'online',
+            data.get('battery_life'),
+            data.get('battery_life_2'),
+            data.get('battery_voltage'),
+            None if ledStatus is None else ledStatus == 'on'
+        )
+
+    # Compact form, used to save the state: The fields in __slots__ order
+    def toList(self):
+        return [ getattr(self, name) for name in self.__slots__ ]
+
+    @classmethod
+    def fromList(cls, values):
+        return cls(*values)
+
+    # Battery levels in %, for the batteries which report one
+    def batteryLevels(self):
+        return [ level for level in (self.batteryLife, self.batteryLife2) if level is not None ]
+
+    # Wired devices report no battery data
+    def hasBattery(self):
+        return self.batteryLife is not None or self.batteryLife2 is not None or self.batteryVoltage is not None
+
+    def __repr__(self):
+        return 'DeviceState(' + ', '.join(f"{ name }={ repr(getattr(self, name)) }" for name in self.__slots__) + ')'
+
+# Index of the /devices payload, built once per fetch.
+# Devices are keyed by Ring id, so that nodes can find their state without scanning the whole payload.
+# The payload itself is not kept.
+class DeviceSnapshot:
+    DOORBELLS = 'doorbells'
+    AUTHORIZED_DOORBELLS = 'authorized_doorbells' # Shared doorbells
+    STICKUP_CAMS = 'stickup_cams' # Cameras, including the shared ones
+
+    categories = [ DOORBELLS, AUTHORIZED_DOORBELLS, STICKUP_CAMS ]
+
+    def __init__(self, devices=None):
+        self.byId = {}
+        self.byCategory = { category: [] for category in self.categories }
+
+        for category in self.categories:
+            for data in (devices or {}).get(category) or []:
+                self._add(DeviceState.fromData(data, category))
+
+    def _add(self, state):
+        self.byId[state.id] = state
+        self.byCategory.setdefault(state.category, []).append(state)
+
+    # Keys of the /devices payload used by the node server. Everything else is dropped while parsing.
+    # Nested objects are kept only if their key is listed (owner, alerts), and then only with the listed keys (id, connection).
+    usedKeys = frozenset(categories + [
+        'id', 'kind', 'description', 'owner', 'alerts', 'connection',
+        'battery_life', 'battery_life_2', 'battery_voltage', 'led_status'
+    ])
+
+    # Parse the /devices response into a snapshot, keeping only the used keys.
+    # Each object is filtered as soon as it is decoded: The settings, features and health objects of the devices
+    # are released right away.
+    @classmethod
+    def parse(cls, content):
+        usedKeys = cls.usedKeys
+        return cls(json.loads(content, object_pairs_hook=lambda pairs: { key: value for key, value in pairs if key in usedKeys }))
+
+    # Compact form, used to save the snapshot: One list of fields per device
+    def toList(self):
+        return [ state.toList() for state in self.byId.values() ]
+
+    @classmethod
+    def fromList(cls, rows):
+        snapshot = cls()
+
+        for row in rows:
+            snapshot._add(DeviceState.fromList(row))
+
+        return snapshot
+
+    # Returns the DeviceState of a Ring device id, or None if the device is not in the snapshot
+    def get(self, id):
+        return self.byId.get(id)
+
+    # Returns the list of DeviceState of a category
+    def list(self, category):
+        return self.byCategory[category]
+
+    def __len__(self):
+        return len(self.byId)
+
+    def __contains__(self, id):
+        return id in self.byId
+
+    def __repr__(self):
+        return f"DeviceSnapshot({ list(self.byId.values()) })"
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Event coalescing
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Collapses bursts of events for the same node into one.
+# - An event with a Ring event id that was already seen is a duplicate and is ignored
+# - After an event is accepted for an address, other events for that address are coalesced
+#   (ignored) during window seconds
+# Counts are kept for each address for diagnostics.
+class EventCoalescer:
+    def __init__(self, window=5, maxEventIds=1000):
+        self.window = window
+        self.maxEventIds = maxEventIds
+
+        self._lock = threading.Lock()
+        self._lastAccepted = {}
+        self._eventIds = OrderedDict()
+        self._counts = {}
+
+    # Returns True if the event should be reported
+    def accept(self, address, eventId=None):
+        now = time.monotonic()
+
+        with self._lock:
+            counts = self._counts.get(address)
+            if counts is None:
+                counts = self._counts[address] = { 'received': 0, 'accepted': 0, 'coalesced': 0, 'duplicates': 0 }
+
+            counts['received'] += 1
+
+            if eventId is not None:
+                if eventId in self._eventIds:
+                    counts['duplicates'] += 1
+                    return False
+
+                self._eventIds[eventId] = True
+                if len(self._eventIds) > self.maxEventIds:
+                    self._eventIds.popitem(last=False)
+
+            lastAccepted = self._lastAccepted.get(address)
+
+            if lastAccepted is not None and now - lastAccepted < self.window:
+                counts['coalesced'] += 1
+                return False
+
+            self._lastAccepted[address] = now
+            counts['accepted'] += 1
+            return True
+
+    # Returns the counts for an address, or for all addresses
+    def getStats(self, address=None):
+        with self._lock:
+            if address is not None:
+                return dict(self._counts.get(address, {}))
+
+            return { address: dict(counts) for address, counts in self._counts.items() }
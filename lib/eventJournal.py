@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Ring events journal
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import csv
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime
+from udi_interface import LOGGER
+
+JournalEvent = namedtuple('JournalEvent', [ 'timestamp', 'deviceId', 'event', 'eventId', 'latency', 'outcome' ])
+
+# Recent events of one device, in fixed-size arrays used as a ring buffer: The oldest event is overwritten.
+class DeviceEvents:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', [ 0 ]) * capacity
+        self.eventCodes = array('B', [ 0 ]) * capacity
+        self.eventIds = array('Q', [ 0 ]) * capacity
+        self.latencies = array('f', [ 0 ]) * capacity
+        self.outcomeCodes = array('B', [ 0 ]) * capacity
+        self.next = 0
+        self.count = 0
+
+    def add(self, timestamp, eventCode, eventId, latency, outcomeCode):
+        index = self.next
+        self.timestamps[index] = timestamp
+        self.eventCodes[index] = eventCode
+        self.eventIds[index] = eventId
+        self.latencies[index] = latency
+        self.outcomeCodes[index] = outcomeCode
+
+        self.next = (index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    # Positions in the arrays, from the oldest event to the newest
+    def indexes(self):
+        start = self.next - self.count
+        return [ (start + offset) % self.capacity for offset in range(self.count) ]
+
+'''
+Journal of the Ring events processed, by device.
+
+The last events of each device are kept in memory (DeviceEvents). They are also appended to a binary file,
+in batches, which is rotated when it reaches maxFileBytes:
+    logs/events.bin, logs/events.bin.1, logs/events.bin.2 (oldest)
+Each file starts with a header (magic), followed by fixed-size records (recordFormat).
+
+The files are in the logs directory: They are included in the log package downloaded from PG3.
+'''
+class EventJournal:
+    # Events and outcomes are saved as their index in these lists. Unknown events are saved as unknownEvent.
+    events = [ 'new-ding', 'new-motion', 'webhook-test' ]
+    outcomes = [ 'sent', 'coalesced' ]
+    unknownEvent = 255
+
+    # Timestamp, Ring device id, Ring event id (0 if none), event, outcome, processing latency in ms
+    recordFormat = struct.Struct('<dQQBBf')
+    magic = b'RGEJ\x01'
+
+    # Events kept in memory for each device
+    defaultCapacity = 100
+
+    # Records are written to the file when this many are waiting, and on flush() (Long poll and stop)
+    flushRecords = 32
+
+    # The file is rotated when it reaches maxFileBytes. backupCount older files are kept (At least 1).
+    maxFileBytes = 1024 * 1024
+    backupCount = 2
+
+    def __init__(self, path='logs/events.bin', capacity=defaultCapacity):
+        self.path = path
+        self.capacity = capacity
+        self.devices = {}
+        self.pending = bytearray()
+        self.pendingCount = 0
+        self.written = 0
+
+        self._eventCodes = { event: code for code, event in enumerate(self.events) }
+        self._outcomeCodes = { outcome: code for code, outcome in enumerate(self.outcomes) }
+
+        # lock protects the memory state. writeLock keeps the batches in order in the file.
+        self.lock = threading.Lock()
+        self.writeLock = threading.Lock()
+
+    # Add an event of a device. timestamp is the time the event was received (time.time()).
+    def add(self, deviceId, event, eventId, latency, outcome='sent', timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        eventCode = self._eventCodes.get(event, self.unknownEvent)
+        outcomeCode = self._outcomeCodes[outcome]
+        eventId = self._toEventId(eventId)
+
+        with self.lock:
+            device = self.devices.get(deviceId)
+
+            if device is None:
+                device = self.devices[deviceId] = DeviceEvents(self.capacity)
+
+            device.add(timestamp, eventCode, eventId, latency, outcomeCode)
+            self.pending += self.recordFormat.pack(timestamp, deviceId, eventId, eventCode, outcomeCode, latency)
+            self.pendingCount += 1
+            flush = self.pendingCount >= self.flushRecords
+
+        if flush:
+            self.flush()
+
+    # Ring event ids are numbers. Anything else is saved as 0.
+    def _toEventId(self, eventId):
+        try:
+            eventId = int(eventId)
+        except (TypeError, ValueError):
+            return 0
+
+        return eventId if 0 <= eventId < 2 ** 64 else 0
+
+    def _toEvent(self, timestamp, deviceId, eventCode, eventId, latency, outcomeCode):
+        event = self.events[eventCode] if eventCode < len(self.events) else 'unknown'
+        outcome = self.outcomes[outcomeCode] if outcomeCode < len(self.outcomes) else 'unknown'
+        return JournalEvent(timestamp, deviceId, event, eventId or None, round(latency, 3), outcome)
+
+    # Recent events kept in memory, oldest first, as JournalEvent
+    # deviceId: Events of this device only. since: Events received after this time.time(). limit: The most recent ones only.
+    def query(self, deviceId=None, since=None, limit=None):
+        events = []
+
+        with self.lock:
+            if deviceId is None:
+                devices = self.devices.items()
+            else:
+                devices = [ (deviceId, self.devices[deviceId]) ] if deviceId in self.devices else []
+
+            for id, device in devices:
+                for index in device.indexes():
+                    if since is None or device.timestamps[index] > since:
+                        events.append(self._toEvent(device.timestamps[index], id, device.eventCodes[index], device.eventIds[index],
+                                                    device.latencies[index], device.outcomeCodes[index]))
+
+        events.sort(key=lambda event: event.timestamp)
+        return events[-limit:] if limit else events
+
+    # Write the waiting records to the file. Returns the number of records written.
+    def flush(self):
+        with self.writeLock:
+            with self.lock:
+                data, self.pending = bytes(self.pending), bytearray()
+                count, self.pendingCount = self.pendingCount, 0
+
+            if not data:
+                return 0
+
+            try:
+                directory = os.path.dirname(self.path)
+
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+
+                self._rotate(len(data))
+
+                with open(self.path, 'ab') as file:
+                    if file.tell() == 0:
+                        file.write(self.magic)
+
+                    file.write(data)
+            except OSError as error:
+                LOGGER.error(f"Unable to write { count } events to { self.path }: { error }")
+                return 0
+
+            self.written += count
+            return count
+
+    # Must be called with writeLock acquired
+    def _rotate(self, size):
+        try:
+            if os.path.getsize(self.path) + size <= self.maxFileBytes:
+                return
+        except FileNotFoundError:
+            return
+
+        LOGGER.info(f"Rotating events journal { self.path }")
+
+        for number in range(self.backupCount - 1, 0, -1):
+            if os.path.exists(f"{ self.path }.{ number }"):
+                os.replace(f"{ self.path }.{ number }", f"{ self.path }.{ number + 1 }")
+
+        os.replace(self.path, f"{ self.path }.1")
+
+    # Events saved in the files, oldest first, as JournalEvent. Records which were not flushed yet are not included.
+    def readFiles(self):
+        paths = [ f"{ self.path }.{ number }" for number in range(self.backupCount, 0, -1) ] + [ self.path ]
+
+        for path in paths:
+            try:
+                with open(path, 'rb') as file:
+                    data = file.read()
+            except FileNotFoundError:
+                continue
+
+            if not data.startswith(self.magic):
+                LOGGER.warning(f"Events journal { path } has an unknown format: Ignored")
+                continue
+
+            # An incomplete record at the end (Interrupted write) is ignored
+            body = memoryview(data)[len(self.magic):]
+            body = body[:len(body) - len(body) % self.recordFormat.size]
+
+            for timestamp, deviceId, eventId, eventCode, outcomeCode, latency in self.recordFormat.iter_unpack(body):
+                yield self._toEvent(timestamp, deviceId, eventCode, eventId, latency, outcomeCode)
+
+    # Export the events saved in the files to a CSV file. names: { deviceId: name }, added to each line.
+    # Returns the number of events exported.
+    def export(self, path, names=None, deviceId=None, since=None):
+        self.flush()
+        names = names or {}
+        count = 0
+
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow([ 'time', 'device id', 'device', 'event', 'event id', 'latency ms', 'outcome' ])
+
+            for event in self.readFiles():
+                if (deviceId is not None and event.deviceId != deviceId) or (since is not None and event.timestamp <= since):
+                    continue
+
+                writer.writerow([ datetime.fromtimestamp(event.timestamp).isoformat(timespec='milliseconds'), event.deviceId,
+                                  names.get(event.deviceId, ''), event.event, event.eventId or '', event.latency, event.outcome ])
+                count += 1
+
+        return count
+
+    def getStats(self):
+        with self.lock:
+            return {
+                'devices': len(self.devices),
+                'inMemory': sum(device.count for device in self.devices.values()),
+                'pending': self.pendingCount,
+                'written': self.written
+            }
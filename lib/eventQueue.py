@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Event ingestion queue
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import queue
+import threading
+import time
+from udi_interface import LOGGER
+
+_stop = object()
+
+# Bounded queue dispatching events to a small pool of worker threads.
+# Events with the same key (Ring device id) are always handled by the same worker, so
+# that events of a device are processed in arrival order.
+# When the queue of a worker is full, the overflow policy decides which event is dropped.
+class EventQueue:
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+    overflowPolicies = [ DROP_OLDEST, DROP_NEWEST ]
+
+    # onDrop, if set, is called each time an event is dropped
+    def __init__(self, handler, workers=2, maxSize=100, overflow=DROP_OLDEST, name='events', onDrop=None):
+        self.handler = handler
+        self.onDrop = onDrop
+        self.workers = workers
+        self.maxSize = maxSize
+        self.overflow = overflow
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._queues = []
+        self._threads = []
+
+        # Events received before start(): [ (key, event) ]. The queues are created by start(), with the configured settings.
+        self._early = []
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.highWater = 0
+        # Events queued to a worker or being processed
+        self._pending = 0
+
+    # Settings can be changed until the queue is started. After that, only the overflow policy can change.
+    def configure(self, workers=None, maxSize=None, overflow=None):
+        with self._lock:
+            if overflow is not None:
+                if overflow in self.overflowPolicies:
+                    self.overflow = overflow
+                else:
+                    LOGGER.warning(f"Invalid overflow policy { overflow } for { self.name } queue, using { self.overflow }")
+
+            if self._threads:
+                return
+
+            if workers is not None:
+                self.workers = workers
+            if maxSize is not None:
+                self.maxSize = maxSize
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+
+            self._createQueues()
+
+            early, self._early = self._early, []
+
+            for key, event in early:
+                self._put(key, event)
+
+            for index, workerQueue in enumerate(self._queues):
+                thread = threading.Thread(target=self._work, args=(workerQueue,), name=f"{ self.name }Worker{ index }", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+        LOGGER.info(f"{ self.name } queue started with { self.workers } workers, max size { self.maxSize }, overflow { self.overflow }")
+
+    # Must be called with the lock acquired
+    def _createQueues(self):
+        # Each worker gets its share of the total size
+        workerSize = max(1, -(-self.maxSize // self.workers))
+        self._queues = [ queue.Queue(workerSize) for _ in range(self.workers) ]
+
+    def stop(self):
+        with self._lock:
+            for workerQueue in self._queues:
+                # Make room for the stop marker if needed. Pending events are lost anyway.
+                try:
+                    workerQueue.put_nowait(_stop)
+                except queue.Full:
+                    if workerQueue.get_nowait() is not _stop:
+                        self._pending -= 1
+                    workerQueue.put_nowait(_stop)
+
+            self._threads = []
+
+    # Queue an event. Returns immediately. Returns False if the event was dropped.
+    def submit(self, key, event):
+        with self._lock:
+            self.received += 1
+
+            # Events received before start() are kept until the workers are started
+            if not self._queues:
+                accepted = True
+
+                if len(self._early) >= self.maxSize:
+                    accepted = self._dropped()
+
+                    if accepted:
+                        self._early.pop(0)
+
+                if accepted:
+                    self._early.append((key, event))
+            else:
+                accepted = self._put(key, event)
+
+            self.highWater = max(self.highWater, self._depth())
+
+        return accepted
+
+    # Must be called with the lock acquired. Returns False if the event was dropped.
+    def _put(self, key, event):
+        workerQueue = self._queues[hash(key) % len(self._queues)]
+
+        try:
+            workerQueue.put_nowait(event)
+            self._pending += 1
+            return True
+        except queue.Full:
+            pass
+
+        if not self._dropped():
+            return False
+
+        try:
+            workerQueue.get_nowait()
+            self._pending -= 1
+        except queue.Empty:
+            pass
+
+        workerQueue.put_nowait(event)
+        self._pending += 1
+        return True
+
+    # Must be called with the lock acquired. The queue is full: Count the dropped event.
+    # Returns True if the new event is kept (The oldest is dropped), False if it is the one dropped.
+    def _dropped(self):
+        self.dropped += 1
+
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            LOGGER.warning(f"{ self.name } queue is full: { self.dropped } events dropped so far ({ self.overflow })")
+
+        if self.onDrop is not None:
+            self.onDrop()
+
+        return self.overflow != self.DROP_NEWEST
+
+    # Must be called with the lock acquired
+    def _depth(self):
+        return sum(workerQueue.qsize() for workerQueue in self._queues) + len(self._early)
+
+    def getStats(self):
+        with self._lock:
+            return {
+                'received': self.received,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'depth': self._depth(),
+                'highWater': self.highWater
+            }
+
+    # Wait until all queued events are processed. Returns False on timeout.
+    def waitIdle(self, timeout=10):
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            with self._lock:
+                # Counted until processed: An event taken by a worker is no longer in its queue
+                if not self._early and self._pending == 0:
+                    return True
+            time.sleep(0.005)
+
+        return False
+
+    def _work(self, workerQueue):
+        while True:
+            event = workerQueue.get()
+
+            if event is _stop:
+                return
+
+            try:
+                self.handler(event)
+            except Exception:
+                LOGGER.exception(f"Error processing event from { self.name } queue")
+                with self._lock:
+                    self.failed += 1
+
+            with self._lock:
+                self.processed += 1
+                self._pending -= 1
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Persistent HTTP session
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from udi_interface import LOGGER
+
+# Connection-pooled, keep-alive HTTP session shared by all the Ring API calls.
+# Connections are kept open between calls so that polls and commands don't pay a DNS lookup
+# and a TCP+TLS handshake every time. Idle connections are closed by a reaper thread, as the
+# server (or a NAT on the way) usually drops them silently after a while.
+class HttpSession:
+    defaultPoolSize = 10
+    defaultConnectTimeout = 5
+    defaultReadTimeout = 30
+    defaultIdleTimeout = 60
+
+    def __init__(self, poolSize=defaultPoolSize, connectTimeout=defaultConnectTimeout,
+                 readTimeout=defaultReadTimeout, idleTimeout=defaultIdleTimeout):
+        self.poolSize = poolSize
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.idleTimeout = idleTimeout
+
+        self._lock = threading.Lock()
+        self._activeRequests = 0
+        self._lastUsed = 0
+        self._poolsOpen = False
+        self._stopEvent = threading.Event()
+        self._reaper = None
+
+        self._session = requests.Session()
+        self._mountAdapters()
+
+    def _mountAdapters(self):
+        # pool_connections is the number of hosts we keep pools for, pool_maxsize the connections per host
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.poolSize)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    # Apply new settings (From custom params). Pools are recreated only if the pool size changed.
+    def configure(self, poolSize=None, connectTimeout=None, readTimeout=None, idleTimeout=None):
+        with self._lock:
+            if connectTimeout is not None:
+                self.connectTimeout = connectTimeout
+            if readTimeout is not None:
+                self.readTimeout = readTimeout
+            if idleTimeout is not None:
+                self.idleTimeout = idleTimeout
+
+            if poolSize is not None and poolSize != self.poolSize:
+                self.poolSize = poolSize
+                self._closePools()
+                self._mountAdapters()
+
+        LOGGER.info(f"HTTP session: pool size { self.poolSize }, timeouts { self.connectTimeout }s/{ self.readTimeout }s, idle { self.idleTimeout }s")
+
+    # Same as requests.request, using the pooled connections and the default timeouts
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (self.connectTimeout, self.readTimeout))
+
+        with self._lock:
+            self._activeRequests += 1
+            self._poolsOpen = True
+            self._startReaper()
+
+        try:
+            return self._session.request(method, url, **kwargs)
+        finally:
+            with self._lock:
+                self._activeRequests -= 1
+                self._lastUsed = time.monotonic()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    # Stop the reaper and close all connections
+    def close(self):
+        self._stopEvent.set()
+        with self._lock:
+            self._closePools()
+
+    # Must be called with the lock acquired
+    def _closePools(self):
+        for adapter in self._session.adapters.values():
+            adapter.close()
+        self._poolsOpen = False
+
+    # Must be called with the lock acquired
+    def _startReaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+
+        self._stopEvent.clear()
+        self._reaper = threading.Thread(target=self._reap, name='httpSessionReaper', daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        while not self._stopEvent.wait(max(self.idleTimeout / 2, 1)):
+            with self._lock:
+                idle = time.monotonic() - self._lastUsed
+
+                if self._poolsOpen and self._activeRequests == 0 and idle >= self.idleTimeout:
+                    LOGGER.debug(f"HTTP session: closing connections idle for { int(idle) }s")
+                    self._closePools()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Logging helpers
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+
+# Values of these keys are never logged (Compared in lower case)
+redactedKeys = { 'access_token', 'refresh_token', 'id_token', 'token', 'client_secret', 'authorization', 'pragma' }
+
+redactedValue = '********'
+
+# Large payloads are cut to this many characters, and lists to this many items
+defaultMaxLength = 2000
+defaultMaxItems = 10
+
+# Copy of a value with secrets replaced and long lists sampled
+def sanitize(value, maxItems=defaultMaxItems):
+    if isinstance(value, dict):
+        return { key: redactedValue if str(key).lower() in redactedKeys else sanitize(item, maxItems) for key, item in value.items() }
+
+    if isinstance(value, (list, tuple)):
+        items = [ sanitize(item, maxItems) for item in value[:maxItems] ]
+
+        if maxItems is not None and len(value) > maxItems:
+            items.append(f"... { len(value) - maxItems } more")
+
+        return items
+
+    return value
+
+def truncate(text, maxLength=defaultMaxLength):
+    if maxLength is None or len(text) <= maxLength:
+        return text
+
+    return f"{ text[:maxLength] }... ({ len(text) - maxLength } more characters)"
+
+# Log argument formatted only if the message is actually logged:
+#   LOGGER.debug('Devices: %s', LazyRepr(devices))
+# Secrets are redacted, long lists are sampled and the result is truncated.
+class LazyRepr:
+    __slots__ = ('value', 'maxLength', 'maxItems')
+
+    def __init__(self, value, maxLength=defaultMaxLength, maxItems=defaultMaxItems):
+        self.value = value
+        self.maxLength = maxLength
+        self.maxItems = maxItems
+
+    def __str__(self):
+        return truncate(str(sanitize(self.value, self.maxItems)), self.maxLength)
+
+    __repr__ = __str__
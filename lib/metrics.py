@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - In-process metrics
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import threading
+import time
+from collections import deque
+
+# Latency histogram with fixed buckets (Upper bounds in ms)
+class Histogram:
+    buckets = [ 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf') ]
+
+    def __init__(self):
+        self.counts = [ 0 ] * len(self.buckets)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.last = None
+
+    def observe(self, ms):
+        index = next(i for i, bound in enumerate(self.buckets) if ms <= bound)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.last = ms
+
+    # Upper bound of the bucket containing the percentile (Never more than the max observed)
+    def percentile(self, percent):
+        if self.count == 0:
+            return None
+
+        target = self.count * percent / 100
+        seen = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return round(min(bound, self.max), 1)
+
+        return round(self.max, 1)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 1) if self.count else None,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': round(self.max, 1),
+            'last': round(self.last, 1) if self.last is not None else None
+        }
+
+# Counters, latency histograms and sliding-window rates, shared by the whole node server.
+# Names are free-form. Labels are appended to the name: 'api.calls GET /devices 200'
+class Metrics:
+    # Rates are computed on this window
+    windowSeconds = 900
+    maxWindowEvents = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self._windows = {}
+
+    def _key(self, name, labels):
+        return ' '.join([ name ] + [ str(label) for label in labels ])
+
+    def increment(self, name, *labels, amount=1):
+        key = self._key(name, labels)
+        now = time.monotonic()
+
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+            # Also count by name only, in a sliding window for the rates
+            window = self._windows.get(name)
+            if window is None:
+                window = self._windows[name] = deque(maxlen=self.maxWindowEvents)
+
+            for _ in range(amount):
+                window.append(now)
+
+    def observe(self, name, ms, *labels):
+        key = self._key(name, labels)
+
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+
+            histogram.observe(ms)
+
+    # Context manager to time a block: with metrics.timer('poll.duration'): ...
+    def timer(self, name, *labels):
+        return _Timer(self, name, labels)
+
+    # Number of increments of a counter (All labels) in the last seconds
+    def countSince(self, name, seconds):
+        limit = time.monotonic() - seconds
+
+        with self._lock:
+            window = self._windows.get(name)
+            return sum(1 for timestamp in window if timestamp >= limit) if window else 0
+
+    def ratePerMinute(self, name, seconds=300):
+        return self.countSince(name, seconds) * 60 / seconds
+
+    def getHistogram(self, name, *labels):
+        with self._lock:
+            return self.histograms.get(self._key(name, labels))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'latencies': { key: histogram.summary() for key, histogram in self.histograms.items() }
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self._windows.clear()
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.ms = (time.perf_counter() - self.start) * 1000
+        self.metrics.observe(self.name, self.ms, *self.labels)
+
+# Shared instance
+metrics = Metrics()
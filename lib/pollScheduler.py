@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Adaptive poll scheduler
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import threading
+import time
+
+# Decides when the devices data needs to be refreshed.
+# Each device gets its own refresh interval based on its last data:
+# - Offline devices are checked often, to detect when they are back
+# - Devices with a low battery are checked more often than those with a good battery
+# - Wired devices (No battery data) only need their connectivity state refreshed
+# Short polls fetch /devices only when at least one device is due.
+class PollScheduler:
+    offlineInterval = 60
+    lowBatteryInterval = 120
+    batteryInterval = 300
+    wiredInterval = 300
+
+    # Battery level (%) under which a battery is considered low
+    lowBatteryLevel = 20
+
+    # offset: Seconds added to the first schedule. The later ones keep the same phase.
+    # Used to spread the polls of several Ring accounts over time.
+    def __init__(self, offset=0):
+        self.offset = offset
+        self._lock = threading.Lock()
+        self._nextDue = {}
+        self._online = {}
+
+    # Refresh interval in seconds for a DeviceState
+    def intervalFor(self, state):
+        if not state.online:
+            return self.offlineInterval
+
+        if not state.hasBattery():
+            return self.wiredInterval
+
+        levels = state.batteryLevels()
+
+        try:
+            if levels and min(float(level) for level in levels) <= self.lowBatteryLevel:
+                return self.lowBatteryInterval
+        except (TypeError, ValueError):
+            pass
+
+        return self.batteryInterval
+
+    # Reschedule all devices after a fetch of the devices data
+    # Returns the list of device ids which went offline since the previous fetch
+    def update(self, snapshot):
+        now = time.monotonic()
+        wentOffline = []
+
+        with self._lock:
+            shift = self.offset if not self._nextDue else 0
+            nextDue = {}
+            online = {}
+
+            for state in snapshot.byId.values():
+                if not state.online and self._online.get(state.id, False):
+                    wentOffline.append(state.id)
+
+                online[state.id] = state.online
+                nextDue[state.id] = now + self.intervalFor(state) + shift
+
+            self._nextDue = nextDue
+            self._online = online
+
+        return wentOffline
+
+    # True if the devices data should be fetched. Always True until we have fetched it once.
+    def isDue(self):
+        with self._lock:
+            return not self._nextDue or time.monotonic() >= min(self._nextDue.values())
+
+    # Seconds until the next device is due
+    def secondsUntilDue(self):
+        with self._lock:
+            if not self._nextDue:
+                return 0
+
+            return max(0, min(self._nextDue.values()) - time.monotonic())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Ring API response cache
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import hashlib
+import threading
+import time
+
+# A cached GET response
+class CacheEntry:
+    def __init__(self, data, digest, etag=None, lastModified=None):
+        self.data = data
+        self.digest = digest
+        self.etag = etag
+        self.lastModified = lastModified
+        self.fetchedAt = time.monotonic()
+
+# Cache for the GET endpoints of the Ring API
+# - Responses younger than ttl seconds are returned without calling the API
+# - Older responses are revalidated with If-None-Match / If-Modified-Since, if the server gave us an ETag or Last-Modified
+# - If the server returns the full payload anyway, its hash is compared with the cached one.
+#   If the payload is the same, the cached (already decoded) data is returned.
+# The cached data is shared between callers: It must be treated as read-only.
+class ResponseCache:
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            return self._entries.get(url)
+
+    def isFresh(self, entry):
+        return entry is not None and time.monotonic() - entry.fetchedAt < self.ttl
+
+    # Headers to add to the request to revalidate a cached entry
+    def conditionalHeaders(self, entry):
+        headers = {}
+
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.lastModified:
+                headers['If-Modified-Since'] = entry.lastModified
+
+        return headers
+
+    # Returns the hash used to detect that a payload has not changed
+    def digest(self, content):
+        return hashlib.sha1(content).hexdigest()
+
+    def store(self, url, response, data, digest):
+        entry = CacheEntry(data, digest, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+        with self._lock:
+            self._entries[url] = entry
+
+        return entry
+
+    # The server confirmed that the entry is still valid
+    def revalidated(self, entry, response=None):
+        entry.fetchedAt = time.monotonic()
+
+        if response is not None:
+            entry.etag = response.headers.get('ETag', entry.etag)
+            entry.lastModified = response.headers.get('Last-Modified', entry.lastModified)
+
+    # Entries will be revalidated on the next call. Used after a call which may have changed the data.
+    def expireAll(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.fetchedAt = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Rate limiting, retries and circuit breaker for the Ring API
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from udi_interface import LOGGER
+
+# Raised when the circuit breaker is open: The call is not attempted
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+# Token bucket shared by all the API calls: Allows bursts of up to burst calls, and rate calls per second on average.
+class TokenBucket:
+    def __init__(self, rate=5, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Wait until a token is available
+    def acquire(self):
+        while True:
+            wait = self.tryAcquire()
+
+            if wait == 0:
+                return
+
+            time.sleep(wait)
+
+    # Take a token if one is available and return 0, else return the seconds to wait before trying again
+    # Used by callers which can't block (asyncio)
+    def tryAcquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+
+            return (1 - self._tokens) / self.rate
+
+# Stops calling the API after failureThreshold consecutive failures.
+# After resetTimeout seconds, a single trial call is allowed (half-open). If it succeeds, calls resume.
+# If the trial call never reports back (An unexpected exception in the caller), another one is allowed after resetTimeout.
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failureThreshold=5, resetTimeout=60):
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._openedAt = 0
+        self._trialAt = 0
+        self._lock = threading.Lock()
+
+    # Returns True if a call can be attempted
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            now = time.monotonic()
+
+            if self.state == self.OPEN and now - self._openedAt >= self.resetTimeout:
+                # Let one call through to test if the API is back
+                self.state = self.HALF_OPEN
+                self._trialAt = now
+                return True
+
+            if self.state == self.HALF_OPEN and now - self._trialAt >= self.resetTimeout:
+                LOGGER.warning('Circuit breaker trial call did not complete, allowing another one')
+                self._trialAt = now
+                return True
+
+            return False
+
+    def recordSuccess(self):
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    # Returns True if this failure opened the circuit
+    def recordFailure(self):
+        with self._lock:
+            self._failures += 1
+
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.failureThreshold):
+                self.state = self.OPEN
+                self._openedAt = time.monotonic()
+                return True
+
+            return False
+
+# Decides which failed calls are retried, and how long to wait before retrying
+class RetryPolicy:
+    retryStatuses = [ 429, 500, 502, 503, 504 ]
+
+    # Methods which can always be retried. Other methods are retried only if the caller says it's safe.
+    idempotentMethods = [ 'GET', 'DELETE', 'HEAD', 'OPTIONS' ]
+
+    def __init__(self, maxAttempts=4, baseDelay=1, maxDelay=30):
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+
+    def isIdempotent(self, method, idempotent=None):
+        return idempotent if idempotent is not None else method in self.idempotentMethods
+
+    # Errors which mean the server or the network is in trouble (As opposed to an error in our request)
+    def isTransient(self, error):
+        if isinstance(error, requests.exceptions.HTTPError):
+            return error.response is not None and error.response.status_code in self.retryStatuses
+
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def shouldRetry(self, method, idempotent, error, attempt):
+        return attempt < self.maxAttempts and self.isIdempotent(method, idempotent) and self.isTransient(error)
+
+    # Seconds to wait before the next attempt: Retry-After if the server sent one, else exponential backoff with full jitter
+    # retryAfter is the Retry-After header, for callers which don't have a requests error
+    def delay(self, attempt, error=None, retryAfter=None):
+        retryAfter = self._retryAfter(error) if retryAfter is None else self.parseRetryAfter(retryAfter)
+
+        if retryAfter is not None:
+            return min(retryAfter, self.maxDelay)
+
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** (attempt - 1)))
+
+    def _retryAfter(self, error):
+        response = getattr(error, 'response', None)
+        return self.parseRetryAfter(response.headers.get('Retry-After') if response is not None else None)
+
+    # Retry-After is either seconds or an HTTP date
+    def parseRetryAfter(self, value):
+        if not value:
+            return None
+
+        try:
+            return max(0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Ring account state
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+from lib.pollScheduler import PollScheduler
+
+# One Ring account managed by the node server.
+# ring is the RingInterface of the account: Its tokens, connection pool, rate limit and subscription.
+# The controller keeps here what it knows about the account: User id, last devices data and poll schedule.
+class RingAccount:
+    def __init__(self, ring, pollOffset=0):
+        self.ring = ring
+        self.number = ring.account
+        self.userId = None
+        self.devices = None
+        self.pollOffset = pollOffset
+
+        # Polls of this account: Its nodes report all their drivers every full_report_polls polls
+        self.pollCount = 0
+        self.scheduler = PollScheduler(pollOffset)
+        self.offlineRecheckTimer = None
+
+        # Poll delayed by pollOffset, when adaptive polling is disabled
+        self.staggerTimer = None
@@ -5,11 +5,21 @@ Copyright (C) 2023 Universal Devices
 
 MIT License
 """
-import json
 import time
 import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from udi_interface import LOGGER, Custom, OAuth
+from lib.httpSession import HttpSession
+from lib.deviceSnapshot import DeviceSnapshot
+from lib.responseCache import ResponseCache
+from lib.retryPolicy import TokenBucket, CircuitBreaker, RetryPolicy, CircuitOpenError
+from lib.subscriptionManager import SubscriptionManager
+from lib.metrics import metrics
+from lib.logUtils import LazyRepr
+from lib.asyncRingClient import AsyncRingClient
+from lib.tokenManager import TokenManager
+from lib.singleFlight import SingleFlight
 # from requests.exceptions import HTTPError
 
 # Implements the API calls to Ring
@@ -17,12 +27,69 @@ from udi_interface import LOGGER, Custom, OAuth
 class RingInterface(OAuth):
     ringApiBasePath = 'https://api.ring.com/integrations/v1'
 
-    def __init__(self, polyglot):
+    # GET responses younger than this are reused without calling the API
+    defaultCacheTtl = 5
+
+    # Maximum number of API calls run in parallel by runParallel()
+    defaultWorkers = 4
+
+    # Node queries reuse devices data younger than this (Seconds)
+    defaultQueryMaxAge = 10
+
+    # PG3 node addresses are limited to 14 characters
+    maxAddressLength = 14
+
+    # account: Number of the Ring account, from 1.
+    # Account 1 uses the tokens of the PG3 authentication, saved by the OAuth class under 'oauthTokens'.
+    # The other accounts keep their tokens under 'oauthTokens<account>', and their node addresses have a one letter prefix.
+    def __init__(self, polyglot, account=1):
         super().__init__(polyglot)
 
+        self.account = account
+        self.tokensKey = 'oauthTokens' if account == 1 else f"oauthTokens{ account }"
+        self.addressPrefix = '' if account == 1 else chr(ord('a') + account - 1)
+
+        if account != 1:
+            self._oauthTokens = Custom(polyglot, self.tokensKey)
+
         self.poly = polyglot
         self.customParams = Custom(polyglot, 'customparams')
+        self.customData = Custom(polyglot, 'customdata')
         self.includeShared = False
+
+        # Keep-alive connections shared by all API calls (Poll, commands, subscriptions)
+        self.session = HttpSession()
+
+        # Cache for GET calls. Unchanged payloads are not decoded again.
+        self.responseCache = ResponseCache(self.defaultCacheTtl)
+
+        # Concurrent fetches of the devices data share one call. The last snapshot is reused by node queries.
+        self.deviceFetches = SingleFlight()
+        self.queryMaxAge = self.defaultQueryMaxAge
+        self.lastSnapshot = None
+        self.lastSnapshotAt = 0
+
+        # Last devices data, with the time its fetch started. Set together: Read by the lights from other threads.
+        self._lastFetch = (None, 0)
+
+        # Shared by all callers: Limits the call rate, retries transient failures, and stops calling during outages
+        self.rateLimiter = TokenBucket()
+        self.retryPolicy = RetryPolicy()
+        self.circuitBreaker = CircuitBreaker()
+
+        # Tracks the webhook subscription and its pragma
+        self.subscriptions = SubscriptionManager()
+        self.postbackBaseUrl = None
+
+        # Runs independent API calls in parallel (Discovery, group light commands)
+        self.workers = self.defaultWorkers
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ringApi')
+
+        # Same calls, on an asyncio loop: Used by commands which must not block the caller
+        self.asyncClient = AsyncRingClient(self)
+
+        # Bearer header for the API calls, refreshed before the tokens expire
+        self.tokens = TokenManager(self)
         LOGGER.info('Ring interface initialized...')
 
     def customDataHandler(self, data):
@@ -33,24 +100,82 @@ class RingInterface(OAuth):
 
             # Save customdata without the key 'token'
             newData = { key: value for key, value in data.items() if key != 'token'}
-            Custom(self.poly, 'customdata').load(newData, True)
+            self.customData.load(newData, True)
 
             # Continue processing as if it was in the right place
             self.customNsHandler('oauthTokens', data['token'])
+        else:
+            # Holds the warm start state
+            self.customData.load(data)
 
     def customNsHandler(self, key, data):
-        LOGGER.debug('customNsHandler {}: {}'.format(key, json.dumps(data)))
-        super().customNsHandler(key, data)
+        # Tokens of the other accounts
+        if key is not None and key.startswith('oauthTokens') and key != self.tokensKey:
+            return
+
+        LOGGER.debug('customNsHandler %s: %s', key, LazyRepr(data))
+
+        if key == self.tokensKey and key != 'oauthTokens':
+            # The OAuth class only knows the tokens of account 1
+            self._oauthTokens.load(data)
+            self._updateRefreshTimer()
+        else:
+            super().customNsHandler(key, data)
+
+        if key == self.tokensKey:
+            self.tokens.reset()
 
     def oauthHandler(self, token):
-        LOGGER.debug('oAuth handler: {}'.format(json.dumps(token)))
+        LOGGER.debug('oAuth handler: %s', LazyRepr(token))
         super().oauthHandler(token)
+        self.tokens.reset()
+
+    # Refresh the tokens now, even if they are not about to expire. Uses the same lock as getAccessToken().
+    def refreshTokens(self):
+        with self._token_lock:
+            if self._oauthTokens is None or not self._oauthTokens.get('refresh_token'):
+                raise ValueError('Access token is not available')
+
+            self._oAuthTokensRefresh()
+            return self._oauthTokens.get('access_token')
+
+    # True if we have tokens which can be refreshed. Reads the saved tokens only: No lock, no refresh.
+    def hasRefreshToken(self):
+        return self._oauthTokens is not None and bool(self._oauthTokens.get('refresh_token'))
+
+    def getTokenExpiry(self):
+        return self._oauthTokens.get('expiry') if self._oauthTokens is not None else None
+
+    # Count and time the token refreshes done by the OAuth class
+    def _oAuthTokensRefresh(self):
+        metrics.increment('oauth.refreshes')
+
+        with metrics.timer('oauth.refresh'):
+            return super()._oAuthTokensRefresh()
 
     def customParamsHandler(self, customParams):
         self.customParams.load(customParams)
         self.includeShared = ('shared' in self.customParams and self.customParams['shared'].lower() == 'true')
         LOGGER.info(f"Include shared devices: { self.includeShared }")
-        LOGGER.debug(f"CustomParams: { json.dumps(customParams) }")
+        LOGGER.debug('CustomParams: %s', LazyRepr(customParams))
+
+        self.session.configure(
+            poolSize=int(self.getNumericParam('pool_size', HttpSession.defaultPoolSize)),
+            connectTimeout=self.getNumericParam('connect_timeout', HttpSession.defaultConnectTimeout),
+            readTimeout=self.getNumericParam('read_timeout', HttpSession.defaultReadTimeout),
+            idleTimeout=self.getNumericParam('idle_timeout', HttpSession.defaultIdleTimeout)
+        )
+        self.responseCache.ttl = self.getNumericParam('cache_ttl', self.defaultCacheTtl, allowZero=True)
+        self.rateLimiter.rate = self.getNumericParam('api_rate', 5)
+        self.rateLimiter.burst = self.getNumericParam('api_burst', 10)
+        self.retryPolicy.maxAttempts = int(self.getNumericParam('api_retries', 3, allowZero=True)) + 1
+        self.subscriptions.renewAfterSeconds = self.getNumericParam('subscription_renew_hours', 6) * 3600
+        self.setWorkers(int(self.getNumericParam('api_workers', self.defaultWorkers)))
+        self.queryMaxAge = self.getNumericParam('query_max_age', self.defaultQueryMaxAge, allowZero=True)
+
+        # Used to point the node server to a local Ring API and Portal stand-in (tools/fakeRingServer.py)
+        self.ringApiBasePath = self.customParams['api_base_url'] if 'api_base_url' in self.customParams else RingInterface.ringApiBasePath
+        self.postbackBaseUrl = self.customParams['postback_base_url'] if 'postback_base_url' in self.customParams else None
 
         if customParams is not None:
             oauthSettingsUpdate = {}
@@ -77,17 +202,58 @@ class RingInterface(OAuth):
                 oauthSettingsUpdate['token_parameters']['my_token_param'] = customParams['my_token_param']
                 LOGGER.info(f"Setting oAuth my_token_param to: { customParams['my_token_param'] }")
 
-            LOGGER.debug(f"Updating oAuth config using: { json.dumps(oauthSettingsUpdate) }")
+            LOGGER.debug('Updating oAuth config using: %s', LazyRepr(oauthSettingsUpdate))
 
             self.updateOauthSettings(oauthSettingsUpdate)
 
-            LOGGER.info(f"Updated oAuth config: { self.getOauthSettings() }")
+            LOGGER.info('Updated oAuth config: %s', LazyRepr(self.getOauthSettings()))
+
+    # Returns a numeric custom param, or the default if it is not set or not a positive number
+    # If allowZero is True, 0 is accepted (Typically used to disable a feature)
+    def getNumericParam(self, key, default, allowZero=False):
+        value = self.customParams[key] if key in self.customParams else None
+
+        if value is None or str(value).strip() == '':
+            return default
+
+        try:
+            number = float(value)
+        except ValueError:
+            LOGGER.warning(f"Custom param { key }={ value } is not a number, using { default }")
+            return default
+
+        if number < 0 or (number == 0 and not allowZero):
+            LOGGER.warning(f"Custom param { key }={ value } must be positive, using { default }")
+            return default
+
+        return number
+
+    # Node address of a Ring device: <account prefix><device id>_<suffix>
+    def makeAddress(self, deviceId, suffix):
+        address = f"{ self.addressPrefix }{ deviceId }_{ suffix }"
+
+        if len(address) > self.maxAddressLength:
+            LOGGER.warning(f"Node address { address } is longer than { self.maxAddressLength } characters")
+
+        return address
 
-    # Convert nodeserver address to a ring device id (Strip non-numeric characters)
+    # Convert nodeserver address to a ring device id (Strip the account prefix and the suffix: Non-numeric characters)
     def addressToId(self, address):
         return int(re.sub(r"[^\d]+", '', address))
 
+    # Account number of a node address: Addresses of account 1 start with the device id, the others with a letter
+    @staticmethod
+    def addressToAccount(address):
+        return ord(address[0]) - ord('a') + 1 if address[:1].isalpha() else 1
+
+    # API path used to label the metrics, with the device ids removed: /devices/{id}/floodlight_on
+    def getEndpoint(self, completeUrl):
+        return re.sub(r'/[0-9]+(?=/|$)', '/{id}', completeUrl[len(self.ringApiBasePath):])
+
     def getPostbackUrl(self, uuid, slot):
+        if self.postbackBaseUrl:
+            return f"{ self.postbackBaseUrl }/api/eisy/pg3/webhook/noresponse/{ uuid }/{ slot }"
+
         config = self.poly.getConfig()
 
         if config['store'].lower() == 'local':
@@ -100,26 +266,33 @@ class RingInterface(OAuth):
         return f"https://{ host }/api/eisy/pg3/webhook/noresponse/{ uuid }/{ slot }"
 
     # Call a Ring API
-    def _callApi(self, method='GET', url=None, body=None):
+    # PATCH, PUT and POST calls are retried only if idempotent is True
+    # decode, if set, is called with the response content instead of the default JSON decoding
+    # useCache=False: The call always reaches Ring, even if a cached response is available
+    def _callApi(self, method='GET', url=None, body=None, idempotent=None, decode=None, useCache=True):
         if url is None:
             LOGGER.error('url is required')
             return None
 
         completeUrl = self.ringApiBasePath + url
 
-        LOGGER.info(f"Making call to { method } { completeUrl }")
+        cached = self.responseCache.get(completeUrl) if method == 'GET' and useCache else None
 
-        # Then calling an API, get the access token (it will be refreshed if necessary)
-        accessToken = self.getAccessToken()
+        if self.responseCache.isFresh(cached):
+            LOGGER.debug('Using cached response for %s %s', method, completeUrl)
+            metrics.increment('api.cached', method, self.getEndpoint(completeUrl))
+            return cached.data
 
-        # if accessToken is None:
-        #     LOGGER.debug('Access token is not available')
-        #     return None
+        LOGGER.info('Making call to %s %s', method, completeUrl)
 
+        # The bearer header is cached. Tokens are refreshed in the background before they expire.
         headers = {
-            'Authorization': f"Bearer { accessToken }"
+            'Authorization': self.tokens.getAuthorizationHeader()
         }
 
+        # Revalidate the cached response, if the server supports it
+        headers.update(self.responseCache.conditionalHeaders(cached))
+
         if method in [ 'PATCH', 'POST'] and body is None:
             LOGGER.error(f"body is required when using { method } with { completeUrl }")
 
@@ -137,28 +310,35 @@ class RingInterface(OAuth):
             # Simulate DNS failure
             # raise requests.exceptions.ConnectionError("DNS lookup failed")
 
-            if method == 'GET':
-                response = requests.get(completeUrl, headers=headers)
-            elif method == 'DELETE':
-                response = requests.delete(completeUrl, headers=headers)
-            elif method == 'PATCH':
-                response = requests.patch(completeUrl, headers=headers, json=body)
-            elif method == 'POST':
-                response = requests.post(completeUrl, headers=headers, json=body)
-            elif method == 'PUT':
-                response = requests.put(completeUrl, headers=headers)
+            response = self._sendWithRetry(method, completeUrl, headers, body, idempotent)
 
-            response.raise_for_status()
-            LOGGER.info(f"Call { method } { completeUrl } successful")
-            try:
-                return response.json()
-            except requests.exceptions.JSONDecodeError:
-                return response.text
+            if response.status_code == 304 and cached is not None:
+                LOGGER.info('Call %s %s successful: Not modified', method, completeUrl)
+                self.responseCache.revalidated(cached, response)
+                return cached.data
+
+            LOGGER.info('Call %s %s successful', method, completeUrl)
+
+            if method != 'GET':
+                # The call may have changed what the GET endpoints return
+                self.responseCache.expireAll()
+                return self._decodeResponse(response, decode)
+
+            # Same payload as last time: Skip decoding, and return the same data
+            digest = self.responseCache.digest(response.content)
+
+            if cached is not None and cached.digest == digest:
+                LOGGER.debug('Response for %s %s has not changed', method, completeUrl)
+                self.responseCache.revalidated(cached, response)
+                return cached.data
+
+            return self.responseCache.store(completeUrl, response, self._decodeResponse(response, decode), digest).data
 
         except requests.exceptions.HTTPError as error:
             if error.response.status_code == 401:
                 LOGGER.error(f"Call {method} {completeUrl} failed with status code 401. Asking to re-authorize.")
                 self.poly.Notices['auth'] = 'Please initiate authentication'
+                self.tokens.invalidate()
 
             else:
                 LOGGER.error(
@@ -167,6 +347,9 @@ class RingInterface(OAuth):
                 )
             raise
 
+        except CircuitOpenError as error:
+            LOGGER.warning(f"Call { method } { completeUrl } not attempted: { error }")
+            raise
         except requests.exceptions.ConnectionError as error:
             LOGGER.error(f"Connection error occurred: {error}")
             raise
@@ -183,9 +366,99 @@ class RingInterface(OAuth):
 
 
 
+    # Send the request, respecting the rate limit and the circuit breaker.
+    # Transient failures (429, 5xx, connection errors, timeouts) of idempotent calls are retried with backoff.
+    def _sendWithRetry(self, method, completeUrl, headers, body, idempotent):
+        endpoint = self.getEndpoint(completeUrl)
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            if not self.circuitBreaker.allow():
+                raise CircuitOpenError('Ring API calls are suspended after repeated failures')
+
+            self.rateLimiter.acquire()
+            start = time.perf_counter()
+
+            try:
+                # The session reuses keep-alive connections and applies the connect/read timeouts
+                response = self.session.request(method, completeUrl, headers=headers, json=body)
+                self.recordCall(method, endpoint, response.status_code, start)
+                response.raise_for_status()
+                self.circuitBreaker.recordSuccess()
+                return response
+
+            except requests.exceptions.RequestException as error:
+                if getattr(error, 'response', None) is None:
+                    # No response: Connection error or timeout
+                    self.recordCall(method, endpoint, type(error).__name__, start)
+
+                if not self.retryPolicy.isTransient(error):
+                    # The API answered: It's our request which is wrong
+                    self.circuitBreaker.recordSuccess()
+                    raise
+
+                if self.circuitBreaker.recordFailure():
+                    LOGGER.error(f"Ring API calls suspended for { self.circuitBreaker.resetTimeout }s after repeated failures")
+                    raise
+
+                if not self.retryPolicy.shouldRetry(method, idempotent, error, attempt):
+                    raise
+
+                delay = self.retryPolicy.delay(attempt, error)
+                LOGGER.warning(f"Call { method } { completeUrl } failed ({ error }), retrying in { round(delay, 1) }s")
+                time.sleep(delay)
+
+    # Every attempt is counted by endpoint and status. HTTP errors and failed connections count as API errors.
+    def recordCall(self, method, endpoint, status, start):
+        metrics.observe('api.latency', (time.perf_counter() - start) * 1000, method, endpoint)
+        metrics.increment('api.calls', method, endpoint, status)
+
+        if not isinstance(status, int) or status >= 400:
+            metrics.increment('api.errors', method, endpoint, status)
+
+    def _decodeResponse(self, response, decode=None):
+        if decode is not None:
+            return decode(response.content)
+
+        try:
+            return response.json()
+        except requests.exceptions.JSONDecodeError:
+            return response.text
+
+    # The executor size can't be changed: Replace it. Calls already submitted finish on the old one.
+    def setWorkers(self, workers):
+        if workers == self.workers:
+            return
+
+        oldExecutor = self.executor
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ringApi')
+        oldExecutor.shutdown(wait=False)
+
+    # Run the functions in parallel, and return their results in the same order
+    # Calls are still subject to the rate limit and the circuit breaker.
+    def runParallel(self, *functions):
+        futures = [ self.executor.submit(function) for function in functions ]
+        return [ future.result() for future in futures ]
+
+    # Close the pooled connections when the node server stops
+    def close(self):
+        # Refresh timer of the OAuth class
+        refreshTimer = getattr(self, '_refreshTimer', None)
+
+        if refreshTimer is not None:
+            refreshTimer.cancel()
+
+        self.asyncClient.stop()
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
     # Call a Ring API to test connectivity
+    # Checks the access token with Ring: Never answered from the cache
     def testApiCall(self):
-        return self._callApi(url='/user/info')
+        return self._callApi(url='/user/info', useCache=False)
 
     def testWebhook(self, body):
         try:
@@ -194,10 +467,10 @@ class RingInterface(OAuth):
             completeUrl = self.getPostbackUrl(config['uuid'], config['profileNum'])
 
             headers = {
-                'pragma': self.currentPragma
+                'pragma': self.getCurrentPragma()
             }
 
-            response = requests.post(completeUrl, headers=headers, json=body, timeout=5)
+            response = self.session.post(completeUrl, headers=headers, json=body, timeout=5)
             response.raise_for_status()
         except requests.exceptions.HTTPError as error:
             httpStatus = error.response.status_code
@@ -215,55 +488,130 @@ class RingInterface(OAuth):
 
     def getAllDevices(self):
         try:
-            return self._callApi(url='/devices')
+            # Parsed once into a DeviceSnapshot, which is what the response cache keeps
+            return self._callApi(url='/devices', decode=DeviceSnapshot.parse)
         except Exception:
             return None
 
-    def getDeviceData(self, id, prefetched=None):
+    # Fetch the /devices payload as a DeviceSnapshot, indexed by Ring device id
+    # If the payload has not changed since the last call, the same snapshot object is returned
+    # Concurrent callers share the same call. If maxAge is set, a snapshot younger than maxAge seconds is reused without calling the API.
+    def getDeviceSnapshot(self, maxAge=None):
+        if maxAge and self.lastSnapshot is not None and time.monotonic() - self.lastSnapshotAt < maxAge:
+            LOGGER.debug('Reusing devices data fetched %.1fs ago', time.monotonic() - self.lastSnapshotAt)
+            metrics.increment('api.collapsed', 'GET', '/devices', 'reused')
+            return self.lastSnapshot
+
+        snapshot, shared = self.deviceFetches.do('/devices', self._fetchDeviceSnapshot)
+
+        if shared:
+            LOGGER.debug('Devices data shared with a concurrent fetch')
+            metrics.increment('api.collapsed', 'GET', '/devices', 'shared')
+
+        return snapshot
+
+    def _fetchDeviceSnapshot(self):
+        start = time.monotonic()
+        snapshot = self.getAllDevices()
+
+        # If we don't have authorizations, snapshot will be null
+        if snapshot is not None:
+            LOGGER.debug('Devices: %s', LazyRepr(snapshot))
+            self.lastSnapshot = snapshot
+            self.lastSnapshotAt = time.monotonic()
+            self._lastFetch = (snapshot, start)
+
+        return snapshot
+
+    # True if snapshot is the last devices data, and its fetch started after since (time.monotonic()).
+    # A fetch which started earlier may have been answered before a change made meanwhile.
+    def isFetchedAfter(self, snapshot, since):
+        lastSnapshot, startedAt = self._lastFetch
+        return snapshot is not None and snapshot is lastSnapshot and startedAt > since
+
+    # Returns the DeviceState of a device from a DeviceSnapshot.
+    # If none is passed (Node queries), devices data younger than query_max_age seconds is reused, else it is fetched.
+    def getDeviceState(self, id, prefetched=None):
         if prefetched is None:
-            LOGGER.info('prefetched is none')
-            devices = self.getAllDevices()
+            snapshot = self.getDeviceSnapshot(self.queryMaxAge)
         else:
-            devices = prefetched
+            snapshot = prefetched
 
-        # If we don't have authorizations, devices will be null
-        if devices is None:
+        if snapshot is None:
             return
 
-        allDevices = devices['doorbells'] + devices['authorized_doorbells'] + devices['stickup_cams']
-        return next((d for d in allDevices if d['id'] == id), None)
+        return snapshot.get(id)
 
+    # Request a new subscription (Or replace the existing one)
     def subscribe(self):
         config = self.poly.getConfig()
         postbackUrl = self.getPostbackUrl(config['uuid'], config['profileNum'])
 
-        # Set a new pragma. Webhooks will be accepted only if it has a header 'pragma' = currentPragma
-        # We change it every long polls as a security measure
-        self.currentPragma = str(time.time())
+        # Set a new pragma. Webhooks will be accepted only if they have a header 'pragma' with this value
+        # We change it on every renewal as a security measure. The previous one is accepted for a short time.
+        pragma = self.subscriptions.startRenewal()
 
         LOGGER.info(f"Requesting subscription to { postbackUrl }")
-        LOGGER.info(f"Pragma is set to { self.currentPragma }")
+        LOGGER.debug('Pragma is set to %s', pragma)
 
         body = {
             'subscription': {
                 'postback_url': postbackUrl,
                 'metadata': {
                     'headers': {
-                        'Pragma': self.currentPragma
+                        'Pragma': pragma
                     }
                 }
              }
         }
 
         try:
-            return self._callApi(method='PATCH', url='/subscription', body=body)
+            # The subscription is replaced as a whole: It is safe to retry
+            result = self._callApi(method='PATCH', url='/subscription', body=body, idempotent=True)
         except Exception:
+            self.subscriptions.renewalFailed()
             return None
 
+        self.subscriptions.renewed(postbackUrl)
+        return result
+
+    # Called on long polls: Renew the subscription only if needed, else check that webhooks are still received
+    def maintainSubscription(self):
+        config = self.poly.getConfig()
+        postbackUrl = self.getPostbackUrl(config['uuid'], config['profileNum'])
+        reason = self.subscriptions.renewalReason(postbackUrl)
+
+        if reason is not None:
+            LOGGER.info(f"Renewing subscription: { reason }")
+            return self.subscribe()
+
+        if self.subscriptions.isHealthCheckDue():
+            LOGGER.info('No webhook received for a while, sending a webhook health check')
+            self.subscriptions.healthCheckSent()
+
+            # Sent in the background: Failures are logged
+            self.asyncClient.submit(self.asyncClient.testWebhook({
+                'event': 'webhook-test',
+                'data': {
+                    'doorbell': {
+                        'id': SubscriptionManager.healthCheckId,
+                        'description': 'Subscription health check'
+                    }
+                }
+            }))
+
+        return None
+
     def getCurrentPragma(self):
-        return getattr(self, 'currentPragma', None)
+        return self.subscriptions.pragma
+
+    # Webhooks are accepted with the current pragma, or the previous one shortly after a renewal
+    def isValidPragma(self, receivedPragma):
+        return self.subscriptions.isValidPragma(receivedPragma)
 
     def unsubscribe(self):
+        self.subscriptions.invalidate()
+
         try:
             return self._callApi(method='DELETE', url='/subscription')
         except Exception:
@@ -277,12 +625,12 @@ class RingInterface(OAuth):
 
     def floodlightOn(self, deviceId):
         try:
-            return self._callApi(method='PUT', url=f"/devices/{ deviceId }/floodlight_on")
+            return self._callApi(method='PUT', url=f"/devices/{ deviceId }/floodlight_on", idempotent=True)
         except Exception:
             return None
 
     def floodlightOff(self, deviceId):
         try:
-            return self._callApi(method='PUT', url=f"/devices/{ deviceId }/floodlight_off")
+            return self._callApi(method='PUT', url=f"/devices/{ deviceId }/floodlight_off", idempotent=True)
         except Exception:
             return None
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Single-flight calls
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+# Collapses concurrent calls with the same key into one:
+# The first caller runs the function, the others wait for it and get the same result (Or the same exception).
+# Calls made after it completed run the function again.
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    # Returns (result, shared). shared is True if the result comes from a call made by another caller.
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result, True
+
+        try:
+            call.result = function()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+        return call.result, False
+
+    # Number of keys with a call in flight
+    def inFlight(self):
+        with self._lock:
+            return len(self._calls)
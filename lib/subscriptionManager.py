@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Ring webhook subscription manager
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import threading
+import time
+from udi_interface import LOGGER
+
+# Keeps track of the Ring webhook subscription, so that it is renewed only when needed.
+# - The subscription is renewed when it was never confirmed, when the postback url changed,
+#   when it is older than renewAfterSeconds, or when a health check failed.
+# - Each renewal sets a new pragma. Webhooks are accepted with the new pragma as soon as the renewal
+#   is requested, and with the previous pragma for graceSeconds after, so that events in flight are not lost.
+# - If no webhook was received for healthCheckSeconds, a webhook-test is sent through the Portal.
+#   If it does not come back within healthCheckTimeout seconds, the subscription is renewed.
+class SubscriptionManager:
+    renewAfterSeconds = 6 * 3600
+    graceSeconds = 120
+    healthCheckSeconds = 3600
+    healthCheckTimeout = 30
+
+    # Id used in the webhook-test body of the health checks
+    healthCheckId = 'healthcheck'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.pragma = None
+        self.pendingPragma = None
+        self.previousPragma = None
+        self.previousValidUntil = 0
+
+        self.postbackUrl = None
+        self.confirmedAt = None
+        self.lastWebhookAt = None
+        self.healthCheckSentAt = None
+
+    # Returns a new pragma, accepted right away as the subscription may be applied before the call returns
+    def startRenewal(self):
+        with self._lock:
+            self.pendingPragma = str(time.time())
+            return self.pendingPragma
+
+    def renewed(self, postbackUrl):
+        with self._lock:
+            if self.pragma is not None and self.pragma != self.pendingPragma:
+                self.previousPragma = self.pragma
+                self.previousValidUntil = time.monotonic() + self.graceSeconds
+
+            self.pragma = self.pendingPragma
+            self.pendingPragma = None
+            self.postbackUrl = postbackUrl
+            self.confirmedAt = time.monotonic()
+            self.healthCheckSentAt = None
+
+    def renewalFailed(self):
+        with self._lock:
+            self.pendingPragma = None
+
+    # The subscription was deleted, or is not trusted anymore
+    def invalidate(self):
+        with self._lock:
+            self.confirmedAt = None
+
+    def isValidPragma(self, received):
+        if received is None:
+            return False
+
+        with self._lock:
+            if received == self.pragma or received == self.pendingPragma:
+                return True
+
+            return received == self.previousPragma and time.monotonic() < self.previousValidUntil
+
+    def webhookReceived(self):
+        with self._lock:
+            self.lastWebhookAt = time.monotonic()
+
+    # Returns the reason why the subscription needs to be renewed, or None
+    def renewalReason(self, postbackUrl):
+        with self._lock:
+            now = time.monotonic()
+
+            if self.confirmedAt is None:
+                return 'not subscribed'
+            if postbackUrl != self.postbackUrl:
+                return 'postback url changed'
+            if now - self.confirmedAt >= self.renewAfterSeconds:
+                return 'subscription is due for renewal'
+
+            healthCheckFailed = (
+                self.healthCheckSentAt is not None
+                and now - self.healthCheckSentAt >= self.healthCheckTimeout
+                and (self.lastWebhookAt is None or self.lastWebhookAt < self.healthCheckSentAt)
+            )
+
+            if healthCheckFailed:
+                return 'webhook health check failed'
+
+            return None
+
+    # True if we have not received any webhook for a while, and no health check is in progress
+    def isHealthCheckDue(self):
+        with self._lock:
+            now = time.monotonic()
+            lastActivity = max(self.lastWebhookAt or 0, self.confirmedAt or 0)
+
+            return self.healthCheckSentAt is None and now - lastActivity >= self.healthCheckSeconds
+
+    def healthCheckSent(self):
+        with self._lock:
+            self.healthCheckSentAt = time.monotonic()
+
+    def healthCheckPassed(self):
+        with self._lock:
+            self.healthCheckSentAt = None
+            LOGGER.info('Webhook health check successful')
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - OAuth access token manager
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import threading
+import time
+from datetime import datetime
+from udi_interface import LOGGER
+from lib.metrics import metrics
+
+# Keeps the bearer header ready for the API calls, and refreshes the tokens before they expire.
+# - Between refreshes, getAuthorizationHeader() returns the cached header without locking
+# - refreshMarginSeconds before expiry, the first call starts a refresh in the background.
+#   Callers keep using the current token meanwhile: They never wait for a refresh while it is still valid.
+#   There is no timer here: The OAuth class has its own, 60s before expiry, for when no calls are made.
+# - Only one refresh runs at a time. Callers which need a token while none is usable wait for it.
+# - After a failed refresh, the next one is attempted after retrySeconds, doubled on each failure up to maxRetrySeconds.
+#   Meanwhile, the current token is used while it is valid. Once expired, callers get a ValueError.
+# oauth is the RingInterface: getAccessToken(), refreshTokens(), getTokenExpiry() and hasRefreshToken() are used.
+class TokenManager:
+    refreshMarginSeconds = 300
+
+    # OAuth.getAccessToken() refreshes inline when the token expires within 60s: The token is not used past that point
+    expiryMarginSeconds = 60
+
+    # Delay before trying again when a refresh failed, doubled on each consecutive failure
+    retrySeconds = 30
+    maxRetrySeconds = 900
+
+    # Maximum time a caller waits for a refresh done by another caller
+    waitSeconds = 30
+
+    def __init__(self, oauth):
+        self.oauth = oauth
+        self._lock = threading.Lock()
+        self._refreshDone = threading.Condition(self._lock)
+        self._refreshing = False
+
+        self._header = None
+        self._refreshAt = 0
+        self._expiresAt = 0
+
+        # Consecutive failed refreshes, and the time before which no refresh is attempted
+        self._failures = 0
+        self._retryAt = 0
+
+    # Returns the cached Authorization header if it can be used right away, else None. Never blocks.
+    def getCachedHeader(self):
+        header = self._header
+
+        if header is not None and time.monotonic() < self._refreshAt:
+            return header
+
+        return None
+
+    # Returns the Authorization header value. Raises ValueError if we don't have tokens (Not authenticated).
+    # May block while the tokens are refreshed.
+    def getAuthorizationHeader(self):
+        header = self.getCachedHeader()
+
+        if header is not None:
+            return header
+
+        with self._lock:
+            deadline = time.monotonic() + self.waitSeconds
+
+            # Another caller is getting a token, and we don't have a usable one: Wait for it
+            while self._refreshing and not self._isUsable() and time.monotonic() < deadline:
+                self._refreshDone.wait(deadline - time.monotonic())
+
+            if self._header is not None and time.monotonic() < self._refreshAt:
+                return self._header
+
+            # The last refresh failed: Don't try again before the backoff delay
+            if time.monotonic() < self._retryAt:
+                if self._isUsable():
+                    return self._header
+
+                raise ValueError(f"Access token expired, next refresh attempt in { round(self._retryAt - time.monotonic()) }s")
+
+            if self._isUsable():
+                # Due for a refresh, but still valid: Refresh in the background and use it meanwhile
+                self._startBackgroundRefresh()
+                return self._header
+
+            self._refreshing = True
+
+        # No usable token: Get one now
+        failure = self._refresh(early=False)
+
+        with self._lock:
+            if self._isUsable():
+                return self._header
+
+        raise failure if failure is not None else ValueError('Access token expired and could not be refreshed')
+
+    # Returns True if we have tokens (The user went through the authentication)
+    def isAuthorized(self):
+        try:
+            self.getAuthorizationHeader()
+            return True
+        except ValueError:
+            return False
+
+    # Same as isAuthorized(), from the cached state only: Never blocks and never refreshes. For the Polyglot thread.
+    # The tokens may still fail to refresh on the next call.
+    def hasTokens(self):
+        return self.getCachedHeader() is not None or self.oauth.hasRefreshToken()
+
+    # The tokens were rejected by the API: Read them again on the next call. A failed refresh is still not retried before its delay.
+    def invalidate(self):
+        with self._lock:
+            self._header = None
+            self._refreshAt = 0
+            self._expiresAt = 0
+
+    # New tokens (Authentication, tokens loaded): Read them on the next call, and forget the failed refreshes
+    def reset(self):
+        with self._lock:
+            self._header = None
+            self._refreshAt = 0
+            self._expiresAt = 0
+            self._failures = 0
+            self._retryAt = 0
+
+    # Must be called with the lock acquired
+    def _isUsable(self):
+        return self._header is not None and time.monotonic() < self._expiresAt
+
+    # Must be called with the lock acquired
+    def _startBackgroundRefresh(self):
+        if self._refreshing:
+            return
+
+        self._refreshing = True
+        threading.Thread(target=self._refresh, kwargs={ 'early': True }, name='tokenRefresh', daemon=True).start()
+
+    # early: Refresh even if the token is not about to expire. Else, the OAuth class refreshes only if needed.
+    # Returns the error if it failed
+    def _refresh(self, early):
+        accessToken = None
+        failure = None
+
+        try:
+            accessToken = self.oauth.refreshTokens() if early else self.oauth.getAccessToken()
+            expiry = self.oauth.getTokenExpiry()
+        except Exception as error:
+            failure = error
+
+            # ValueError: No tokens, the user has to authenticate
+            if early and not isinstance(error, ValueError):
+                LOGGER.error(f"Access token refresh failed: { error }")
+
+        with self._lock:
+            self._refreshing = False
+
+            if accessToken is not None:
+                self._setToken(accessToken, expiry)
+
+            # The OAuth class keeps the current tokens when the refresh fails: The token is still due for a refresh.
+            refreshed = accessToken is not None and time.monotonic() < self._refreshAt
+
+            # getAccessToken() does not refresh a token which is still usable: It is refreshed on the next call.
+            loaded = accessToken is not None and not early and self._isUsable()
+
+            if refreshed:
+                self._failures = 0
+                self._retryAt = 0
+            elif not loaded and not isinstance(failure, ValueError):
+                self._refreshFailed()
+
+            self._refreshDone.notify_all()
+
+        return failure
+
+    # Must be called with the lock acquired
+    def _setToken(self, accessToken, expiry):
+        now = time.monotonic()
+        remaining = (datetime.fromisoformat(expiry) - datetime.now()).total_seconds() if expiry else 0
+
+        self._header = f"Bearer { accessToken }"
+        self._expiresAt = now + remaining - self.expiryMarginSeconds
+        self._refreshAt = now + remaining - self.refreshMarginSeconds
+
+    # Must be called with the lock acquired
+    # The cached header is used until the next attempt, or until it expires
+    def _refreshFailed(self):
+        now = time.monotonic()
+        self._failures += 1
+        delay = min(self.retrySeconds * 2 ** (self._failures - 1), self.maxRetrySeconds)
+
+        self._retryAt = now + delay
+        self._refreshAt = min(self._retryAt, max(now, self._expiresAt))
+        metrics.increment('oauth.failures')
+        LOGGER.warning(f"Access token refresh failed { self._failures } times, next attempt in { delay }s")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Warm start state
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import time
+from udi_interface import LOGGER
+
+# Last known state of the node server, saved in the Polyglot custom data under the key 'warmStart'.
+# On startup, the nodes are restored from it and report their last known state right away,
+# while the tokens, discovery and subscription are checked in the background.
+# Saved compactly:
+#   accounts: { account number: [ userId, devices ] } devices is one list of fields per device (DeviceSnapshot.toList())
+#   nodes: { address: [ node class name, name, { driver: value } ] }
+class WarmStart:
+    key = 'warmStart'
+
+    # Bumped when the saved format changes. Saved state of another version is ignored.
+    version = 2
+
+    # Changes are saved at most this often, unless the save is forced (On stop)
+    saveIntervalSeconds = 300
+
+    # customData is the Custom for 'customdata', loaded by the CUSTOMDATA handler
+    def __init__(self, customData):
+        self.customData = customData
+        self.lastSavedAt = 0
+        self._lastState = None
+
+    # Returns the saved state, or None if there is none we can use
+    def get(self):
+        state = self.customData.get(self.key)
+
+        if not isinstance(state, dict) or state.get('version') != self.version:
+            return None
+
+        return state
+
+    # Save the state if it changed. Returns True if it was saved.
+    # accounts: RingAccount list, with their devices data
+    def save(self, accounts, nodes, force=False):
+        state = {
+            'version': self.version,
+            'accounts': { str(account.number): [ account.userId, account.devices.toList() ] for account in accounts },
+            'nodes': { node.address: [ type(node).__name__, node.name, { driver['driver']: driver['value'] for driver in node.drivers } ] for node in nodes }
+        }
+
+        if state == self._lastState:
+            return False
+
+        if not force and time.monotonic() - self.lastSavedAt < self.saveIntervalSeconds:
+            return False
+
+        LOGGER.debug(f"Saving warm start state: { len(state['accounts']) } accounts, { len(state['nodes']) } nodes")
+        self.customData[self.key] = state
+        self.lastSavedAt = time.monotonic()
+        self._lastState = state
+        return True
+
+    def clear(self):
+        self._lastState = None
+        self.customData.delete(self.key)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Ring events routing
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+
+# Routes Ring events to nodes: (account number, Ring device id, event) -> node
+# The table is rebuilt when the nodes change (Discovery), so that each event is routed with one lookup.
+# Lookups are lock-free: The table is replaced, never modified.
+# A device shared between linked accounts has nodes in each account (include_shared): The account of the webhook,
+# found from its pragma, selects the node.
+class WebhookRouter:
+    # Node address suffix receiving each event
+    eventSuffixes = { 'new-ding': '_db', 'new-motion': '_m' }
+
+    # The controller TEST command sends a webhook-test with the address of the node as device id
+    testEvent = 'webhook-test'
+
+    def __init__(self):
+        self._routes = {}
+        self._deviceIds = frozenset()
+
+    def rebuild(self, nodes):
+        routes = {}
+
+        for node in nodes:
+            account = node.ring.account
+            routes[(account, node.address, self.testEvent)] = node
+            deviceId = getattr(node, 'deviceId', None)
+
+            if deviceId is None:
+                continue
+
+            for event, suffix in self.eventSuffixes.items():
+                if node.address.endswith(suffix):
+                    routes[(account, str(deviceId), event)] = node
+
+        self._routes = routes
+        self._deviceIds = frozenset((account, id) for account, id, event in routes)
+
+    # Returns the node for the event of a device of an account, or None
+    def route(self, account, id, event):
+        return self._routes.get((account, str(id), event))
+
+    # True if at least one node of the account receives events for this device id
+    def isKnown(self, account, id):
+        return (account, str(id)) in self._deviceIds
+
+    def __len__(self):
+        return len(self._routes)
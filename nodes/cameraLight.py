@@ -5,17 +5,30 @@ Copyright (C) 2023 Universal Devices inc
 
 MIT License
 """
-
+import threading
+import time
 from udi_interface import LOGGER, Node
+from lib.metrics import metrics
 
 '''
 Camera lighting node.
 This is a secondary node to a Camera node
+
+ST is updated as soon as a command is received, then reconciled with the Ring devices data (led_status)
+of the first poll which requested it after the command completed.
+DON/DOF received in a quick succession (Scenes flashing the lights) are collapsed: Only the last one is sent to Ring.
 '''
 class CameraLight(Node):
     # nodedef id
     id = 'LIGHT'
-    drivers = []
+    drivers = [
+        { 'driver': 'ST', 'value': 0, 'uom': 78, 'name': 'Light' },
+        { 'driver': 'GV0', 'value': 0, 'uom': 42, 'name': 'Last command latency' },
+        { 'driver': 'GV1', 'value': 0, 'uom': 56, 'name': 'Commands failed' }
+    ]
+
+    # A command is sent to Ring when no other command was received for this time
+    debounceSeconds = 0.5
 
     def __init__(self, polyglot, parent, address, name, ringInterface):
         super().__init__(polyglot, parent, address, name)
@@ -24,20 +37,154 @@ class CameraLight(Node):
         self.ring = ringInterface
         self.deviceId = ringInterface.addressToId(address)
 
+        self.lock = threading.Lock()
+
+        # State asked by the last command, until it is sent
+        self.intended = None
+        self.debounceTimer = None
+        self.inFlight = 0
+
+        # Time the last command completed, until devices data fetched after it is received. None if there is none.
+        self.commandDoneAt = None
+
+        # Light state in the last devices data used
+        self.confirmed = None
+
         # REF: https://github.com/UniversalDevicesInc/hints
         #'0x01021001'
         self.hint = [ 1, 2, 16, 1 ]  # Non-dimming light
 
     def don(self, param=None):
         LOGGER.info(f'DON received for device: { self.address }')
-        self.ring.floodlightOn(self.deviceId)
+        self.command(True)
 
     def dof(self, param=None):
         LOGGER.info(f'DOF received for device: { self.address }')
-        self.ring.floodlightOff(self.deviceId)
+        self.command(False)
+
+    # Report the new state right away. It is sent to Ring once no other command is received for debounceSeconds.
+    def command(self, on):
+        with self.lock:
+            if self.debounceTimer is not None:
+                self.debounceTimer.cancel()
+                metrics.increment('lights.collapsed')
+                LOGGER.debug(f"Light { self.address }: Previous command replaced before it was sent")
+
+            self.intended = on
+            self.debounceTimer = threading.Timer(self.debounceSeconds, self.sendIntended)
+            self.debounceTimer.daemon = True
+            self.debounceTimer.start()
+
+        self.setDriver('ST', 100 if on else 0)
+
+    # Commands don't wait for Ring: The call runs on the async client
+    def sendIntended(self):
+        with self.lock:
+            on, self.intended = self.intended, None
+            self.debounceTimer = None
+
+        if on is None:
+            return
+
+        start = self.commandSent(on)
+        client = self.ring.asyncClient
+        call = client.floodlightOn if on else client.floodlightOff
+        future = client.submit(call(self.deviceId))
+        future.add_done_callback(lambda done: self.commandDone(on, start, self.isSuccess(done)))
+
+    # The call may also fail with an exception (Cancelled when stopping): commandDone() must be called anyway
+    @staticmethod
+    def isSuccess(future):
+        try:
+            return future.result() is not None
+        except Exception:
+            return False
+
+    # Called when a command is sent to Ring, by this node or by the controller (All lights commands)
+    # Returns the start time to pass to commandDone
+    def commandSent(self, on):
+        with self.lock:
+            # A command sent by the controller replaces the one waiting here
+            if self.debounceTimer is not None:
+                self.debounceTimer.cancel()
+                self.debounceTimer = None
+                self.intended = None
+
+            self.inFlight += 1
+
+        self.setDriver('ST', 100 if on else 0)
+        return time.perf_counter()
+
+    # Latency and failures are reported for every command. On failure, ST goes back to the last devices data.
+    # Must be called once for each commandSent(), even if the call failed.
+    def commandDone(self, on, start, success):
+        ms = (time.perf_counter() - start) * 1000
+        command = 'DON' if on else 'DOF'
+
+        metrics.observe('lights.latency', ms, command)
+        metrics.increment('lights.commands', command, 'success' if success else 'failure')
+        self.setDriver('GV0', round(ms))
+
+        with self.lock:
+            self.inFlight -= 1
+            self.commandDoneAt = time.monotonic()
+            revert = not success and self.inFlight == 0 and self.debounceTimer is None and self.confirmed is not None
+
+        if not success:
+            LOGGER.error(f"{ command } failed for device: { self.address }")
+            self.setDriver('GV1', int(self.getDriver('GV1') or 0) + 1)
+
+        if revert:
+            self.setDriver('ST', 100 if self.confirmed else 0)
+
+    # Called by the polls with the devices data of the account, even if it has not changed:
+    # ST is reconciled as soon as devices data fetched after the last command is available.
+    def reconcile(self, snapshot):
+        if self.commandDoneAt is not None and snapshot is not None:
+            self.queryWithPrefetched(snapshot)
+
+    # Only nodes with this method can be globally refreshed
+    # Drivers are reported only if they changed, unless forceReport is True
+    def queryWithPrefetched(self, prefetched, forceReport=False):
+        snapshot = prefetched if prefetched is not None else self.ring.getDeviceSnapshot(self.ring.queryMaxAge)
+        state = snapshot.get(self.deviceId) if snapshot is not None else None
+
+        self.setDriver('GV0', self.getDriver('GV0') or 0, True, forceReport)
+        self.setDriver('GV1', self.getDriver('GV1') or 0, True, forceReport)
+
+        if state is None or state.lightOn is None:
+            LOGGER.debug(f"Light { self.address }: No light state in the devices data")
+            return
+
+        with self.lock:
+            # The devices data may not reflect the commands yet: The optimistic state is kept
+            pending = self.debounceTimer is not None or self.inFlight > 0
+
+            # Devices data requested before the last command completed
+            stale = self.commandDoneAt is not None and not self.ring.isFetchedAfter(snapshot, self.commandDoneAt)
+
+            if not pending and not stale:
+                self.commandDoneAt = None
+                self.confirmed = state.lightOn
+
+        if pending or stale:
+            LOGGER.debug(f"Light { self.address }: Command in progress, not reconciled with the devices data")
+            return
+
+        value = 100 if state.lightOn else 0
+
+        if self.getDriver('ST') != value:
+            LOGGER.info(f"Light { self.address } is { 'on' if state.lightOn else 'off' } in Ring, updating its state")
+            metrics.increment('lights.reconciled')
+
+        self.setDriver('ST', value, True, forceReport)
+
+    def query(self, param=None):
+        self.queryWithPrefetched(None, True)
 
     # The commands here need to match what is in the nodedef profile file.
     commands = {
         'DON': don,
-        'DOF': dof
+        'DOF': dof,
+        'QUERY': query
         }
@@ -8,11 +8,18 @@ MIT License
 import requests
 import threading
 import time
+from datetime import datetime
 from udi_interface import LOGGER, Node
 from nodes.doorbell import Doorbell
 from nodes.doorbellMotion import DoorbellMotion
 from nodes.camera import Camera
 from nodes.cameraLight import CameraLight
+from lib.deviceSnapshot import DeviceSnapshot
+from lib.ringAccount import RingAccount
+from lib.metrics import metrics
+from lib.webhookRouter import WebhookRouter
+from lib.warmStart import WarmStart
+from lib.eventJournal import EventJournal
 
 # siren is currently not used
 DEVICE_TYPES = {
@@ -56,106 +63,533 @@ class Controller(Node):
     drivers = [
         # Default value is "Online"
         { 'driver': 'ST', 'value': 1, 'uom': 25 },
-        { 'driver': 'GV0', 'value': 0, 'uom': 25 }
+        { 'driver': 'GV0', 'value': 0, 'uom': 25 },
+        { 'driver': 'GV1', 'value': 0, 'uom': 42, 'name': 'Last poll duration' },
+        { 'driver': 'GV2', 'value': 0, 'uom': 51, 'name': 'API error rate' },
+        { 'driver': 'GV3', 'value': 0, 'uom': 56, 'name': 'Events per minute' },
+        { 'driver': 'GV4', 'value': 0, 'uom': 56, 'name': 'Events ignored' },
+        { 'driver': 'GV5', 'value': 0, 'uom': 56, 'name': 'Lights failed' }
     ]
 
     webhookTestTimeoutSeconds = 5
 
+    # By default, all drivers are reported every 10 polls, even if they have not changed
+    defaultFullReportPolls = 10
+
+    # When a device goes offline, devices data is refreshed again after this delay
+    offlineRecheckSeconds = 15
+
+    # Windows used for the metrics drivers
+    errorRateSeconds = 900
+    eventRateSeconds = 300
+
+    # Polls of the Ring accounts are spread by this many seconds
+    defaultPollStaggerSeconds = 60
+
+    # EXPORTEVENTS writes the events journal here, LOGEVENTS logs this many recent events
+    eventsExportPath = 'logs/events.csv'
+    recentEventsLogged = 50
+
+    # Node classes by name, to restore the nodes saved for the warm start
+    nodeClasses = { nodeClass.__name__: nodeClass for nodeClass in (Doorbell, DoorbellMotion, Camera, CameraLight) }
+
     def __init__(self, polyglot, parent, address, name, ringInterface):
         super(Controller, self).__init__(polyglot, parent, address, name)
 
         self.poly = polyglot
         self.ring = ringInterface
 
+        # Ring accounts: Account 1 uses ringInterface. Others are added by addAccount().
+        self.accounts = [ RingAccount(ringInterface) ]
+        self.lightsFailed = 0
+
+        # Names given to the nodes on the last discovery, and nodes to query once added
+        self.discoveredNames = {}
+        self.pendingQueries = set()
+        self.readyQueries = []
+        self.pendingLock = threading.Lock()
+
+        # Discovery and the warm start add and remove nodes: One at a time
+        self.discoveryLock = threading.RLock()
+
+        # Polls run on the Polyglot thread and on timers (Stagger, offline rechecks): One at a time
+        self.pollLock = threading.RLock()
+
+        # Ring events are routed to the nodes with this table, rebuilt when nodes are added or removed
+        self.webhookRouter = WebhookRouter()
+
+        # Nodes and their last known state, saved in the custom data for the next start
+        self.warmStart = WarmStart(ringInterface.customData)
+
+        # Ring events processed, by device
+        self.eventJournal = EventJournal()
+
+        # Timeout of the webhook test. The test webhook may be processed before testWebhook() returns.
+        self.webhookTimer = None
+        self.webhookTestLock = threading.Lock()
+
         polyglot.addNode(self, conn_status='ST')
+        self.webhookRouter.rebuild(self.getNodeList())
 
         LOGGER.info('Controller Initialized...')
 
+    # Add a Ring account, with its own RingInterface. Its polls are shifted from those of the previous accounts.
+    def addAccount(self, ringInterface):
+        stagger = self.ring.getNumericParam('poll_stagger_seconds', self.defaultPollStaggerSeconds, allowZero=True)
+        account = RingAccount(ringInterface, (ringInterface.account - 1) * stagger)
+        self.accounts.append(account)
+        return account
+
+    # Copy of the nodes. poly.nodes() iterates the nodes dict of the interface, which discovery may change on another thread.
+    def getNodeList(self):
+        return list(self.poly.getNodes().values())
+
+    def getAccount(self, number):
+        return next((account for account in self.accounts if account.number == number), None)
+
+    # Devices data of the account of a node
+    def getNodeDevices(self, node):
+        account = self.getAccount(node.ring.account)
+        return account.devices if account is not None else None
+
+    # Runs on the startup thread, or on the Polyglot thread (DISCOVER command): Discoveries run one at a time
     def discoverDevices(self, param=None):
-        userInfo = self.ring.getUserInfo()
+        with self.discoveryLock:
+            wanted = {}
+            complete = True
+
+            for account in self.accounts:
+                if self.discoverAccount(account):
+                    wanted.update(self.getWantedNodes(account))
+                else:
+                    complete = False
+
+            if not wanted and not complete:
+                return
+
+            LOGGER.info(f"Including shared devices: { self.ring.includeShared }")
+
+            # Nodes of an account which failed are kept
+            self.syncNodes(wanted, remove=complete)
+            self.saveWarmStart()
+
+    # Returns True if the user info and the devices of the account were fetched
+    def discoverAccount(self, account):
+        if len(self.accounts) > 1 and not account.ring.tokens.isAuthorized():
+            LOGGER.warning(f"Ring account { account.number } is not authenticated: Its devices are not discovered")
+            return False
+
+        # Both calls are independent
+        userInfo, account.devices = account.ring.runParallel(account.ring.getUserInfo, account.ring.getDeviceSnapshot)
 
-        userInfo = self.ring.getUserInfo()
         if userInfo is None:
-            LOGGER.error("Failed to get user info, aborting...")
-            return
+            LOGGER.error(f"Failed to get user info of account { account.number }, aborting...")
+            return False
+
+        account.userId = userInfo['user']['id']
+
+        LOGGER.info(f"User id of account { account.number } is: { account.userId }")
 
-        self.userId = userInfo['user']['id']
+        if account.devices is None:
+            LOGGER.error(f"Failed to get devices of account { account.number }, aborting...")
+            return False
 
-        LOGGER.info(f"User id is: { self.userId }")
+        LOGGER.info(f"Devices found in account { account.number }: { len(account.devices) }")
+        return True
+
+    # Add the nodes saved by the previous run, with their last known state, without calling Ring.
+    # Discovery then checks them against the Ring account. Returns True if nodes were restored.
+    def restoreWarmStart(self):
+        # A discovery in progress adds the nodes (CONFIGDONE again after an authentication)
+        if not self.discoveryLock.acquire(blocking=False):
+            return False
+
+        try:
+            return self._restoreWarmStart()
+        finally:
+            self.discoveryLock.release()
 
-        self.devices = self.ring.getAllDevices()
-        LOGGER.info(f"Devices: { self.devices }")
+    def _restoreWarmStart(self):
+        if any(account.devices is not None for account in self.accounts):
+            return False
 
-        LOGGER.info(f"Including shared devices: { self.ring.includeShared }")
+        state = self.warmStart.get()
 
-        doorbellsList = self.devices['doorbells']
+        if state is None:
+            LOGGER.info('No warm start state: Nodes are added by discovery')
+            return False
+
+        try:
+            restored = {}
+
+            for number, (userId, devices) in state['accounts'].items():
+                account = self.getAccount(int(number))
+
+                if account is not None:
+                    restored[account] = (userId, DeviceSnapshot.fromList(devices))
+
+            wanted = {}
+            drivers = {}
+
+            for address, (className, name, nodeDrivers) in state['nodes'].items():
+                account = self.getAccount(self.ring.addressToAccount(address))
+
+                if className in self.nodeClasses and account in restored:
+                    wanted[address] = (self.nodeClasses[className], name, account.ring)
+                    drivers[address] = nodeDrivers
+        except (KeyError, TypeError, ValueError) as error:
+            LOGGER.warning(f"Warm start state ignored: { error }")
+            return False
+
+        LOGGER.info(f"Restoring { len(wanted) } nodes of { len(restored) } accounts from the warm start state")
+
+        for account, (userId, devices) in restored.items():
+            account.userId = userId
+            account.devices = devices
+
+        # Nodes are only added: Removing the nodes of devices which are gone is left to discovery
+        self.syncNodes(wanted, drivers, remove=False)
+        return True
+
+    # Save the nodes and the devices data for the next start. Changes are saved at most every few minutes, unless forced.
+    def saveWarmStart(self, force=False):
+        accounts = [ account for account in self.accounts if account.devices is not None ]
+
+        if not accounts:
+            return
+
+        nodes = [ node for node in self.getNodeList() if node.address != self.address ]
+
+        if self.warmStart.save(accounts, nodes, force):
+            LOGGER.info(f"Warm start state saved: { len(nodes) } nodes")
+
+    # Nodes needed for the devices of an account: { address: (node class, name, RingInterface) }
+    def getWantedNodes(self, account):
+        ring = account.ring
+        wanted = {}
+        doorbellsList = account.devices.list(DeviceSnapshot.DOORBELLS)
 
         # Shared doorbells are in authorized_doorbells (For cams, they are in the same array)
-        if self.ring.includeShared:
-          doorbellsList += self.devices['authorized_doorbells']
-
-        for doorbellData in doorbellsList:
-            ownerId = doorbellData['owner']['id']
-
-            if ownerId == self.userId or self.ring.includeShared:
-                addressDoorbell = str(doorbellData['id']) + '_db'  # Has to be _db to receive ding events
-                nameDoorbell = doorbellData['description']
-                doorbell = Doorbell(self.poly, self.address, addressDoorbell, nameDoorbell, self.ring)
-                LOGGER.warn(f"Adding doorbell { addressDoorbell }: { nameDoorbell }")
-                self.poly.addNode(doorbell)
-
-                addressDoorbellMotion = str(doorbellData['id']) + '_m'   # Has to be _m to receive motion events
-                nameDoorbellMotion = doorbellData['description'] + ' (Motion)'
-                doorbellMotion = DoorbellMotion(self.poly, self.address, addressDoorbellMotion, nameDoorbellMotion, self.ring)
-                LOGGER.warn(f"Adding doorbell motion node { addressDoorbellMotion }: { nameDoorbellMotion }")
-                self.poly.addNode(doorbellMotion)
+        if ring.includeShared:
+          doorbellsList = doorbellsList + account.devices.list(DeviceSnapshot.AUTHORIZED_DOORBELLS)
+
+        for doorbell in doorbellsList:
+            if doorbell.ownerId == account.userId or ring.includeShared:
+                # Has to be _db to receive ding events, and _m to receive motion events
+                wanted[ring.makeAddress(doorbell.id, 'db')] = (Doorbell, doorbell.description, ring)
+                wanted[ring.makeAddress(doorbell.id, 'm')] = (DoorbellMotion, doorbell.description + ' (Motion)', ring)
             else:
-                LOGGER.warn(f"Adding doorbell { doorbellData['id'] } ({ doorbellData['description'] }) ignored: Doorbell is shared")
-
-        for camData in self.devices['stickup_cams']:
-            ownerId = camData['owner']['id']
+                LOGGER.debug('Doorbell %s (%s) ignored: Doorbell is shared', doorbell.id, doorbell.description)
 
-            if ownerId == self.userId or self.ring.includeShared:
-                addressCamera = str(camData['id']) + '_m'  # Has to be _m to receive motion events
-                nameCamera = camData['description'] + ' (Motion)'
-                camera = Camera(self.poly, self.address, addressCamera, nameCamera, self.ring)
-                LOGGER.warn(f"Adding camera { addressCamera }: { nameCamera }")
-                self.poly.addNode(camera)
+        for cam in account.devices.list(DeviceSnapshot.STICKUP_CAMS):
+            if cam.ownerId == account.userId or ring.includeShared:
+                # Has to be _m to receive motion events
+                wanted[ring.makeAddress(cam.id, 'm')] = (Camera, cam.description + ' (Motion)', ring)
 
-                kind = camData['kind']
-                typeData = DEVICE_TYPES.get(kind, None)
+                typeData = DEVICE_TYPES.get(cam.kind, None)
 
                 if typeData is None:
-                    LOGGER.error(f"Device kind { kind } is not defined.\nDevice info: { camData }\n*** Please contact UDI support and copy/paste this log. ***")
+                    LOGGER.error('Device kind %s is not defined.\nDevice info: %s\n*** Please contact UDI support and copy/paste this log. ***', cam.kind, cam)
                     continue
 
                 if typeData.get('lights', False) is True:
-                    addressCameraLight = str(camData['id']) + '_lt'
-                    nameCameraLight = camData['description'] + ' (Lights)'
-                    cameraLight = CameraLight(self.poly, self.address, addressCameraLight, nameCameraLight, self.ring)
-                    LOGGER.warn(f"Adding camera lighting node { addressCameraLight }: { nameCameraLight }")
-                    self.poly.addNode(cameraLight)
+                    wanted[ring.makeAddress(cam.id, 'lt')] = (CameraLight, cam.description + ' (Lights)', ring)
             else:
-                LOGGER.warn(f"Adding camera { camData['id'] } ({ camData['description'] }) ignored: Camera is shared")
+                LOGGER.debug('Camera %s (%s) ignored: Camera is shared', cam.id, cam.description)
+
+        return wanted
+
+    # Add the missing nodes, rename the nodes of devices renamed in Ring, and remove the nodes of devices which are gone.
+    # Nodes which are unchanged are left alone.
+    # drivers: { address: { driver: value } } Initial driver values of the added nodes
+    def syncNodes(self, wanted, drivers=None, remove=True):
+        with self.discoveryLock:
+            existing = { node.address: node for node in self.getNodeList() if node.address != self.address }
+
+            # Nodes created by a previous run, but not yet added in this run, with their names saved by PG3
+            inDb = { node['address']: node.get('name') for node in self.poly.getNodesFromDb() if node.get('address') != self.address }
+
+            added = []
+
+            for address, (nodeClass, name, ring) in wanted.items():
+                node = existing.get(address)
+
+                if node is None or not isinstance(node, nodeClass):
+                    LOGGER.warning('Adding %s node %s: %s', nodeClass.__name__, address, name)
+                    node = nodeClass(self.poly, self.address, address, name, ring)
+                    added.append(node)
+
+                    # Last known values, when restored from the warm start state
+                    savedDrivers = (drivers or {}).get(address, {})
+
+                    for driver in node.drivers:
+                        if driver['driver'] in savedDrivers:
+                            driver['value'] = savedDrivers[driver['driver']]
+
+                # Names changed in IoX are kept: Rename only when the name changed in Ring.
+                # The first discovery of a run compares with the names saved by PG3: Devices renamed while stopped are renamed too.
+                elif self.discoveredNames.get(address, inDb.get(address) or name) != name:
+                    LOGGER.warning('Renaming node %s: %s', address, name)
+                    self.poly.renameNode(address, name)
+
+                self.discoveredNames[address] = name
+
+            removed = (existing.keys() | inDb.keys()) - wanted.keys() if remove else set()
+
+            if removed and not wanted:
+                LOGGER.warning('No devices found: Existing nodes are kept')
+                removed = set()
 
+            for address in removed:
+                LOGGER.warning('Removing node %s: Device is no longer in the Ring account', address)
+                self.poly.delNode(address)
+                self.discoveredNames.pop(address, None)
 
-    # When node is added, automatically "query" using prefetched devices data from discoverDevices
+            LOGGER.info(f"Discovery done: { len(added) } nodes added, { len(removed) } removed, { len(wanted) } in total")
+
+            # New nodes are queried once PG3 has added them all
+            with self.pendingLock:
+                self.pendingQueries.update(node.address for node in added)
+
+            for node in added:
+                self.poly.addNode(node)
+
+            if added or removed:
+                self.webhookRouter.rebuild(self.getNodeList())
+
+    # When nodes are added, automatically "query" them using prefetched devices data from discoverDevices
+    # They are queried together when the last one is added.
     def addNodeDoneHandler(self, nodeData):
         address = nodeData['address']
 
-        for node in self.poly.nodes():
-            if node.address == address and hasattr(node, 'queryWithPrefetched'):
-                node.queryWithPrefetched(self.devices)
+        with self.pendingLock:
+            if address not in self.pendingQueries:
+                return
+
+            self.pendingQueries.discard(address)
+            node = self.poly.getNode(address)
+
+            if node is not None and hasattr(node, 'queryWithPrefetched'):
+                self.readyQueries.append(node)
+
+            if self.pendingQueries:
+                return
+
+        self.flushPendingQueries()
+
+    # Query the nodes added since the last discovery, even if some are still pending
+    def flushPendingQueries(self):
+        with self.pendingLock:
+            ready, self.readyQueries = self.readyQueries, []
+
+        for node in ready:
+            node.queryWithPrefetched(self.getNodeDevices(node), True)
+
+    # Short poll: With adaptive polling (Opt-in), devices data of an account is fetched only when one of its devices is due for a refresh
+    # accounts: Accounts to poll, all by default
+    def shortPoll(self, accounts=None):
+        accounts = accounts or self.accounts
+        adaptive = 'adaptive_poll' in self.ring.customParams and self.ring.customParams['adaptive_poll'].lower() == 'true'
+
+        if not adaptive:
+            self.staggeredPoll(accounts)
+            return
+
+        due = [ account for account in accounts if account.scheduler.isDue() ]
+
+        if not due:
+            LOGGER.debug('No device due for a refresh, next one in %ds', min(account.scheduler.secondsUntilDue() for account in accounts))
+            self.reportMetrics()
+            return
+
+        self.queryAll(accounts=due)
+
+    # Without adaptive polling, every short poll refreshes all accounts. Accounts with a poll offset are refreshed that
+    # many seconds later. A delayed poll which has not run yet is not rescheduled: Offsets longer than the short poll
+    # interval skip polls instead of piling them up.
+    def staggeredPoll(self, accounts):
+        now = [ account for account in accounts if account.pollOffset <= 0 ]
+
+        for account in accounts:
+            if account.pollOffset > 0 and (account.staggerTimer is None or not account.staggerTimer.is_alive()):
+                account.staggerTimer = threading.Timer(account.pollOffset, self.queryAll, kwargs={ 'accounts': [ account ] })
+                account.staggerTimer.daemon = True
+                account.staggerTimer.start()
+
+        if now:
+            self.queryAll(accounts=now)
+        else:
+            self.reportMetrics()
+
+    # Refresh an account again soon after a device went offline, to confirm its state.
+    # The schedule is not reset: The next short poll would fetch the devices data again.
+    def scheduleOfflineRecheck(self, account, deviceIds):
+        LOGGER.info(f"Devices { deviceIds } went offline, refreshing again in { self.offlineRecheckSeconds }s")
+
+        if account.offlineRecheckTimer is not None:
+            account.offlineRecheckTimer.cancel()
+
+        account.offlineRecheckTimer = threading.Timer(self.offlineRecheckSeconds, self.queryAll, kwargs={ 'accounts': [ account ], 'countPoll': False })
+        account.offlineRecheckTimer.daemon = True
+        account.offlineRecheckTimer.start()
+
+    # Nodes report only the drivers which changed, except when QUERYALL is used from IoX (param is set)
+    # or every full_report_polls polls of their account. This makes sure that IoX properties are never left blank.
+    # accounts: Accounts to refresh, all by default
+    # countPoll: False for the extra refreshes (Offline rechecks): They don't move the full reports
+    def queryAll(self, param=None, accounts=None, countPoll=True):
+        with self.pollLock:
+            with metrics.timer('poll.duration') as timer:
+                forceReport = self.refreshNodes(accounts or self.accounts, param is not None, countPoll)
+
+            self.setDriver('GV1', round(timer.ms), True, forceReport)
+            self.reportMetrics(forceReport)
+            self.saveWarmStart()
+
+    # Counts a poll of the account. Returns True if its nodes must report all their drivers on this poll.
+    def countPoll(self, account):
+        fullReportPolls = int(self.ring.getNumericParam('full_report_polls', self.defaultFullReportPolls, allowZero=True))
+        account.pollCount += 1
+        return fullReportPolls > 0 and account.pollCount % fullReportPolls == 0
+
+    # Returns True if at least one account was fully reported
+    def refreshNodes(self, accounts, forceReport, countPoll=True):
+        # Devices data of the accounts which changed: { account number: snapshot }
+        changed = {}
+
+        # Accounts whose nodes report all their drivers
+        fullReport = set()
+
+        for account in accounts:
+            if (countPoll and self.countPoll(account)) or forceReport:
+                fullReport.add(account.number)
+
+            # Prefetch devices data
+            previousDevices = account.devices
+            account.devices = account.ring.getDeviceSnapshot()
+
+            if account.devices is not None:
+                wentOffline = account.scheduler.update(account.devices)
+
+                if wentOffline:
+                    self.scheduleOfflineRecheck(account, wentOffline)
+
+            # The payload has not changed since last poll: Nothing to update
+            if account.devices is not None and account.devices is previousDevices and account.number not in fullReport:
+                LOGGER.debug(f"Devices data of account { account.number } has not changed, skipping node updates")
+            else:
+                changed[account.number] = account.devices
+
+        # The nodes of the changed accounts are queried below
+        with self.pendingLock:
+            self.readyQueries = [ node for node in self.readyQueries if node.ring.account not in changed ]
 
-    def queryAll(self, param=None):
-        # Prefetch devices data
-        self.devices = self.ring.getAllDevices()
-        LOGGER.debug(f'Devices: { self.devices }')
+        self.flushPendingQueries()
 
-        for node in self.poly.nodes():
-            if hasattr(node, 'queryWithPrefetched'):
+        for node in self.getNodeList():
+            if hasattr(node, 'queryWithPrefetched') and node.ring.account in changed:
                 # Run a query on all devices with prefetched data
-                node.queryWithPrefetched(self.devices)
+                node.queryWithPrefetched(changed[node.ring.account], node.ring.account in fullReport)
+            elif hasattr(node, 'reconcile'):
+                # Lights check their last command against the devices data, even if it has not changed
+                node.reconcile(self.getNodeDevices(node))
+
+        return len(fullReport) > 0
+
+    # Metrics drivers: API error rate over the last 15 minutes, events received per minute and events ignored over the last 5 minutes
+    def reportMetrics(self, forceReport=False):
+        calls = metrics.countSince('api.calls', self.errorRateSeconds)
+        errors = metrics.countSince('api.errors', self.errorRateSeconds)
+
+        self.setDriver('GV2', round(errors * 100 / calls, 1) if calls else 0, True, forceReport)
+        self.setDriver('GV3', round(metrics.ratePerMinute('webhooks.received', self.eventRateSeconds), 1), True, forceReport)
+        self.setDriver('GV4', metrics.countSince('webhooks.ignored', self.eventRateSeconds), True, forceReport)
+
+    # Turn all the camera lights on or off at the same time, on the async clients: The command returns immediately.
+    # Light nodes report their new state right away, and send DON/DOF if they succeeded. GV5 is the number of lights which failed.
+    def setAllLights(self, on):
+        lightsByAccount = {}
+
+        for node in self.getNodeList():
+            if isinstance(node, CameraLight):
+                lightsByAccount.setdefault(node.ring, {})[node.deviceId] = node
+
+        LOGGER.info(f"Turning { 'on' if on else 'off' } { sum(len(lights) for lights in lightsByAccount.values()) } lights")
+
+        with self.pendingLock:
+            self.lightsFailed = 0
+
+        futures = []
+
+        # Each account has its own client
+        for ring, lights in lightsByAccount.items():
+            client = ring.asyncClient
+            start = min(light.commandSent(on) for light in lights.values())
+            future = client.submit(client.setFloodlights(list(lights), on))
+            future.add_done_callback(lambda done, lights=lights, start=start: self.allLightsDone(lights, self.getLightsResults(done, lights), on, start))
+            futures.append(future)
+
+        return futures
+
+    # Results of an all lights call: { deviceId: True if successful }. If the call itself failed, all its lights failed.
+    def getLightsResults(self, future, lights):
+        try:
+            return future.result()
+        except Exception as error:
+            LOGGER.error(f"All lights call failed: { error }")
+            return { deviceId: False for deviceId in lights }
+
+    def allLightsDone(self, lights, results, on, start):
+        for deviceId, success in results.items():
+            lights[deviceId].commandDone(on, start, success)
+
+            if success:
+                lights[deviceId].reportCmd('DON' if on else 'DOF')
+            else:
+                LOGGER.error(f"Failed to turn { 'on' if on else 'off' } light { lights[deviceId].address } ({ lights[deviceId].name })")
+
+        with self.pendingLock:
+            self.lightsFailed += sum(1 for success in results.values() if not success)
+            lightsFailed = self.lightsFailed
+
+        self.setDriver('GV5', lightsFailed, True, True)
+
+    def lightsOn(self, param=None):
+        self.setAllLights(True)
+
+    def lightsOff(self, param=None):
+        self.setAllLights(False)
+
+    # Ring device names, from the devices data of the accounts: { deviceId: name }
+    def getDeviceNames(self):
+        names = {}
+
+        for account in self.accounts:
+            if account.devices is not None:
+                names.update({ state.id: state.description for state in account.devices.byId.values() })
+
+        return names
+
+    # Log the most recent events of all the devices, oldest first
+    def logEvents(self, param=None):
+        events = self.eventJournal.query(limit=self.recentEventsLogged)
+        names = self.getDeviceNames()
+
+        LOGGER.info(f"Last { len(events) } events: { self.eventJournal.getStats() }")
+
+        for event in events:
+            receivedAt = datetime.fromtimestamp(event.timestamp).isoformat(sep=' ', timespec='milliseconds')
+            LOGGER.info(f"{ receivedAt } { names.get(event.deviceId, '') } ({ event.deviceId }): { event.event } { event.outcome } in { event.latency }ms, event id { event.eventId }")
+
+    # Export the events journal to a CSV file, included in the log package
+    def exportEvents(self, param=None):
+        try:
+            count = self.eventJournal.export(self.eventsExportPath, self.getDeviceNames())
+        except OSError as error:
+            LOGGER.error(f"Events export to { self.eventsExportPath } failed: { error }")
+            return
+
+        LOGGER.info(f"Exported { count } events to { self.eventsExportPath }")
 
     def test(self, param=None):
         try:
@@ -177,11 +611,22 @@ class Controller(Node):
                }
             }
 
-            self.ring.testWebhook(body)
-            LOGGER.info('Webhook test message sent successfully.')
+            # Started before sending: The webhook may be received before testWebhook() returns
+            with self.webhookTestLock:
+                if self.webhookTimer is not None:
+                    self.webhookTimer.cancel()
+
+                self.webhookTimer = threading.Timer(self.webhookTestTimeoutSeconds, self.webhookTimeout)
+                self.webhookTimer.daemon = True
+                self.webhookTimer.start()
+
+            try:
+                self.ring.testWebhook(body)
+            except Exception:
+                self.cancelWebhookTimer()
+                raise
 
-            self.webhookTimer = threading.Timer(self.webhookTestTimeoutSeconds, self.webhookTimeout)
-            self.webhookTimer.start()
+            LOGGER.info('Webhook test message sent successfully.')
 
         except requests.exceptions.HTTPError as error:
             if error.response.status_code == 401:
@@ -196,23 +641,46 @@ class Controller(Node):
             self.setDriver('GV0', 4, True, True) # 4=failure
 
     # This is called when the webhook is not received on time
+    # Runs on the timer thread
     def webhookTimeout(self):
+        with self.webhookTestLock:
+            # The webhook was received, or another test started
+            if self.webhookTimer is not threading.current_thread():
+                return
+
+            self.webhookTimer = None
+
         if self.getDriver('GV0') == 1: # Test in progress
             LOGGER.error(f"Webhook test message timed out after { self.webhookTestTimeoutSeconds } seconds.")
             self.setDriver('GV0', 3, True, True) # 3=Timeout
 
+    # Returns True if a webhook test was in progress
+    def cancelWebhookTimer(self):
+        with self.webhookTestLock:
+            timer, self.webhookTimer = self.webhookTimer, None
+
+        if timer is None:
+            return False
+
+        timer.cancel()
+        return True
+
     # This is called when we test webhooks - We successfully received it.
+    # Runs on the webhook queue workers: It may run before test() returns.
     def activate(self):
-        if self.getDriver('GV0') == 1: # Test in progress
+        if self.cancelWebhookTimer() and self.getDriver('GV0') == 1: # Test in progress
             LOGGER.info('Webhook test message received successfully.')
-            self.webhookTimer.cancel()
             self.setDriver('GV0', 2, True, True) # 2=Success
 
     # The commands here need to match what is in the nodedef profile file.
     commands = {
         'DISCOVER': discoverDevices,
         'QUERYALL': queryAll,
-        'TEST': test
+        'TEST': test,
+        'LIGHTSON': lightsOn,
+        'LIGHTSOFF': lightsOff,
+        'LOGEVENTS': logEvents,
+        'EXPORTEVENTS': exportEvents
     }
 
 
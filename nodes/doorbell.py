@@ -42,53 +42,36 @@ class Doorbell(Node):
         self.reportCmd('DON')
 
     # Only nodes with this method can be globally refreshed
-    def queryWithPrefetched(self, prefetched):
-        self.query(prefetched)
+    # Drivers are reported only if they changed, unless forceReport is True
+    def queryWithPrefetched(self, prefetched, forceReport=False):
+        state = self.ring.getDeviceState(self.deviceId, prefetched)
 
-    # Query for a single node with the possibility of passing prefetched devices data
-    def query(self, prefetched=None):
-        deviceData = self.ring.getDeviceData(self.deviceId, prefetched)
+        LOGGER.info('Query for node %s (%s)', self.address, self.name)
 
-        LOGGER.info(f"Query for node { self.address } ({ self.name })")
-
-        if deviceData is None:
+        if state is None:
             LOGGER.info(f"Ring device id { self.deviceId } not found")
-            self.setDriver('ST', 0, True, True)
+            self.setDriver('ST', 0, True, forceReport)
             return
 
-        LOGGER.debug(f"Device data: { deviceData }")
-
-        try:
-            # Device is online?
-            online = 1 if deviceData['alerts']['connection'] == 'online' else 0
-        except KeyError:
-            # If the device is not found in the devices data, mark it offline
-            online = 0
+        LOGGER.debug('Device state: %s', state)
 
-        self.setDriver('ST', online, True, True, text='online')
+        self.setDriver('ST', 1 if state.online else 0, True, forceReport, text='online')
 
         # Devices may have battery_life, others have battery_voltage
-        try:
-            bat = deviceData['battery_life']
-            self.setDriver('BATLVL', bat, True, True)
-        except KeyError:
-            pass
+        if state.batteryLife is not None:
+            self.setDriver('BATLVL', state.batteryLife, True, forceReport)
 
         # Some devices have 2 batteries.
-        try:
-            bat2 = deviceData['battery_life_2']
-            self.setDriver('GV0', bat2, True, True)
-        except KeyError:
-            pass
-
-        try:
-            batmv = deviceData['battery_voltage']
-            self.setDriver('GV1', batmv, True, True)
-        except KeyError:
-            pass
-
-        # Always report, even if it has not changed
-        # self.reportDrivers()
+        if state.batteryLife2 is not None:
+            self.setDriver('GV0', state.batteryLife2, True, forceReport)
+
+        if state.batteryVoltage is not None:
+            self.setDriver('GV1', state.batteryVoltage, True, forceReport)
+
+    # QUERY command: Report all drivers, even if they have not changed
+    # Devices data younger than query_max_age is reused. Concurrent queries share the same fetch.
+    def query(self, param=None):
+        self.queryWithPrefetched(None, True)
 
     # The commands here need to match what is in the nodedef profile file.
     commands = {
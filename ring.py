@@ -11,24 +11,53 @@ MIT License
 
 import sys
 import json
+import threading
+import time
 import traceback
 from udi_interface import LOGGER, Custom, Interface
 from lib.ringInterface import RingInterface
+from lib.eventQueue import EventQueue
+from lib.eventCoalescer import EventCoalescer
+from lib.subscriptionManager import SubscriptionManager
+from lib.metrics import metrics
+from lib.logUtils import LazyRepr
 from nodes.controller import Controller
 
 validEvents = [ 'new-ding', 'new-motion', 'webhook-test' ]
 # Event 'new-on_demand' is sent when someone uses Live view
 
+# Accounts are named by a letter in the node addresses
+maxAccounts = 26
+
 
 polyglot = None
 ringInterface = None
 controller = None
+webhookQueue = None
+eventCoalescer = None
+startupThread = None
+
+# Custom namespaces received from Polyglot (oAuth config & tokens), given to the accounts added later
+customNs = {}
 
 def configDoneHandler():
+    global startupThread
+
     polyglot.Notices.clear()
 
+    # Custom params are loaded: We can start processing webhooks
+    webhookQueue.start()
+
+    # Nodes saved by the previous run report their last known state right away
+    controller.restoreWarmStart()
+
+    # Tokens, discovery and subscription may wait for Ring: They run in the background
+    startupThread = threading.Thread(target=startRing, name='startRing', daemon=True)
+    startupThread.start()
+
+def startRing():
     try:
-        ringInterface.getAccessToken()
+        ringInterface.tokens.getAuthorizationHeader()
     except ValueError as err:
         LOGGER.warning('Access token is not yet available. Please authenticate.')
         polyglot.Notices['auth'] = 'Please initiate authentication'
@@ -36,119 +65,263 @@ def configDoneHandler():
 
     try:
         controller.discoverDevices()
-        ringInterface.subscribe()
+
+        for account in getAuthorizedAccounts():
+            account.ring.subscribe()
     except ValueError as err:
-        LOGGER.debug(f"Error in configDoneHandler: {err}")
+        LOGGER.debug(f"Error in startRing: {err}")
+
+# Accounts with tokens. Account 1 is required: Other accounts are linked after it.
+# Uses the cached tokens state only: No token refresh on the caller's thread.
+def getAuthorizedAccounts():
+    return [ account for account in controller.accounts if account.ring.tokens.hasTokens() ]
+
+# Add the accounts set by the custom param 'accounts'. Accounts are not removed until restart.
+def configureAccounts(count, customParams):
+    count = min(int(count), maxAccounts)
+
+    while len(controller.accounts) < count:
+        account = RingInterface(polyglot, len(controller.accounts) + 1)
+
+        for key, data in customNs.items():
+            account.customNsHandler(key, data)
+
+        account.customParamsHandler(customParams)
+        controller.addAccount(account)
+        LOGGER.info(f"Ring account { account.account } added, with node addresses prefixed by '{ account.addressPrefix }'")
+
+    if len(controller.accounts) > count:
+        LOGGER.warning(f"{ len(controller.accounts) } Ring accounts are in use: Restart the node server to remove accounts")
+
+def customNsHandler(key, data):
+    # PG3 sends CUSTOMNS(None, None) at the end of getAll when the node server has no custom namespace
+    if key is None:
+        return
 
+    customNs[key] = data
+
+    for account in controller.accounts:
+        account.ring.customNsHandler(key, data)
+
+
+def customParamsHandler(customParams):
+    for account in controller.accounts:
+        account.ring.customParamsHandler(customParams)
+
+    configureAccounts(ringInterface.getNumericParam('accounts', 1), customParams)
+
+    webhookQueue.configure(
+        workers=int(ringInterface.getNumericParam('webhook_workers', 2)),
+        maxSize=int(ringInterface.getNumericParam('webhook_queue_size', 100)),
+        overflow=ringInterface.customParams['webhook_overflow'] if 'webhook_overflow' in ringInterface.customParams else None
+    )
+
+    # Events for the same node within this window are reported once. 0 disables it.
+    eventCoalescer.window = ringInterface.getNumericParam('coalesce_seconds', 5, allowZero=True)
 
 def oauthHandler(token):
-    LOGGER.info('Authentication successful {}'.format(json.dumps(token)))
+    LOGGER.info('Authentication successful %s', LazyRepr(token))
+
+    # PG3 has one authentication per node server: The custom param link_account says which account it is for
+    account = controller.getAccount(int(ringInterface.getNumericParam('link_account', 1)))
+
+    if account is None:
+        LOGGER.warning('link_account is not one of the accounts: Tokens are used for account 1')
+        account = controller.accounts[0]
+
     # When user just authorized, the ringInterface needs to store the tokens
-    ringInterface.oauthHandler(token)
+    LOGGER.info(f"Tokens received for Ring account { account.number }")
+    account.ring.oauthHandler(token)
 
     # Then proceed with device discovery
     configDoneHandler()
 
 def pollHandler(pollType):
-    try:
-        ringInterface.getAccessToken()
-    except ValueError as err:
+    # The accounts without tokens are skipped. The check itself does no token work on the Polyglot thread.
+    accounts = getAuthorizedAccounts()
+
+    if not accounts:
         LOGGER.info('Poll skipped as we are not authenticated to Ring.')
         polyglot.Notices['auth'] = 'Please initiate authentication'
         return
 
-
     if pollType == 'longPoll':
-        ringInterface.subscribe()
+        for account in accounts:
+            account.ring.maintainSubscription()
+
+        LOGGER.info(f"Webhook queue: { webhookQueue.getStats() }")
+        LOGGER.info(f"Webhook events: { eventCoalescer.getStats() }")
+        controller.eventJournal.flush()
+        LOGGER.info(f"Events journal: { controller.eventJournal.getStats() }")
+        LOGGER.info('Metrics: %s', LazyRepr(metrics.snapshot(), maxLength=None))
     else:
-        controller.queryAll()
+        controller.shortPoll(accounts)
 
 def addNodeDoneHandler(node):
     # We will automatically query the device after discovery
     controller.addNodeDoneHandler(node)
 
 def stopHandler():
+    # Saved before the nodes are set offline: The next start restores their last known state
+    controller.saveWarmStart(force=True)
+
     # Set nodes offline
-    for node in polyglot.nodes():
+    for node in controller.getNodeList():
         if hasattr(node, 'setOffline'):
             node.setOffline()
+    webhookQueue.stop()
+
+    # Events processed by the queue are written to the journal file
+    controller.eventJournal.flush()
+
+    for account in controller.accounts:
+        # Delayed polls must not run on a closed interface
+        for timer in (account.staggerTimer, account.offlineRecheckTimer):
+            if timer is not None:
+                timer.cancel()
+
+        account.ring.close()
+
     polyglot.stop()
 
+# Runs on the Polyglot callback thread: Only validate and route the webhook, and queue it.
+# Events are processed by the webhook queue workers, in arrival order for each device.
+# Invalid webhooks are rejected as early as possible: The pragma before parsing the body, unknown devices before queuing.
 def webhookHandler(data):
     # TEST FOR NEST:
     #polyglot.webhookResponse()
     #LOGGER.info(f"-------------Returning RESPONSE---------")
 
     # Available information: headers, query, body
-    LOGGER.info(f"Webhook received: { data }")
-    receivedPragma = data['headers']['pragma']
-    currentPragma = ringInterface.getCurrentPragma()
+    receivedAt = time.perf_counter()
+    LOGGER.debug('Webhook received: %s', LazyRepr(data))
+    metrics.increment('webhooks.received')
 
-    # Ignore webhooks if they don't have the right pragma
-    if receivedPragma != currentPragma:
-        LOGGER.info(f"Expected pragma { currentPragma }, receivedPragma { receivedPragma }: Webhook is ignored.")
+    # Ignore webhooks if they don't have the right pragma. Each account has its own subscription and pragma.
+    receivedPragma = data['headers'].get('pragma')
+    account = next((account for account in controller.accounts if account.ring.isValidPragma(receivedPragma)), None)
+
+    if account is None:
+        LOGGER.info('Webhook received with an invalid pragma: Webhook is ignored.')
+        metrics.increment('webhooks.ignored', 'pragma')
         return
 
-    LOGGER.info(f"Webhook body received: { data['body'] }")
-    eventInfo = json.loads(data['body'])
+    # Webhooks are getting through: The subscription is healthy
+    account.ring.subscriptions.webhookReceived()
 
-    event = eventInfo['event'] # 'new-ding' or 'new-motion'
-    id = eventInfo['data']['doorbell']['id']
-    deviceName = eventInfo['data']['doorbell']['description']
+    try:
+        eventInfo = json.loads(data['body'])
+        event = eventInfo['event'] # 'new-ding' or 'new-motion'
+        id = eventInfo['data']['doorbell']['id']
+    except (ValueError, KeyError, TypeError):
+        LOGGER.info('Webhook received with an invalid body: Webhook is ignored.')
+        metrics.increment('webhooks.ignored', 'invalidBody')
+        return
 
     if event not in validEvents:
         LOGGER.info(f"Invalid event received: { event }")
+        metrics.increment('webhooks.ignored', 'invalidEvent')
         return
 
-    if event == 'new-ding':
-        address = str(id) + '_db'
-    elif event == 'new-motion':
-        address = str(id) + '_m'
-    elif event == 'webhook-test':
-        address = id
+    if event == 'webhook-test' and id == SubscriptionManager.healthCheckId:
+        account.ring.subscriptions.healthCheckPassed()
+        return
 
-    LOGGER.info(f"Event { event } for address { address } ({ deviceName })")
+    node = controller.webhookRouter.route(account.number, id, event)
 
-    node = polyglot.getNode(address)
+    if node is None:
+        if controller.webhookRouter.isKnown(account.number, id):
+            LOGGER.info('Event %s of device %s ignored: No node receives it', event, id)
+            metrics.increment('webhooks.ignored', 'unknownNode')
+        else:
+            LOGGER.info('Event %s of device %s ignored: Unknown device', event, id)
+            metrics.increment('webhooks.ignored', 'unknownDevice')
+        return
 
-    if node is not None:
-        node.activate()
-    else:
-        LOGGER.info(f"Node { address } not found")
+    webhookQueue.submit(str(id), (receivedAt, event, node, getEventId(eventInfo)))
 
-if __name__ == "__main__":
-    try:
-        polyglot = Interface([], { "enableWebhook": True })
-        polyglot.start({ 'version': '1.2.7', 'requestId': True })
+# Runs on the webhook queue workers. Measures the time from reception to the command sent to IoX.
+# Events of the devices are added to the events journal, with their outcome.
+def processQueuedWebhook(queued):
+    receivedAt, event, node, eventId = queued
+
+    sent = processWebhookEvent(event, node, eventId)
+    latency = (time.perf_counter() - receivedAt) * 1000
+
+    if sent:
+        metrics.observe('webhooks.latency', latency, event)
 
-        # Show the help in PG3 UI under the node's Configuration option
-        polyglot.setCustomParamsDoc()
-        # Update the profile files
-        polyglot.updateProfile()    # Use checkProfile() instead?
+    deviceId = getattr(node, 'deviceId', None)
 
-        # Implements the API calls & Handles the oAuth authentication & token renewals
-        ringInterface = RingInterface(polyglot)
+    if deviceId is not None:
+        controller.eventJournal.add(deviceId, event, eventId, latency, 'sent' if sent else 'coalesced', time.time() - latency / 1000)
 
-        # Create the controller node
-        controller = Controller(polyglot, 'controller', 'controller', 'Ring', ringInterface)
+# Ring event id, used to detect duplicate deliveries of the same event
+def getEventId(eventInfo):
+    data = eventInfo.get('data') or {}
+    ding = data.get('ding') or {}
+    return ding.get('id', data.get('id'))
 
-        #polyglot.webhookStart({ "name": "Ring" })
-        # Tests for Tesla
-        polyglot.webhookStart({"name": "Ring"})
+# Returns True if the event was sent to the node
+def processWebhookEvent(event, node, eventId):
+    LOGGER.info('Event %s for address %s (%s)', event, node.address, node.name)
 
-        # subscribe to the events we want
-        polyglot.subscribe(polyglot.POLL, pollHandler)
-        polyglot.subscribe(polyglot.STOP, stopHandler)
-        polyglot.subscribe(polyglot.CUSTOMDATA, ringInterface.customDataHandler) # Used for migration from older OAuth class
-        polyglot.subscribe(polyglot.CUSTOMNS, ringInterface.customNsHandler)  # oAuth config & tokens saved
-        polyglot.subscribe(polyglot.CUSTOMPARAMS, ringInterface.customParamsHandler) # UI params
-        polyglot.subscribe(polyglot.OAUTH, oauthHandler) # oAuth tokens received after authentication
-        polyglot.subscribe(polyglot.WEBHOOK, webhookHandler)
-        polyglot.subscribe(polyglot.CONFIGDONE, configDoneHandler)
-        polyglot.subscribe(polyglot.ADDNODEDONE, addNodeDoneHandler)
+    # Repeated events within the coalescing window are reported only once
+    if event != 'webhook-test' and not eventCoalescer.accept(node.address, eventId):
+        LOGGER.info('Event %s for address %s coalesced', event, node.address)
+        metrics.increment('webhooks.ignored', 'coalesced')
+        return False
+
+    node.activate()
+    return True
+
+# Create the Ring interface and the controller, and subscribe to the Polyglot events.
+# polyglot must be set and started. This is also used by tools/fakePolyglot.py to run the node server without PG3.
+def initialize():
+    global ringInterface, controller, webhookQueue, eventCoalescer
+
+    # Show the help in PG3 UI under the node's Configuration option
+    polyglot.setCustomParamsDoc()
+    # Update the profile files
+    polyglot.updateProfile()    # Use checkProfile() instead?
+
+    # Received again from Polyglot on each start
+    customNs.clear()
+
+    # Implements the API calls & Handles the oAuth authentication & token renewals
+    ringInterface = RingInterface(polyglot)
+
+    # Webhooks are processed outside of the Polyglot callback thread
+    webhookQueue = EventQueue(processQueuedWebhook, name='webhook', onDrop=lambda: metrics.increment('webhooks.ignored', 'queueFull'))
+    eventCoalescer = EventCoalescer()
+
+    # Create the controller node
+    controller = Controller(polyglot, 'controller', 'controller', 'Ring', ringInterface)
+
+    #polyglot.webhookStart({ "name": "Ring" })
+    # Tests for Tesla
+    polyglot.webhookStart({"name": "Ring"})
+
+    # subscribe to the events we want
+    polyglot.subscribe(polyglot.POLL, pollHandler)
+    polyglot.subscribe(polyglot.STOP, stopHandler)
+    polyglot.subscribe(polyglot.CUSTOMDATA, ringInterface.customDataHandler) # Used for migration from older OAuth class
+    polyglot.subscribe(polyglot.CUSTOMNS, customNsHandler)  # oAuth config & tokens saved
+    polyglot.subscribe(polyglot.CUSTOMPARAMS, customParamsHandler) # UI params
+    polyglot.subscribe(polyglot.OAUTH, oauthHandler) # oAuth tokens received after authentication
+    polyglot.subscribe(polyglot.WEBHOOK, webhookHandler)
+    polyglot.subscribe(polyglot.CONFIGDONE, configDoneHandler)
+    polyglot.subscribe(polyglot.ADDNODEDONE, addNodeDoneHandler)
+
+    # We can start receive events
+    polyglot.ready()
+
+if __name__ == "__main__":
+    try:
+        polyglot = Interface([], { "enableWebhook": True })
+        polyglot.start({ 'version': '1.3.0', 'requestId': True })
 
-        # We can start receive events
-        polyglot.ready()
+        initialize()
 
         # Just sit and wait for events
         polyglot.runForever()
@@ -158,4 +331,4 @@ if __name__ == "__main__":
 
     except Exception:
         LOGGER.error(f"Error starting Ring: {traceback.format_exc()}")
-        polyglot.stop()
\ No newline at end of file
+        polyglot.stop()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - asyncio Ring client tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import asyncio
+import threading
+import time
+import unittest
+import lib.asyncRingClient
+from lib.asyncRingClient import AsyncRingClient, aiohttp
+from lib.retryPolicy import CircuitBreaker, RetryPolicy, TokenBucket
+
+# Stand-in for the RingInterface: Only the state shared with the async client
+class FakeRing:
+    def __init__(self):
+        self.circuitBreaker = CircuitBreaker(failureThreshold=5, resetTimeout=60)
+        self.retryPolicy = RetryPolicy(maxAttempts=1)
+        self.rateLimiter = TokenBucket()
+        self.calls = []
+
+    def getEndpoint(self, completeUrl):
+        return '/devices'
+
+    def recordCall(self, method, endpoint, status, start):
+        self.calls.append(status)
+
+    # Synchronous call, used when aiohttp is not installed
+    def _callApi(self, method='GET', url=None, body=None, idempotent=None, decode=None, useCache=True):
+        self.calls.append((method, url, threading.current_thread().name))
+        self.useCache = useCache
+
+        if url.startswith('/devices/0/'):
+            raise ConnectionError('Simulated failure')
+
+        return {}
+
+# Every request fails with error, before a response is returned
+class FailingSession:
+    closed = False
+
+    def __init__(self, error):
+        self.error = error
+
+    def request(self, method, url, **kwargs):
+        return self
+
+    async def __aenter__(self):
+        raise self.error
+
+    async def __aexit__(self, *args):
+        return False
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncRingClientTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = FakeRing()
+        self.client = AsyncRingClient(self.ring)
+
+    def send(self, error):
+        self.client._session = FailingSession(error)
+        return asyncio.run(self.client._sendWithRetry('GET', 'http://ring/devices', {}, None, None))
+
+    # The breaker lets a trial call through
+    def halfOpen(self):
+        breaker = self.ring.circuitBreaker
+        breaker.state = CircuitBreaker.OPEN
+        breaker._openedAt = time.monotonic() - breaker.resetTimeout
+
+    def test_payloadErrorOnTrialReopens(self):
+        self.halfOpen()
+
+        with self.assertRaises(aiohttp.ClientPayloadError):
+            self.send(aiohttp.ClientPayloadError('Response payload is not completed'))
+
+        self.assertEqual(self.ring.circuitBreaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.ring.calls, [ 'ClientPayloadError' ])
+
+    def test_clientErrorOnTrialReopens(self):
+        self.halfOpen()
+
+        with self.assertRaises(aiohttp.TooManyRedirects):
+            self.send(aiohttp.TooManyRedirects(None, ()))
+
+        self.assertEqual(self.ring.circuitBreaker.state, CircuitBreaker.OPEN)
+
+    def test_clientErrorCountsAsFailure(self):
+        for attempt in range(self.ring.circuitBreaker.failureThreshold):
+            with self.assertRaises(aiohttp.ClientResponseError):
+                self.send(aiohttp.ClientResponseError(None, (), status=400, message='Bad redirect'))
+
+        self.assertEqual(self.ring.circuitBreaker.state, CircuitBreaker.OPEN)
+
+# Without aiohttp, the calls are made by the RingInterface on the loop's executor
+class WithoutAiohttpTest(unittest.TestCase):
+    def setUp(self):
+        self.aiohttp = lib.asyncRingClient.aiohttp
+        lib.asyncRingClient.aiohttp = None
+        self.ring = FakeRing()
+        self.client = AsyncRingClient(self.ring)
+
+    def tearDown(self):
+        self.client.stop()
+        lib.asyncRingClient.aiohttp = self.aiohttp
+
+    def test_callsUseSynchronousSession(self):
+        results = self.client.submit(self.client.setFloodlights([ 0, 1, 2 ], True)).result(5)
+
+        self.assertEqual(results, { 0: False, 1: True, 2: True })
+        self.assertEqual(sorted(url for method, url, thread in self.ring.calls), [ f"/devices/{ id }/floodlight_on" for id in range(3) ])
+
+        # Not on the caller's thread, nor on the loop thread
+        threads = { thread for method, url, thread in self.ring.calls }
+        self.assertNotIn(threading.current_thread().name, threads)
+        self.assertNotIn('ringAsync', threads)
+
+    def test_testApiCallNotCached(self):
+        self.client.submit(self.client.testApiCall()).result(5)
+        self.assertEqual(self.ring.calls[0][:2], ('GET', '/user/info'))
+        self.assertFalse(self.ring.useCache)
+
+if __name__ == '__main__':
+    unittest.main()
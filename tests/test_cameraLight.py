@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Camera light node tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import threading
+import time
+import unittest
+from nodes.cameraLight import CameraLight
+from tools.fakePolyglot import FakeNodeServer
+from tools.fakeRingServer import FakeRingServer
+
+class CameraLightTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeRingServer(doorbells=0, cameras=1).__enter__()
+        self.nodeServer = FakeNodeServer(self.server, { 'coalesce_seconds': '0' }).start()
+        self.ring = self.nodeServer.ring
+        self.light = next(node for node in self.nodeServer.controller.getNodeList() if isinstance(node, CameraLight))
+        self.fetch()
+
+    def tearDown(self):
+        self.nodeServer.stop()
+        self.server.__exit__(None, None, None)
+
+    # Devices data from Ring, not from the response cache
+    def fetch(self):
+        self.ring.responseCache.expireAll()
+        snapshot = self.ring.getDeviceSnapshot()
+        self.light.reconcile(snapshot)
+        return snapshot
+
+    def waitDone(self, timeout=5):
+        deadline = time.monotonic() + timeout
+
+        while (self.light.debounceTimer is not None or self.light.inFlight) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_commandsDebounced(self):
+        for on in [ True, False, True, False, True ]:
+            self.light.command(on)
+
+        self.waitDone()
+        self.assertEqual(self.server.requestCounts.get('PUT /integrations/v1/devices/{id}/floodlight_on'), 1)
+        self.assertIsNone(self.server.requestCounts.get('PUT /integrations/v1/devices/{id}/floodlight_off'))
+        self.assertEqual(self.light.getDriver('ST'), 100)
+
+    def test_reconciledAfterCommand(self):
+        self.light.command(True)
+        self.waitDone()
+
+        # Ring says the light is on
+        self.fetch()
+        self.assertTrue(self.light.confirmed)
+        self.assertIsNone(self.light.commandDoneAt)
+
+    # Devices data requested before the command completed is not used to confirm or roll back the command
+    def test_fetchStartedBeforeCommandIgnored(self):
+        self.server.latency = 0.3
+        self.ring.responseCache.expireAll()
+        results = []
+        fetch = threading.Thread(target=lambda: results.append(self.ring.getDeviceSnapshot()))
+        fetch.start()
+        time.sleep(0.05)
+
+        # The command completes while the fetch is in progress. Ring did not apply it yet.
+        start = self.light.commandSent(True)
+        self.light.commandDone(True, start, True)
+        fetch.join()
+
+        self.light.reconcile(results[0])
+        self.assertEqual(self.light.getDriver('ST'), 100)
+        self.assertIsNotNone(self.light.commandDoneAt)
+
+        # The next fetch is used: Ring still says off
+        self.server.latency = 0
+        self.fetch()
+        self.assertEqual(self.light.getDriver('ST'), 0)
+        self.assertIsNone(self.light.commandDoneAt)
+
+if __name__ == '__main__':
+    unittest.main()
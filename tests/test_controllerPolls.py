@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Controller poll tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import threading
+import time
+import unittest
+import ring
+from datetime import datetime, timedelta
+from tools.fakePolyglot import FakeInterface, FakeNodeServer
+from tools.fakeRingServer import FakeRingServer
+
+class ControllerPollsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeRingServer(doorbells=1, cameras=1).__enter__()
+        self.nodeServer = FakeNodeServer(self.server, { 'accounts': '2', 'full_report_polls': '2', 'poll_stagger_seconds': '0' }).start()
+
+        # Tokens of account 2
+        token = { 'access_token': 'fake-access-token-2', 'refresh_token': 'fake-refresh-token-2', 'expires_in': 3600,
+                  'expiry': (datetime.now() + timedelta(hours=1)).isoformat() }
+        self.nodeServer.poly.publish(FakeInterface.CUSTOMNS, 'oauthTokens2', token)
+        self.nodeServer.discover()
+
+        self.controller = self.nodeServer.controller
+        self.reports = []
+
+        # Records the accounts whose nodes were fully reported
+        for node in self.controller.getNodeList():
+            if hasattr(node, 'queryWithPrefetched'):
+                node.queryWithPrefetched = self.recorder(node, node.queryWithPrefetched)
+
+    def tearDown(self):
+        self.nodeServer.stop()
+        self.server.__exit__(None, None, None)
+
+    def recorder(self, node, query):
+        def record(prefetched, forceReport=False):
+            self.reports.append((node.ring.account, forceReport))
+            return query(prefetched, forceReport)
+
+        return record
+
+    # Nodes queries of the account with all drivers reported
+    def fullReports(self, account):
+        return sum(1 for number, force in self.reports if number == account and force)
+
+    # Driver updates sent to PG3 for the nodes of the devices
+    def nodeUpdates(self, function):
+        updates = []
+        send = self.nodeServer.poly.send
+
+        def record(message, type):
+            if type == 'status':
+                updates.extend(update['driver'] for update in message.get('set', []) if update['address'] != 'controller')
+
+            return send(message, type)
+
+        self.nodeServer.poly.send = record
+
+        try:
+            function()
+        finally:
+            self.nodeServer.poly.send = send
+
+        return updates
+
+    # Only the drivers which changed are reported, except on full reports. Polls are not counted here: No full report.
+    def test_changedDriversOnly(self):
+        first = self.controller.accounts[0]
+        self.controller.queryAll(accounts=[ first ], countPoll=False)
+
+        first.ring.responseCache.expireAll()
+        self.assertEqual(self.nodeUpdates(lambda: self.controller.queryAll(accounts=[ first ], countPoll=False)), [])
+
+        self.server.setOnline(self.server.deviceIds()[0], False)
+        first.ring.responseCache.expireAll()
+        self.assertEqual(self.nodeUpdates(lambda: self.controller.queryAll(accounts=[ first ], countPoll=False)), [ 'ST' ])
+        first.offlineRecheckTimer.cancel()
+
+        # QUERYALL from IoX
+        self.assertGreater(len(self.nodeUpdates(lambda: self.controller.queryAll(param={}, accounts=[ first ]))), 1)
+
+    # Staggered accounts are polled one at a time: Each one still gets its full report every full_report_polls polls
+    def test_fullReportPerAccount(self):
+        first, second = self.controller.accounts
+
+        for poll in range(4):
+            self.controller.queryAll(accounts=[ first ])
+            self.controller.queryAll(accounts=[ second ])
+
+        self.assertEqual(first.pollCount, 4)
+        self.assertEqual(second.pollCount, 4)
+        self.assertGreater(self.fullReports(1), 0)
+        self.assertEqual(self.fullReports(1), self.fullReports(2))
+
+    # Offline rechecks don't count as polls
+    def test_recheckNotCounted(self):
+        first = self.controller.accounts[0]
+
+        self.controller.queryAll(accounts=[ first ])
+        self.controller.queryAll(accounts=[ first ], countPoll=False)
+        self.assertEqual(first.pollCount, 1)
+        self.assertEqual(self.fullReports(1), 0)
+
+        self.controller.queryAll(accounts=[ first ])
+        self.assertGreater(self.fullReports(1), 0)
+
+    # Without adaptive_poll, every short poll refreshes the devices
+    def test_adaptivePollOptIn(self):
+        first = self.controller.accounts[0]
+
+        self.nodeServer.shortPoll()
+        self.nodeServer.shortPoll()
+        self.assertEqual(first.pollCount, 2)
+
+        self.nodeServer.poly.publish(FakeInterface.CUSTOMPARAMS, { **self.nodeServer.customParams, 'adaptive_poll': 'true' })
+        self.nodeServer.shortPoll()
+        self.nodeServer.shortPoll()
+
+        # No device is due yet: Scheduled by the previous polls
+        self.assertEqual(first.pollCount, 2)
+
+    # Accounts without tokens are skipped, the others are still polled
+    def test_pollSkipsUnauthorizedAccount(self):
+        first, second = self.controller.accounts
+        first.ring._oauthTokens.load({})
+        first.ring.tokens.reset()
+
+        self.nodeServer.shortPoll()
+        self.assertEqual(ring.getAuthorizedAccounts(), [ second ])
+        self.assertEqual((first.pollCount, second.pollCount), (0, 1))
+
+    # Polls run on the Polyglot thread and on timers: They must not overlap
+    def test_pollsSerialized(self):
+        first = self.controller.accounts[0]
+        getDeviceSnapshot = first.ring.getDeviceSnapshot
+        active = []
+        overlaps = []
+
+        def slowSnapshot(*args, **kwargs):
+            active.append(1)
+            overlaps.append(len(active) > 1)
+            time.sleep(0.02)
+            active.pop()
+            return getDeviceSnapshot(*args, **kwargs)
+
+        first.ring.getDeviceSnapshot = slowSnapshot
+        threads = [ threading.Thread(target=self.controller.queryAll, kwargs={ 'accounts': [ first ] }) for _ in range(5) ]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(overlaps), 5)
+        self.assertFalse(any(overlaps))
+        self.assertEqual(first.pollCount, 5)
+
+    # A device going offline is rechecked by the timer only: The next short poll doesn't fetch the devices data again
+    def test_offlineRecheckOnly(self):
+        first = self.controller.accounts[0]
+        self.controller.queryAll(accounts=[ first ])
+
+        self.server.setOnline(self.server.deviceIds()[0], False)
+        first.ring.responseCache.expireAll()
+        self.controller.queryAll(accounts=[ first ])
+
+        self.assertIsNotNone(first.offlineRecheckTimer)
+        self.assertFalse(first.scheduler.isDue())
+        first.offlineRecheckTimer.cancel()
+
+if __name__ == '__main__':
+    unittest.main()
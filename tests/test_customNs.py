@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Custom namespace handling tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import unittest
+import ring
+from tools.fakePolyglot import FakeInterface, FakeNodeServer
+from tools.fakeRingServer import FakeRingServer
+
+class CustomNsTest(unittest.TestCase):
+    # PG3 ends getAll with CUSTOMNS(None, None) when there are no tokens yet (New install)
+    def test_noneKeyIgnored(self):
+        with FakeRingServer(doorbells=1, cameras=1) as server, FakeNodeServer(server, authenticated=False) as nodeServer:
+            self.assertNotIn(None, ring.customNs)
+            self.assertFalse(nodeServer.ring.tokens.isAuthorized())
+
+    # The accounts added later get the custom namespaces received so far
+    def test_accountsAddedAfterNoneKey(self):
+        with FakeRingServer(doorbells=1, cameras=1) as server, FakeNodeServer(server, authenticated=False) as nodeServer:
+            nodeServer.poly.publish(FakeInterface.CUSTOMPARAMS, { **nodeServer.customParams, 'accounts': '2', 'coalesce_seconds': '7' })
+            nodeServer.poly.waitIdle()
+
+            self.assertEqual([ account.number for account in nodeServer.controller.accounts ], [ 1, 2 ])
+            self.assertEqual(ring.eventCoalescer.window, 7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Devices data tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import json
+import unittest
+from lib.deviceSnapshot import DeviceSnapshot, DeviceState
+
+payload = json.dumps({
+    'doorbells': [
+        { 'id': 1, 'kind': 'lpd_v2', 'description': 'Front door', 'owner': { 'id': 10, 'email': 'owner@example.com' },
+          'alerts': { 'connection': 'online' }, 'settings': { 'volume': 5 }, 'health': { 'firmware': '1.2.3' } }
+    ],
+    'authorized_doorbells': [
+        { 'id': 2, 'kind': 'doorbell_v3', 'description': 'Shared door', 'owner': { 'id': 20 }, 'alerts': { 'connection': 'offline' } }
+    ],
+    'stickup_cams': [
+        { 'id': 3, 'kind': 'cocoa_floodlight', 'description': 'Garage', 'owner': { 'id': 10 }, 'alerts': { 'connection': 'online' },
+          'led_status': 'on' },
+        { 'id': 4, 'kind': 'stickup_cam_v4', 'description': 'Garden', 'owner': { 'id': 10 }, 'alerts': { 'connection': 'online' },
+          'battery_life': 80, 'battery_life_2': 15, 'battery_voltage': 3900 }
+    ],
+    'chimes': [ { 'id': 5 } ]
+}).encode()
+
+class DeviceSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = DeviceSnapshot.parse(payload)
+
+    def test_parse(self):
+        self.assertEqual(len(self.snapshot), 4)
+        self.assertNotIn(5, self.snapshot)
+        self.assertEqual([ state.id for state in self.snapshot.list(DeviceSnapshot.STICKUP_CAMS) ], [ 3, 4 ])
+
+        doorbell = self.snapshot.get(1)
+        self.assertEqual((doorbell.category, doorbell.ownerId, doorbell.kind, doorbell.description, doorbell.online),
+                         (DeviceSnapshot.DOORBELLS, 10, 'lpd_v2', 'Front door', True))
+        self.assertFalse(doorbell.hasBattery())
+        self.assertIsNone(doorbell.lightOn)
+
+        self.assertFalse(self.snapshot.get(2).online)
+        self.assertTrue(self.snapshot.get(3).lightOn)
+
+        camera = self.snapshot.get(4)
+        self.assertTrue(camera.hasBattery())
+        self.assertEqual(camera.batteryLevels(), [ 80, 15 ])
+        self.assertEqual(camera.batteryVoltage, 3900)
+
+    # The records have no instance dict: Only the fields in __slots__
+    def test_slotted(self):
+        with self.assertRaises(AttributeError):
+            self.snapshot.get(1).settings = {}
+
+    def test_compactFormRoundTrip(self):
+        restored = DeviceSnapshot.fromList(json.loads(json.dumps(self.snapshot.toList())))
+
+        self.assertEqual(repr(restored), repr(self.snapshot))
+        self.assertEqual(restored.list(DeviceSnapshot.AUTHORIZED_DOORBELLS)[0].id, 2)
+
+    def test_missingFields(self):
+        state = DeviceState.fromData({ 'id': 6 }, DeviceSnapshot.STICKUP_CAMS)
+
+        self.assertFalse(state.online)
+        self.assertIsNone(state.ownerId)
+        self.assertEqual(state.batteryLevels(), [])
+
+if __name__ == '__main__':
+    unittest.main()
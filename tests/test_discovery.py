@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Incremental discovery tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import unittest
+from tools.fakePolyglot import FakeNodeServer
+from tools.fakeRingServer import FakeRingServer
+
+class DiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeRingServer(doorbells=1, cameras=2).__enter__()
+        self.nodeServer = FakeNodeServer(self.server).start()
+        self.controller = self.nodeServer.controller
+        self.poly = self.nodeServer.poly
+
+    def tearDown(self):
+        self.nodeServer.stop()
+        self.server.__exit__(None, None, None)
+
+    def discover(self):
+        self.nodeServer.ring.responseCache.expireAll()
+        self.nodeServer.discover()
+
+    def names(self):
+        return { address: node.name for address, node in self.poly.nodes_internal.items() }
+
+    def test_unchangedDevicesKept(self):
+        nodes = dict(self.poly.nodes_internal)
+        self.discover()
+        self.assertEqual(self.poly.nodes_internal, nodes)
+
+    def test_removedDeviceNodesRemoved(self):
+        self.server.removeDevice(200000)
+        self.discover()
+
+        self.assertNotIn('200000_m', self.poly.nodes_internal)
+        self.assertNotIn('200000_lt', self.poly.nodes_internal)
+        self.assertIn('200001_m', self.poly.nodes_internal)
+
+    def test_renamedInRing(self):
+        self.server.updateDevice(200001, description='Backyard')
+        self.discover()
+        self.assertEqual(self.names()['200001_m'], 'Backyard (Motion)')
+
+    # After a restart, the names are compared with those saved by PG3
+    def test_renamedWhileStopped(self):
+        self.controller.discoveredNames.clear()
+        self.server.updateDevice(200001, description='Backyard')
+        self.discover()
+        self.assertEqual(self.names()['200001_m'], 'Backyard (Motion)')
+
+    # Names changed in IoX are kept while the name in Ring does not change
+    def test_nameChangedInIoxKept(self):
+        self.poly.nodes_internal['200001_m'].name = 'Garden camera'
+        self.discover()
+        self.assertEqual(self.names()['200001_m'], 'Garden camera')
+
+if __name__ == '__main__':
+    unittest.main()
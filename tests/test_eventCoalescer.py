@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Event coalescing tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import time
+import unittest
+from lib.eventCoalescer import EventCoalescer
+
+class EventCoalescerTest(unittest.TestCase):
+    def test_burstCoalesced(self):
+        coalescer = EventCoalescer(window=0.1)
+
+        self.assertTrue(coalescer.accept('100_m'))
+        self.assertFalse(coalescer.accept('100_m'))
+
+        # Other nodes are not affected
+        self.assertTrue(coalescer.accept('200_m'))
+
+        time.sleep(0.12)
+        self.assertTrue(coalescer.accept('100_m'))
+        self.assertEqual(coalescer.getStats('100_m'), { 'received': 3, 'accepted': 2, 'coalesced': 1, 'duplicates': 0 })
+
+    def test_duplicatesIgnored(self):
+        coalescer = EventCoalescer(window=0)
+
+        self.assertTrue(coalescer.accept('100_m', eventId=1))
+        self.assertFalse(coalescer.accept('100_m', eventId=1))
+        self.assertTrue(coalescer.accept('100_m', eventId=2))
+        self.assertEqual(coalescer.getStats('100_m')['duplicates'], 1)
+
+    def test_eventIdsBounded(self):
+        coalescer = EventCoalescer(window=0, maxEventIds=2)
+
+        for eventId in range(3):
+            coalescer.accept('100_m', eventId=eventId)
+
+        # The oldest id was forgotten
+        self.assertTrue(coalescer.accept('100_m', eventId=0))
+        self.assertFalse(coalescer.accept('100_m', eventId=2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Event queue tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import threading
+import time
+import unittest
+from lib.eventQueue import EventQueue
+
+class EventQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.handled = []
+        self.release = threading.Event()
+        self.release.set()
+        self.queues = []
+
+    def tearDown(self):
+        self.release.set()
+
+        for eventQueue in self.queues:
+            eventQueue.stop()
+
+    def handler(self, event):
+        self.release.wait(5)
+        self.handled.append(event)
+
+    def makeQueue(self, **kwargs):
+        eventQueue = EventQueue(self.handler, **kwargs)
+        self.queues.append(eventQueue)
+        return eventQueue
+
+    # Events of a device are processed in arrival order, by the same worker
+    def test_orderByKey(self):
+        eventQueue = self.makeQueue(workers=4, maxSize=1000)
+        eventQueue.start()
+
+        for index in range(200):
+            eventQueue.submit(index % 5, (index % 5, index))
+
+        self.assertTrue(eventQueue.waitIdle())
+
+        for key in range(5):
+            indexes = [ index for eventKey, index in self.handled if eventKey == key ]
+            self.assertEqual(indexes, sorted(indexes))
+            self.assertEqual(len(indexes), 40)
+
+    def test_dropOldest(self):
+        eventQueue = self.makeQueue(workers=1, maxSize=3)
+        eventQueue.start()
+        self.release.clear()
+
+        # The first event is taken by the worker, which waits
+        eventQueue.submit(1, 0)
+        time.sleep(0.05)
+
+        for index in range(1, 6):
+            self.assertTrue(eventQueue.submit(1, index))
+
+        self.release.set()
+        self.assertTrue(eventQueue.waitIdle())
+        self.assertEqual(self.handled, [ 0, 3, 4, 5 ])
+        self.assertEqual(eventQueue.getStats()['dropped'], 2)
+
+    def test_dropNewest(self):
+        drops = []
+        eventQueue = self.makeQueue(workers=1, maxSize=3, overflow=EventQueue.DROP_NEWEST, onDrop=lambda: drops.append(1))
+        eventQueue.start()
+        self.release.clear()
+
+        eventQueue.submit(1, 0)
+        time.sleep(0.05)
+
+        results = [ eventQueue.submit(1, index) for index in range(1, 6) ]
+
+        self.release.set()
+        self.assertTrue(eventQueue.waitIdle())
+        self.assertEqual(results, [ True, True, True, False, False ])
+        self.assertEqual(self.handled, [ 0, 1, 2, 3 ])
+        self.assertEqual(len(drops), 2)
+
+    # Events received before start() use the settings configured before start()
+    def test_earlyEventsUseConfiguredSettings(self):
+        eventQueue = self.makeQueue()
+
+        for index in range(5):
+            eventQueue.submit(index, index)
+
+        # Each worker gets one event: Keys 3 and 4 go to the same workers as keys 0 and 1
+        eventQueue.configure(workers=3, maxSize=3, overflow=EventQueue.DROP_NEWEST)
+        eventQueue.start()
+
+        self.assertTrue(eventQueue.waitIdle())
+        self.assertEqual(len(eventQueue._queues), 3)
+        self.assertEqual(sorted(self.handled), [ 0, 1, 2 ])
+        self.assertEqual(eventQueue.getStats()['dropped'], 2)
+
+    def test_handlerErrorCounted(self):
+        eventQueue = EventQueue(lambda event: 1 / event, workers=1)
+        self.queues.append(eventQueue)
+        eventQueue.start()
+
+        eventQueue.submit(1, 0)
+        eventQueue.submit(1, 1)
+
+        self.assertTrue(eventQueue.waitIdle())
+        stats = eventQueue.getStats()
+        self.assertEqual((stats['processed'], stats['failed']), (2, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Adaptive poll scheduler tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import unittest
+from lib.deviceSnapshot import DeviceSnapshot, DeviceState
+from lib.pollScheduler import PollScheduler
+
+def snapshot(*states):
+    return DeviceSnapshot.fromList([ state.toList() for state in states ])
+
+class PollSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = PollScheduler()
+
+    def test_intervals(self):
+        self.assertEqual(self.scheduler.intervalFor(DeviceState(1, online=False, batteryLife=90)), PollScheduler.offlineInterval)
+        self.assertEqual(self.scheduler.intervalFor(DeviceState(1, online=True)), PollScheduler.wiredInterval)
+        self.assertEqual(self.scheduler.intervalFor(DeviceState(1, online=True, batteryLife=90)), PollScheduler.batteryInterval)
+        self.assertEqual(self.scheduler.intervalFor(DeviceState(1, online=True, batteryLife=90, batteryLife2=15)), PollScheduler.lowBatteryInterval)
+        self.assertEqual(self.scheduler.intervalFor(DeviceState(1, online=True, batteryLife='n/a')), PollScheduler.batteryInterval)
+
+    def test_dueUntilFirstUpdate(self):
+        self.assertTrue(self.scheduler.isDue())
+        self.assertEqual(self.scheduler.secondsUntilDue(), 0)
+
+        self.scheduler.update(snapshot(DeviceState(1, online=True, batteryLife=90), DeviceState(2, online=True)))
+        self.assertFalse(self.scheduler.isDue())
+
+        # The earliest device decides
+        self.assertAlmostEqual(self.scheduler.secondsUntilDue(), PollScheduler.batteryInterval, delta=1)
+
+    def test_wentOffline(self):
+        self.assertEqual(self.scheduler.update(snapshot(DeviceState(1, online=True), DeviceState(2, online=False))), [])
+        self.assertEqual(self.scheduler.update(snapshot(DeviceState(1, online=False), DeviceState(2, online=False))), [ 1 ])
+        self.assertAlmostEqual(self.scheduler.secondsUntilDue(), PollScheduler.offlineInterval, delta=1)
+
+    # The offset shifts the first schedule only
+    def test_offset(self):
+        scheduler = PollScheduler(offset=60)
+        devices = snapshot(DeviceState(1, online=True))
+
+        scheduler.update(devices)
+        self.assertAlmostEqual(scheduler.secondsUntilDue(), PollScheduler.wiredInterval + 60, delta=1)
+
+        scheduler.update(devices)
+        self.assertAlmostEqual(scheduler.secondsUntilDue(), PollScheduler.wiredInterval, delta=1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Rate limit, retry policy and circuit breaker tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import time
+import unittest
+import requests
+from lib.retryPolicy import CircuitBreaker, RetryPolicy, TokenBucket
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failureThreshold=3, resetTimeout=0.1)
+
+    def open(self):
+        for failure in range(self.breaker.failureThreshold):
+            opened = self.breaker.recordFailure()
+
+        self.assertTrue(opened)
+        self.assertFalse(self.breaker.allow())
+
+    def test_opensAfterThreshold(self):
+        self.assertFalse(self.breaker.recordFailure())
+        self.assertFalse(self.breaker.recordFailure())
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.recordFailure())
+        self.assertFalse(self.breaker.allow())
+
+    def test_successResetsFailures(self):
+        self.breaker.recordFailure()
+        self.breaker.recordFailure()
+        self.breaker.recordSuccess()
+        self.assertFalse(self.breaker.recordFailure())
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_halfOpenRecovery(self):
+        self.open()
+        time.sleep(0.12)
+
+        # One trial call only
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.recordSuccess()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_halfOpenFailureReopens(self):
+        self.open()
+        time.sleep(0.12)
+
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.recordFailure())
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    # The trial call never reported back: Another trial is allowed after resetTimeout
+    def test_halfOpenTrialExpires(self):
+        self.open()
+        time.sleep(0.12)
+
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        time.sleep(0.12)
+
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burstThenRate(self):
+        bucket = TokenBucket(rate=10, burst=3)
+
+        for call in range(3):
+            self.assertEqual(bucket.tryAcquire(), 0)
+
+        wait = bucket.tryAcquire()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+
+        time.sleep(wait + 0.01)
+        self.assertEqual(bucket.tryAcquire(), 0)
+
+class RetryPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(maxAttempts=3, baseDelay=1, maxDelay=30)
+
+    def httpError(self, status, headers=None):
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers or {})
+        return requests.exceptions.HTTPError(response=response)
+
+    def test_transientErrors(self):
+        self.assertTrue(self.policy.isTransient(self.httpError(503)))
+        self.assertTrue(self.policy.isTransient(requests.exceptions.ConnectionError()))
+        self.assertTrue(self.policy.isTransient(requests.exceptions.ReadTimeout()))
+        self.assertFalse(self.policy.isTransient(self.httpError(401)))
+
+    def test_onlyIdempotentCallsRetried(self):
+        error = self.httpError(502)
+
+        self.assertTrue(self.policy.shouldRetry('GET', None, error, 1))
+        self.assertFalse(self.policy.shouldRetry('POST', None, error, 1))
+        self.assertTrue(self.policy.shouldRetry('PUT', True, error, 1))
+        self.assertFalse(self.policy.shouldRetry('GET', None, error, 3))
+
+    def test_delay(self):
+        for attempt in range(1, 10):
+            self.assertLessEqual(self.policy.delay(attempt), min(30, 2 ** (attempt - 1)))
+
+        self.assertEqual(self.policy.delay(1, self.httpError(429, { 'Retry-After': '7' })), 7)
+        self.assertEqual(self.policy.delay(1, retryAfter='120'), 30)
+        self.assertIsNone(self.policy.parseRetryAfter('soon'))
+
+if __name__ == '__main__':
+    unittest.main()
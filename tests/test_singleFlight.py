@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Single-flight calls tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import threading
+import time
+import unittest
+from lib.singleFlight import SingleFlight
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = 0
+
+    def slowCall(self):
+        self.calls += 1
+        time.sleep(0.1)
+        return self.calls
+
+    def runConcurrently(self, function, count=5):
+        results = []
+        threads = [ threading.Thread(target=lambda: results.append(function())) for _ in range(count) ]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_concurrentCallsShared(self):
+        results = self.runConcurrently(lambda: self.flight.do('/devices', self.slowCall))
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(results), [ (1, False) ] + [ (1, True) ] * 4)
+        self.assertEqual(self.flight.inFlight(), 0)
+
+    def test_laterCallsRunAgain(self):
+        self.assertEqual(self.flight.do('/devices', self.slowCall), (1, False))
+        self.assertEqual(self.flight.do('/devices', self.slowCall), (2, False))
+
+    def test_keysIndependent(self):
+        results = self.runConcurrently(lambda: self.flight.do(threading.current_thread().name, self.slowCall), count=3)
+
+        self.assertEqual(self.calls, 3)
+        self.assertTrue(all(not shared for result, shared in results))
+
+    # The waiting callers get the same exception
+    def test_errorShared(self):
+        def failingCall():
+            time.sleep(0.1)
+            raise ValueError('Not authenticated')
+
+        errors = []
+
+        def call():
+            try:
+                self.flight.do('/devices', failingCall)
+            except ValueError as error:
+                errors.append(error)
+
+        self.runConcurrently(call, count=3)
+
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(len({ id(error) for error in errors }), 1)
+        self.assertEqual(self.flight.inFlight(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - TokenManager tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from lib.tokenManager import TokenManager
+
+# Stand-in for the RingInterface / OAuth class. Like the OAuth class, a failed refresh keeps the current tokens.
+class FakeOAuth:
+    def __init__(self, expiresIn, refreshWorks=False):
+        self.accessToken = 'token-1'
+        self.expiry = (datetime.now() + timedelta(seconds=expiresIn)).isoformat()
+        self.refreshWorks = refreshWorks
+        self.refreshes = 0
+        self.hasRefresh = True
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        self.refreshes += 1
+
+        if self.refreshWorks:
+            self.accessToken = f"token-{ self.refreshes + 1 }"
+            self.expiry = (datetime.now() + timedelta(hours=1)).isoformat()
+
+    def refreshTokens(self):
+        with self._lock:
+            self._refresh()
+            return self.accessToken
+
+    # Refreshes only within 60s of the expiry
+    def getAccessToken(self):
+        with self._lock:
+            if datetime.fromisoformat(self.expiry) - timedelta(seconds=60) < datetime.now():
+                self._refresh()
+
+            return self.accessToken
+
+    def getTokenExpiry(self):
+        return self.expiry
+
+    def hasRefreshToken(self):
+        return self.hasRefresh
+
+class TokenManagerTest(unittest.TestCase):
+    def waitForRefreshes(self, tokens):
+        deadline = time.monotonic() + 2
+
+        while tokens._refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_validToken(self):
+        oauth = FakeOAuth(expiresIn=3600)
+        tokens = TokenManager(oauth)
+
+        self.assertEqual(tokens.getAuthorizationHeader(), 'Bearer token-1')
+        self.assertEqual(tokens.getAuthorizationHeader(), 'Bearer token-1')
+        self.assertEqual(oauth.refreshes, 0)
+
+    def test_expiredTokenFailedRefresh(self):
+        oauth = FakeOAuth(expiresIn=-10)
+        tokens = TokenManager(oauth)
+        deadline = time.monotonic() + 1
+
+        while time.monotonic() < deadline:
+            with self.assertRaises(ValueError):
+                tokens.getAuthorizationHeader()
+
+        # One attempt, then none until the retry delay
+        self.assertEqual(oauth.refreshes, 1)
+        self.assertGreaterEqual(tokens._retryAt - time.monotonic(), TokenManager.retrySeconds - 2)
+
+    def test_backoffDoubles(self):
+        oauth = FakeOAuth(expiresIn=-10)
+        tokens = TokenManager(oauth)
+        delays = []
+
+        for attempt in range(8):
+            tokens._retryAt = 0
+
+            with self.assertRaises(ValueError):
+                tokens.getAuthorizationHeader()
+
+            delays.append(round(tokens._retryAt - time.monotonic()))
+
+        self.assertEqual(oauth.refreshes, 8)
+        self.assertEqual(delays[:3], [ 30, 60, 120 ])
+        self.assertEqual(max(delays), TokenManager.maxRetrySeconds)
+
+    def test_dueTokenFailedRefreshKeepsToken(self):
+        oauth = FakeOAuth(expiresIn=200)
+        tokens = TokenManager(oauth)
+
+        for call in range(100):
+            self.assertEqual(tokens.getAuthorizationHeader(), 'Bearer token-1')
+            self.waitForRefreshes(tokens)
+
+        # The token is loaded, the second call starts a background refresh, which fails: The token is used until the retry delay
+        self.assertEqual(oauth.refreshes, 1)
+
+    def test_dueTokenRefreshed(self):
+        oauth = FakeOAuth(expiresIn=200, refreshWorks=True)
+        tokens = TokenManager(oauth)
+
+        # Loaded, then refreshed in the background on the next call
+        self.assertEqual(tokens.getAuthorizationHeader(), 'Bearer token-1')
+        self.assertEqual(tokens.getAuthorizationHeader(), 'Bearer token-1')
+        self.waitForRefreshes(tokens)
+        self.assertEqual(tokens.getAuthorizationHeader(), 'Bearer token-2')
+        self.assertEqual(tokens._failures, 0)
+
+    def test_resetAllowsRetry(self):
+        oauth = FakeOAuth(expiresIn=-10)
+        tokens = TokenManager(oauth)
+
+        with self.assertRaises(ValueError):
+            tokens.getAuthorizationHeader()
+
+        # New tokens from an authentication
+        oauth.refreshWorks = True
+        tokens.reset()
+
+        self.assertEqual(tokens.getAuthorizationHeader(), 'Bearer token-3')
+
+    # Never refreshes: Used on the Polyglot thread
+    def test_hasTokensUsesCachedState(self):
+        oauth = FakeOAuth(expiresIn=-10)
+        tokens = TokenManager(oauth)
+
+        self.assertTrue(tokens.hasTokens())
+        self.assertEqual(oauth.refreshes, 0)
+
+        oauth.hasRefresh = False
+        self.assertFalse(tokens.hasTokens())
+
+if __name__ == '__main__':
+    unittest.main()
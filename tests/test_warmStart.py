@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Warm start tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import unittest
+from lib.deviceSnapshot import DeviceSnapshot, DeviceState
+from lib.warmStart import WarmStart
+from tools.fakePolyglot import FakeNodeServer
+from tools.fakeRingServer import FakeRingServer
+
+# Stand-in for the Custom class
+class FakeCustom(dict):
+    def delete(self, key):
+        self.pop(key, None)
+
+class FakeAccount:
+    number = 1
+    userId = 1000
+    devices = DeviceSnapshot.fromList([ DeviceState(1, online=True).toList() ])
+
+class FakeNode:
+    address = '1_m'
+    name = 'Camera'
+
+    def __init__(self, value):
+        self.drivers = [ { 'driver': 'ST', 'value': value, 'uom': 2 } ]
+
+class WarmStartTest(unittest.TestCase):
+    def test_saveThrottled(self):
+        warmStart = WarmStart(FakeCustom())
+
+        self.assertTrue(warmStart.save([ FakeAccount() ], [ FakeNode(1) ]))
+
+        # Unchanged: Never saved. Changed: Saved after saveIntervalSeconds, or when forced.
+        self.assertFalse(warmStart.save([ FakeAccount() ], [ FakeNode(1) ], force=True))
+        self.assertFalse(warmStart.save([ FakeAccount() ], [ FakeNode(0) ]))
+        self.assertTrue(warmStart.save([ FakeAccount() ], [ FakeNode(0) ], force=True))
+
+        self.assertEqual(warmStart.get()['nodes'], { '1_m': [ 'FakeNode', 'Camera', { 'ST': 0 } ] })
+
+    def test_otherVersionIgnored(self):
+        warmStart = WarmStart(FakeCustom({ WarmStart.key: { 'version': WarmStart.version - 1, 'accounts': {}, 'nodes': {} } }))
+        self.assertIsNone(warmStart.get())
+
+    # The nodes are restored with their last known state, even if Ring can't be reached
+    def test_restoredWithoutRing(self):
+        with FakeRingServer(doorbells=1, cameras=2) as server:
+            with FakeNodeServer(server) as nodeServer:
+                nodeServer.shortPoll()
+                drivers = { address: list(node.drivers) for address, node in nodeServer.poly.nodes_internal.items() if address != 'controller' }
+
+            customData = nodeServer.poly.custom['customdata']
+
+            # All calls fail: Discovery can't add the nodes
+            server.errorRate = 1
+
+            with FakeNodeServer(server, { 'api_retries': '0' }, customData=customData) as nodeServer:
+                restored = { address: node.drivers for address, node in nodeServer.poly.nodes_internal.items() if address != 'controller' }
+
+        self.assertTrue(drivers)
+        self.assertEqual(restored.keys(), drivers.keys())
+
+        for address, nodeDrivers in drivers.items():
+            self.assertEqual([ driver['value'] for driver in restored[address] ], [ driver['value'] for driver in nodeDrivers ], address)
+
+if __name__ == '__main__':
+    unittest.main()
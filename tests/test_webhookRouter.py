@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Ring events routing tests
+Copyright (C) 2023 Universal Devices
+
+MIT License
+
+Run from the repository root: python -m pytest tests
+"""
+import unittest
+from lib.webhookRouter import WebhookRouter
+
+class FakeRing:
+    def __init__(self, account):
+        self.account = account
+
+# Stand-in for the nodes: Only what the router reads
+class FakeNode:
+    def __init__(self, account, address, deviceId=None):
+        self.ring = FakeRing(account)
+        self.address = address
+
+        if deviceId is not None:
+            self.deviceId = deviceId
+
+class WebhookRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.controller = FakeNode(1, 'controller')
+        self.ding = FakeNode(1, '100_db', 100)
+        self.motion = FakeNode(1, '100_m', 100)
+        self.light = FakeNode(1, '200_lt', 200)
+
+        # Device 100 shared with account 2
+        self.sharedMotion = FakeNode(2, 'b100_m', 100)
+
+        self.router = WebhookRouter()
+        self.router.rebuild([ self.controller, self.ding, self.motion, self.light, self.sharedMotion ])
+
+    def test_routeByEvent(self):
+        self.assertIs(self.router.route(1, 100, 'new-ding'), self.ding)
+        self.assertIs(self.router.route(1, '100', 'new-motion'), self.motion)
+        self.assertIsNone(self.router.route(1, 200, 'new-motion'))
+        self.assertIsNone(self.router.route(1, 100, 'new-on_demand'))
+
+    def test_routeByAccount(self):
+        self.assertIs(self.router.route(2, 100, 'new-motion'), self.sharedMotion)
+        self.assertIsNone(self.router.route(2, 100, 'new-ding'))
+        self.assertTrue(self.router.isKnown(2, 100))
+        self.assertFalse(self.router.isKnown(2, 200))
+
+    # The TEST command uses the node address as device id
+    def test_testEvent(self):
+        self.assertIs(self.router.route(1, 'controller', 'webhook-test'), self.controller)
+        self.assertIsNone(self.router.route(2, 'controller', 'webhook-test'))
+
+    def test_rebuildReplacesRoutes(self):
+        self.router.rebuild([ self.controller ])
+        self.assertIsNone(self.router.route(1, 100, 'new-ding'))
+        self.assertFalse(self.router.isKnown(1, 100))
+        self.assertEqual(len(self.router), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Benchmarks for the poll, discovery and webhook hot paths
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from udi_interface import LOGGER
+import ring
+from lib.deviceSnapshot import DeviceSnapshot
+from tools.fakeRingServer import FakeRingServer
+from tools.fakePolyglot import FakeNodeServer
+
+'''
+Runs the node server hot paths against synthetic accounts of 10, 100 and 1000 devices:
+  getDeviceData    Index the /devices payload and look up every device
+  queryAll         Short poll with a changed /devices payload (Fetch, parse, update all nodes)
+  discoverDevices  Full discovery
+  webhookHandler   Webhook validation on the Polyglot callback thread
+  webhookToDon     Webhook sent by the Ring stand-in until DON is sent to PG3
+
+For each: throughput, p50/p99 latency, memory allocated per operation, and peak RSS.
+
+    python3 -m tools.benchmark --save benchmarks/1.3.0.json
+    python3 -m tools.benchmark --compare benchmarks/1.3.0.json
+'''
+
+defaultSizes = [ 10, 100, 1000 ]
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def peakRssKb():
+    # ru_maxrss is in KB on Linux, in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if platform.system() == 'Darwin' else rss
+
+# Run operation iterations times. Latencies are measured on a first pass, allocations on a second pass
+# (tracemalloc slows down everything it traces).
+def measure(operation, iterations, setup=None):
+    latencies = []
+
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    allocationIterations = max(1, min(iterations, 10))
+
+    for _ in range(allocationIterations):
+        if setup is not None:
+            setup()
+
+        tracemalloc.clear_traces()
+        before = tracemalloc.get_traced_memory()[0]
+        operation()
+        current, peak = tracemalloc.get_traced_memory()
+
+    tracemalloc.stop()
+
+    return result(latencies, peak - before)
+
+def result(latencies, allocatedBytes):
+    total = sum(latencies)
+
+    return {
+        'iterations': len(latencies),
+        'throughput': round(len(latencies) / total, 2) if total else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'alloc_peak_kb': round(allocatedBytes / 1024, 1),
+        'peak_rss_kb': peakRssKb()
+    }
+
+def benchGetDeviceData(server, iterations):
+    payload = server.devices
+    ids = server.deviceIds()
+
+    def operation():
+        snapshot = DeviceSnapshot(payload)
+        for id in ids:
+            ring.ringInterface.getDeviceState(id, snapshot)
+
+    return measure(operation, iterations)
+
+def benchQueryAll(server, nodeServer, iterations):
+    ids = server.deviceIds()
+    counter = [ 0 ]
+
+    # Change one device so that the payload is new and all nodes are updated
+    def setup():
+        counter[0] += 1
+        server.updateDevice(ids[counter[0] % len(ids)], battery_life=counter[0] % 100)
+        nodeServer.ring.responseCache.expireAll()
+
+    return measure(lambda: nodeServer.controller.queryAll(), iterations, setup)
+
+def benchDiscovery(server, nodeServer, iterations):
+    def operation():
+        nodeServer.controller.discoverDevices()
+        nodeServer.poly.waitIdle()
+
+    return measure(operation, iterations, lambda: nodeServer.ring.responseCache.expireAll())
+
+def benchWebhookHandler(server, nodeServer, iterations):
+    pragma = nodeServer.ring.getCurrentPragma()
+    ids = server.deviceIds()
+    counter = [ 0 ]
+
+    def operation():
+        counter[0] += 1
+        id = ids[counter[0] % len(ids)]
+        ring.webhookHandler({
+            'headers': { 'pragma': pragma },
+            'query': {},
+            'body': json.dumps({ 'event': 'new-motion', 'data': { 'id': f"bench-{ counter[0] }", 'doorbell': { 'id': id, 'description': 'Bench' } } })
+        })
+
+    stats = measure(operation, iterations)
+    ring.webhookQueue.waitIdle(60)
+    return stats
+
+def benchWebhookToDon(server, nodeServer, iterations):
+    commandsBefore = len(nodeServer.poly.getCommands())
+
+    start = time.perf_counter()
+    sent = server.sendWebhooks(iterations)
+    commands = nodeServer.waitForCommands(commandsBefore + iterations, timeout=60)[commandsBefore:]
+    elapsed = time.perf_counter() - start
+
+    # Match each DON with the webhook sent for the same device, in order
+    sentByAddress = {}
+    for id, sentAt in sent:
+        sentByAddress.setdefault(id, []).append(sentAt)
+
+    latencies = []
+    for address, cmd, receivedAt in commands:
+        pending = sentByAddress.get(ring.ringInterface.addressToId(address))
+        if pending:
+            latencies.append(receivedAt - pending.pop(0))
+
+    stats = result(latencies or [ elapsed ], 0)
+    stats['throughput'] = round(len(commands) / elapsed, 2)
+    stats['lost'] = iterations - len(commands)
+    del stats['alloc_peak_kb']
+    return stats
+
+def runSize(size, iterations):
+    doorbells = max(1, size // 5)
+    cameras = size - doorbells
+    results = {}
+
+    # Events are not coalesced and the poll is not adaptive (Default): We want every event and every poll to be processed
+    customParams = { 'coalesce_seconds': '0', 'api_rate': '1000', 'api_burst': '1000', 'webhook_queue_size': str(max(100, iterations * 2)) }
+
+    with FakeRingServer(doorbells=doorbells, cameras=cameras, seed=size) as server, FakeNodeServer(server, customParams) as nodeServer:
+        results['getDeviceData'] = benchGetDeviceData(server, iterations)
+        results['queryAll'] = benchQueryAll(server, nodeServer, iterations)
+        results['discoverDevices'] = benchDiscovery(server, nodeServer, max(1, iterations // 5))
+        results['webhookHandler'] = benchWebhookHandler(server, nodeServer, iterations * 10)
+        results['webhookToDon'] = benchWebhookToDon(server, nodeServer, iterations * 2)
+
+    return results
+
+# Compare with a baseline. Returns the list of regressions (p50 slower than threshold)
+def compare(results, baseline, threshold):
+    regressions = []
+
+    for size, benches in results['results'].items():
+        for name, stats in benches.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+
+            if not base or not base.get('p50_ms'):
+                continue
+
+            ratio = stats['p50_ms'] / base['p50_ms']
+            line = f"{ size:>5} devices { name:<16} p50 { stats['p50_ms']:>10} ms  baseline { base['p50_ms']:>10} ms  ({ ratio:.2f}x)"
+            print(line, file=sys.__stdout__)
+
+            if ratio > 1 + threshold:
+                regressions.append(line)
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Ring node server benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=defaultSizes, help='Number of devices of the synthetic accounts')
+    parser.add_argument('--iterations', type=int, default=20, help='Iterations for each benchmark')
+    parser.add_argument('--save', help='Save the results to this JSON file')
+    parser.add_argument('--compare', help='Compare the results with this JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='p50 slowdown reported as a regression (0.25 = 25%%)')
+    parser.add_argument('--log-level', default='WARNING', help='Node server log level during the benchmarks')
+    args = parser.parse_args()
+
+    LOGGER.setLevel(getattr(logging, args.log_level.upper()))
+
+    results = {
+        'version': '1.3.0',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': {}
+    }
+
+    for size in args.sizes:
+        results['results'][str(size)] = runSize(size, args.iterations)
+
+    print(json.dumps(results, indent=2), file=sys.__stdout__)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+
+        if regressions:
+            print(f"{ len(regressions) } regression(s)", file=sys.__stdout__)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
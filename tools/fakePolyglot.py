@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Stand-in for the Polyglot interface, to run the node server without PG3
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from udi_interface import Custom, Interface
+
+# The node server modules are at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ring
+
+'''
+Replaces udi_interface.Interface: No MQTT connection to PG3.
+- Events are dispatched in order on a single thread, like the real interface
+- Messages sent to PG3 are recorded: Driver updates, commands sent (DON...), nodes added/removed
+'''
+class FakeInterface:
+    # Same event names as the real interface
+    CONFIG = Interface.CONFIG
+    START = Interface.START
+    STOP = Interface.STOP
+    ADDNODEDONE = Interface.ADDNODEDONE
+    CUSTOMDATA = Interface.CUSTOMDATA
+    CUSTOMPARAMS = Interface.CUSTOMPARAMS
+    CUSTOMNS = Interface.CUSTOMNS
+    POLL = Interface.POLL
+    CONFIGDONE = Interface.CONFIGDONE
+    OAUTH = Interface.OAUTH
+    WEBHOOK = Interface.WEBHOOK
+    DELNODEDONE = Interface.DELNODEDONE
+
+    def __init__(self, uuid='00:0d:b9:00:00:00', profileNum=3):
+        self.uuid = uuid
+        self.profileNum = str(profileNum)
+        self.nodes_internal = {}
+        self.Notices = Custom(self, 'notices')
+
+        self._subscribers = {}
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='fakePolyglot', daemon=True)
+        self._dispatcher.start()
+
+        self.statusCount = 0
+        self.drivers = {}
+        self.commands = []
+        self.custom = {}
+        self.stopped = False
+
+    # ---- Events ----
+
+    def subscribe(self, topic, callback, address=None):
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    # Queue an event for the subscribers, like a message received from PG3
+    def publish(self, topic, *args):
+        self._events.put((topic, args))
+
+    # Wait until all queued events are processed
+    def waitIdle(self):
+        self._events.join()
+
+    def _dispatch(self):
+        while True:
+            topic, args = self._events.get()
+
+            try:
+                for callback in self._subscribers.get(topic, []):
+                    callback(*args)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+            finally:
+                self._events.task_done()
+
+    # ---- Interface API used by the node server ----
+
+    def start(self, version=None):
+        pass
+
+    def ready(self):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+    def setCustomParamsDoc(self, html=None):
+        pass
+
+    def updateProfile(self):
+        pass
+
+    def webhookStart(self, config=None):
+        pass
+
+    def getConfig(self):
+        return { 'uuid': self.uuid, 'profileNum': self.profileNum, 'store': 'local' }
+
+    def db_getNodeDrivers(self, addr=None, init=False):
+        return []
+
+    # Nodes saved by PG3: The nodes added so far
+    def getNodesFromDb(self, addr=None):
+        return [ { 'address': node.address, 'name': node.name } for node in list(self.nodes_internal.values()) ]
+
+    def addNode(self, node, conn_status=None, rename=False):
+        self.nodes_internal[node.address] = node
+        self.publish(self.ADDNODEDONE, { 'address': node.address })
+        return node
+
+    def delNode(self, address):
+        self.nodes_internal.pop(address, None)
+        self.publish(self.DELNODEDONE, { 'address': address })
+
+    def renameNode(self, address, newname):
+        if address in self.nodes_internal:
+            self.nodes_internal[address].name = newname
+
+    def getNode(self, address):
+        return self.nodes_internal.get(address)
+
+    def getNodes(self):
+        return self.nodes_internal
+
+    # Iterates the live dict, like the real Interface
+    def nodes(self):
+        for address in self.nodes_internal:
+            yield self.nodes_internal[address]
+
+    def setController(self, node_addr, driver):
+        pass
+
+    # Messages to PG3 are recorded
+    def send(self, message, type):
+        now = time.perf_counter()
+
+        with self._lock:
+            if type == 'status':
+                for update in message.get('set', []):
+                    self.statusCount += 1
+                    self.drivers[(update['address'], update['driver'])] = update['value']
+            elif type == 'command':
+                for command in message.get('command', []):
+                    self.commands.append((command['address'], command['cmd'], now))
+            elif type == 'custom':
+                for update in message.get('set', []):
+                    self.custom[update['key']] = update['value']
+
+    def getDriverValue(self, address, driver):
+        with self._lock:
+            return self.drivers.get((address, driver))
+
+    def getCommands(self):
+        with self._lock:
+            return list(self.commands)
+
+'''
+Runs the node server (ring.py) against a FakeInterface and a FakeRingServer.
+
+    with FakeRingServer(doorbells=2, cameras=10) as server, FakeNodeServer(server) as nodeServer:
+        nodeServer.shortPoll()
+        server.sendWebhooks(10)
+        nodeServer.waitForCommands(10)
+'''
+class FakeNodeServer:
+    # customData: Custom data saved by a previous run (poly.custom['customdata']), to test the warm start
+    # authenticated: False to start like a new install, without tokens
+    def __init__(self, server, customParams=None, customData=None, authenticated=True):
+        self.server = server
+        self.customData = customData
+        self.authenticated = authenticated
+        self.customParams = {
+            'api_base_url': server.apiBaseUrl,
+            'postback_base_url': server.baseUrl,
+            **(customParams or {})
+        }
+        self.poly = None
+
+    def start(self):
+        self.poly = FakeInterface()
+
+        ring.polyglot = self.poly
+        ring.initialize()
+
+        self.ring = ring.ringInterface
+        self.controller = ring.controller
+
+        # Webhooks received by the Portal stand-in go to the node server as PG3 would send them
+        self.server.webhookCallback = lambda data: self.poly.publish(FakeInterface.WEBHOOK, data)
+
+        token = {
+            'access_token': 'fake-access-token',
+            'refresh_token': 'fake-refresh-token',
+            'expires_in': 3600,
+            'expiry': (datetime.now() + timedelta(hours=1)).isoformat()
+        }
+
+        self.poly.publish(FakeInterface.CUSTOMDATA, self.customData)
+        self.poly.publish(FakeInterface.CUSTOMPARAMS, self.customParams)
+
+        if self.authenticated:
+            self.poly.publish(FakeInterface.CUSTOMNS, 'oauthTokens', token)
+        else:
+            # PG3 ends getAll with this when the node server has no custom namespace
+            self.poly.publish(FakeInterface.CUSTOMNS, None, None)
+
+        self.poly.publish(FakeInterface.CONFIGDONE)
+        self.waitStarted()
+        return self
+
+    # Discovery and subscription run in the background after CONFIGDONE
+    def waitStarted(self, timeout=60):
+        self.poly.waitIdle()
+
+        if ring.startupThread is not None:
+            ring.startupThread.join(timeout)
+
+        self.poly.waitIdle()
+
+    def stop(self):
+        self.poly.publish(FakeInterface.STOP)
+        self.poly.waitIdle()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def shortPoll(self):
+        self.poly.publish(FakeInterface.POLL, 'shortPoll')
+        self.poly.waitIdle()
+
+    def longPoll(self):
+        self.poly.publish(FakeInterface.POLL, 'longPoll')
+        self.poly.waitIdle()
+
+    def discover(self):
+        self.controller.discoverDevices()
+        self.poly.waitIdle()
+
+    # Wait until count commands (DON...) were sent to PG3. Returns the commands.
+    def waitForCommands(self, count, timeout=10):
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            commands = self.poly.getCommands()
+            if len(commands) >= count:
+                return commands
+            time.sleep(0.005)
+
+        return self.poly.getCommands()
+
+if __name__ == "__main__":
+    from tools.fakeRingServer import FakeRingServer
+
+    # Smoke run: discovery, a short poll and a few webhooks
+    with FakeRingServer(doorbells=2, cameras=4) as server, FakeNodeServer(server, { 'coalesce_seconds': '0' }) as nodeServer:
+        nodeServer.shortPoll()
+        server.sendWebhooks(6)
+        commands = nodeServer.waitForCommands(6)
+
+        print(f"Nodes: { len(nodeServer.poly.nodes_internal) }", file=sys.__stdout__)
+        print(f"Driver updates: { nodeServer.poly.statusCount }", file=sys.__stdout__)
+        print(f"Commands: { len(commands) }", file=sys.__stdout__)
+        print(f"Ring API requests: { server.requestCounts }", file=sys.__stdout__)
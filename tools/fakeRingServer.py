@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 - Local stand-in for the Ring API and the Portal webhook relay
+Copyright (C) 2023 Universal Devices
+
+MIT License
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+'''
+Local Ring API and Portal webhook relay, used to benchmark and test the node server without network.
+
+Ring API (Under /integrations/v1):
+  GET    /user/info
+  GET    /devices                          Supports ETag / If-None-Match
+  PATCH  /subscription
+  DELETE /subscription
+  PUT    /devices/{id}/floodlight_on|off
+
+Portal webhook relay:
+  POST   /api/eisy/pg3/webhook/noresponse/{uuid}/{slot}
+         The webhook is passed to webhookCallback as PG3 does: { headers, query, body }
+
+Point the node server to it with the custom params:
+  api_base_url = server.apiBaseUrl
+  postback_base_url = server.baseUrl
+'''
+class FakeRingServer:
+    userId = 1000
+
+    def __init__(self, doorbells=1, cameras=1, latency=0, errorRate=0, host='127.0.0.1', port=0, seed=None):
+        self.latency = latency
+        self.errorRate = errorRate
+        self.webhookCallback = None
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._payload = None
+        self._etag = None
+
+        self.subscription = None
+        self.floodlights = {}
+        self.requestCounts = {}
+
+        self.devices = { 'doorbells': [], 'authorized_doorbells': [], 'stickup_cams': [] }
+        self._generateDevices(doorbells, cameras)
+
+        self._server = ThreadingHTTPServer((host, port), self._handlerClass())
+        self._server.daemon_threads = True
+        self._thread = None
+        self._webhookSession = requests.Session()
+
+    @property
+    def baseUrl(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{ host }:{ port }"
+
+    @property
+    def apiBaseUrl(self):
+        return self.baseUrl + '/integrations/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fakeRingServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._webhookSession.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # ---- Simulated account ----
+
+    def _generateDevices(self, doorbells, cameras):
+        for index in range(doorbells):
+            self.devices['doorbells'].append(self._device(100000 + index, 'lpd_v2', f"Doorbell { index }", battery=False))
+
+        for index in range(cameras):
+            # Alternate wired floodlights and battery cameras
+            if index % 2 == 0:
+                device = self._device(200000 + index, 'cocoa_floodlight', f"Floodlight { index }", battery=False)
+                device['led_status'] = 'off'
+            else:
+                device = self._device(200000 + index, 'stickup_cam_v4', f"Camera { index }", battery=True)
+
+            self.devices['stickup_cams'].append(device)
+
+    def _device(self, id, kind, description, battery):
+        device = {
+            'id': id,
+            'kind': kind,
+            'description': description,
+            'owner': { 'id': self.userId, 'email': 'owner@example.com' },
+            'alerts': { 'connection': 'online' },
+            # Fields which are in the real payload, but not used by the node server
+            'settings': { key: self._random.randint(0, 100) for key in ('motion_sensitivity', 'volume', 'chime_volume', 'exposure', 'contrast') },
+            'features': { feature: True for feature in ('motions_enabled', 'show_recordings', 'advanced_motion_enabled', 'people_only_enabled') },
+            'health': { 'wifi_name': 'home', 'latest_signal_strength': -self._random.randint(40, 80), 'firmware': '1.2.3' }
+        }
+
+        if battery:
+            device['battery_life'] = self._random.randint(5, 100)
+            device['battery_voltage'] = self._random.randint(3500, 4200)
+
+        return device
+
+    def allDevices(self):
+        return self.devices['doorbells'] + self.devices['authorized_doorbells'] + self.devices['stickup_cams']
+
+    def deviceIds(self):
+        return [ device['id'] for device in self.allDevices() ]
+
+    # Change device data. The /devices payload will change accordingly.
+    def updateDevice(self, id, **fields):
+        with self._lock:
+            device = next(d for d in self.allDevices() if d['id'] == id)
+            device.update(fields)
+            self._payload = None
+
+    # Remove a device from the account (Sold, moved to another account...)
+    def removeDevice(self, id):
+        with self._lock:
+            for devices in self.devices.values():
+                devices[:] = [ device for device in devices if device['id'] != id ]
+
+            self._payload = None
+
+    def setOnline(self, id, online):
+        self.updateDevice(id, alerts={ 'connection': 'online' if online else 'offline' })
+
+    # Must be called with the lock acquired
+    def _devicesPayload(self):
+        if self._payload is None:
+            self._payload = json.dumps(self.devices).encode()
+            self._etag = '"' + hashlib.sha1(self._payload).hexdigest() + '"'
+
+        return self._payload, self._etag
+
+    # ---- Webhooks ----
+
+    # Send webhooks as Ring would, to the subscription postback url, with the subscription headers
+    # Returns the list of (address suffix, send time) sent
+    def sendWebhooks(self, count=1, event='new-motion', deviceIds=None, interval=0):
+        if self.subscription is None:
+            raise Exception('No subscription')
+
+        deviceIds = deviceIds or self.deviceIds()
+        sent = []
+
+        for index in range(count):
+            id = deviceIds[index % len(deviceIds)]
+            device = next(d for d in self.allDevices() if d['id'] == id)
+            body = {
+                'event': event,
+                'data': {
+                    'id': f"{ id }-{ time.time_ns() }-{ index }",
+                    'doorbell': { 'id': id, 'description': device['description'] }
+                }
+            }
+
+            sentAt = time.perf_counter()
+            self._webhookSession.post(self.subscription['postback_url'], headers=self.subscription['headers'], json=body, timeout=5)
+            sent.append((id, sentAt))
+
+            if interval:
+                time.sleep(interval)
+
+        return sent
+
+    # ---- HTTP handling ----
+
+    def _count(self, key):
+        with self._lock:
+            self.requestCounts[key] = self.requestCounts.get(key, 0) + 1
+
+    def _handlerClass(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            # Send headers and body in one packet: Avoids the delayed ACK stalls of keep-alive connections
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server._handle(self, 'GET')
+
+            def do_PATCH(self):
+                server._handle(self, 'PATCH')
+
+            def do_PUT(self):
+                server._handle(self, 'PUT')
+
+            def do_DELETE(self):
+                server._handle(self, 'DELETE')
+
+            def do_POST(self):
+                server._handle(self, 'POST')
+
+        return Handler
+
+    def _handle(self, handler, method):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        path = handler.path.split('?')[0]
+
+        if path.startswith('/api/eisy/pg3/webhook/'):
+            self._count('POST webhook')
+            return self._relayWebhook(handler, body)
+
+        self._count(f"{ method } { re.sub(r'/[0-9]+/', '/{id}/', path) }")
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.errorRate and self._random.random() < self.errorRate:
+            return self._send(handler, 503, { 'error': 'Simulated failure' })
+
+        if not handler.headers.get('Authorization', '').startswith('Bearer '):
+            return self._send(handler, 401, { 'message': 'Unauthorized access' })
+
+        path = path[len('/integrations/v1'):] if path.startswith('/integrations/v1') else path
+
+        if method == 'GET' and path == '/user/info':
+            return self._send(handler, 200, { 'user': { 'id': self.userId } })
+
+        if method == 'GET' and path == '/devices':
+            with self._lock:
+                payload, etag = self._devicesPayload()
+
+            if handler.headers.get('If-None-Match') == etag:
+                return self._sendRaw(handler, 304, b'', { 'ETag': etag })
+
+            return self._sendRaw(handler, 200, payload, { 'ETag': etag, 'Content-Type': 'application/json' })
+
+        if method == 'PATCH' and path == '/subscription':
+            subscription = json.loads(body)['subscription']
+            self.subscription = {
+                'postback_url': subscription['postback_url'],
+                'headers': subscription.get('metadata', {}).get('headers', {})
+            }
+            return self._send(handler, 200, { 'subscription': subscription })
+
+        if method == 'DELETE' and path == '/subscription':
+            self.subscription = None
+            return self._sendRaw(handler, 204, b'')
+
+        match = re.fullmatch(r'/devices/([0-9]+)/floodlight_(on|off)', path)
+        if method == 'PUT' and match:
+            id = int(match.group(1))
+            self.floodlights[id] = match.group(2) == 'on'
+
+            if id in self.deviceIds():
+                self.updateDevice(id, led_status=match.group(2))
+
+            return self._sendRaw(handler, 204, b'')
+
+        return self._send(handler, 404, { 'error': 'Not found' })
+
+    # Portal relay: Pass the webhook to the node server the way PG3 does
+    def _relayWebhook(self, handler, body):
+        if self.webhookCallback is None:
+            return self._send(handler, 503, { 'error': 'Node server not connected' })
+
+        data = {
+            'headers': { key.lower(): value for key, value in handler.headers.items() },
+            'query': {},
+            'body': body.decode()
+        }
+
+        self._sendRaw(handler, 200, b'')
+        self.webhookCallback(data)
+
+    def _send(self, handler, status, data):
+        self._sendRaw(handler, status, json.dumps(data).encode(), { 'Content-Type': 'application/json' })
+
+    def _sendRaw(self, handler, status, payload, headers=None):
+        handler.send_response(status)
+
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)